@@ -0,0 +1,148 @@
+"""
+Benchmark of ACL parsing, effective ACL building and permission checks.
+
+Generates ACL strings of growing size with mixed allow/deny ACEs,
+special principals and callable principals, and measures:
+    * parse: `parse_acl` of ACL string;
+    * compile: `CompiledACL` build of parsed ACL;
+    * effective: `BaseACL._apply_callables` of parsed (list) and
+      compiled ACLs, i.e. effective ACL build done by `__acl__`
+      and `generate_item_acl`;
+    * checks: permission checks per second of static ACLs made by
+      Pyramid `ACLAuthorizationPolicy` and by
+      `CompiledACLAuthorizationPolicy`, which decides on static compiled
+      ACLs using their decision tables.
+
+Decisions of both policies are compared on every check and mismatches
+are reported.
+
+Usage:
+    python benchmarks/acl.py [max number of ACEs] [repeat]
+"""
+import sys
+import random
+import timeit
+
+from mock import Mock
+from pyramid.authorization import ACLAuthorizationPolicy
+from pyramid.security import Everyone, Authenticated
+
+from ramses import acl, registry
+
+
+PRINCIPALS = [
+    'everyone', 'authenticated', 'g:admin', 'g:staff', 'g:editors',
+    '{{bench_owner}}', '{{bench_staff}}']
+PERMISSIONS = sorted(set(acl.PERMISSIONS.values()))
+CHECKS = 1000
+
+
+@registry.add
+def bench_owner(ace, request, obj):
+    return (ace[0], 'u:{}'.format(obj), ace[2])
+
+
+@registry.add
+@acl.request_principal
+def bench_staff(ace, request, obj):
+    return (ace[0], 'g:staff', ace[2])
+
+
+def make_acl_string(rng, size):
+    aces = []
+    for index in range(size):
+        if rng.random() < 0.1:
+            perms = 'all'
+        else:
+            perms = ','.join(rng.sample(PERMISSIONS, rng.randint(1, 3)))
+        principal = rng.choice(PRINCIPALS + ['u:{}'.format(index)])
+        aces.append('{} {} {}'.format(
+            rng.choice(['allow', 'deny']), principal, perms))
+    return '\n'.join(aces)
+
+
+def make_principal_sets(rng, count):
+    pool = [Authenticated, 'g:admin', 'g:staff', 'g:editors', 'u:1', 'u:7']
+    return [
+        [Everyone] + [p for p in pool if rng.random() < 0.3]
+        for _ in range(count)]
+
+
+def make_context(acl_value):
+    context = type('Context', (object,), {})()
+    context.__acl__ = acl_value
+    return context
+
+
+def best(func, repeat, number=1):
+    return min(timeit.Timer(func).repeat(repeat, number)) / number
+
+
+def run(max_size, repeat):
+    rng = random.Random(0)
+    principal_sets = make_principal_sets(rng, 50)
+    checks = [
+        (rng.choice(principal_sets), rng.choice(PERMISSIONS))
+        for _ in range(CHECKS)]
+    policy = ACLAuthorizationPolicy()
+    compiled_policy = acl.CompiledACLAuthorizationPolicy()
+    print('{:>5} {:>10} {:>10} {:>12} {:>12} {:>12} {:>12} {:>10}'.format(
+        'aces', 'parse us', 'compile us', 'list acl us', 'compiled us',
+        'pyramid/s', 'compiled/s', 'mismatch'))
+
+    size = 1
+    while size <= max_size:
+        acl_string = make_acl_string(rng, size)
+
+        def parse():
+            acl._parsed_acls.clear()
+            return acl.parse_acl(acl_string)
+        parsed = parse()
+        parse_time = best(parse, repeat, 100)
+        compile_time = best(lambda: acl.CompiledACL(parsed), repeat, 100)
+        compiled = acl.CompiledACL(parsed)
+
+        base = acl.BaseACL(Mock(_ramses_cache=None))
+        list_time = best(
+            lambda: base._apply_callables(acl=parsed, obj=1), repeat, 100)
+        compiled_time = best(
+            lambda: base._apply_callables(acl=compiled, obj=1), repeat, 100)
+
+        static = [ace for ace in parsed if not callable(ace[1])]
+        context = make_context(static)
+        compiled_context = make_context(acl.CompiledACL(static))
+
+        def check_pyramid():
+            for principals, permission in checks:
+                policy.permits(context, principals, permission)
+
+        def check_compiled():
+            for principals, permission in checks:
+                compiled_policy.permits(
+                    compiled_context, principals, permission)
+        throughput = {
+            'pyramid': CHECKS / best(check_pyramid, repeat),
+            'compiled': CHECKS / best(check_compiled, repeat),
+        }
+
+        mismatches = 0
+        for principals, permission in checks:
+            expected = policy.permits(context, principals, permission)
+            result = compiled_policy.permits(
+                compiled_context, principals, permission)
+            if bool(expected) != bool(result) or expected.ace != result.ace:
+                mismatches += 1
+
+        print('{:>5} {:>10.1f} {:>10.1f} {:>12.1f} {:>12.1f} '
+              '{:>12.0f} {:>12.0f} {:>10}'.format(
+                  size, parse_time * 1e6, compile_time * 1e6,
+                  list_time * 1e6, compiled_time * 1e6,
+                  throughput['pyramid'], throughput['compiled'],
+                  mismatches))
+        size *= 2
+
+
+if __name__ == '__main__':
+    max_size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    run(max_size, repeat)
@@ -0,0 +1,120 @@
+"""
+Benchmark of privacy serialization of collection listings.
+
+Serializes listings of documents with a nested relationship using
+nefertari `apply_privacy` wrapper and `apply_compiled_privacy` wrapper
+of precompiled serializers, for public, authenticated and admin users,
+and checks that both wrappers produce the same output.
+
+Usage:
+    python benchmarks/serializers.py [number of items] [repeat]
+"""
+import sys
+import copy
+import timeit
+
+from mock import Mock, patch
+from nefertari import wrappers
+
+from ramses import serializers
+
+
+class User(object):
+    _public_fields = ['username']
+    _auth_fields = ['username', 'email', 'first_name', 'last_name']
+    _hidden_fields = ['password']
+    _nested_relationships = []
+
+    def __init__(self, username, admin=False):
+        self.username = username
+        self.admin = admin
+
+    @classmethod
+    def pk_field(cls):
+        return 'username'
+
+    @classmethod
+    def is_admin(cls, user):
+        return user.admin
+
+
+class Story(object):
+    _public_fields = ['id', 'name', 'owner']
+    _auth_fields = [
+        'id', 'name', 'description', 'status', 'created_at', 'owner',
+        'tags', 'score']
+    _hidden_fields = ['secret']
+    _nested_relationships = ['owner']
+
+
+MODELS = {'User': User, 'Story': Story}
+
+
+def make_listing(size):
+    return {
+        'total': size,
+        'count': size,
+        'data': [{
+            '_type': 'Story', '_pk': str(index),
+            '_self': 'http://example.com/stories/{}'.format(index),
+            'id': index, 'name': 'story {}'.format(index),
+            'description': 'description', 'status': 'active',
+            'created_at': '2015-01-01T00:00:00', 'secret': 'secret',
+            'tags': ['a', 'b'], 'score': index * 1.5, 'views': index,
+            'owner': {
+                '_type': 'User', '_pk': 'user{}'.format(index % 50),
+                'username': 'user{}'.format(index % 50),
+                'email': 'user@example.com', 'first_name': 'First',
+                'last_name': 'Last', 'password': 'hash',
+            },
+        } for index in range(size)],
+    }
+
+
+def best(func, repeat):
+    return min(timeit.Timer(func).repeat(repeat, 1))
+
+
+def run(size, repeat):
+    for model_cls in MODELS.values():
+        serializers.compile_serializers(model_cls)
+    listing = make_listing(size)
+    users = (
+        ('public', None),
+        ('authenticated', User('someone')),
+        ('admin', User('root', admin=True)),
+    )
+    print('{:>14} {:>8} {:>14} {:>14} {:>8} {:>6}'.format(
+        'audience', 'items', 'nefertari ms', 'compiled ms', 'speedup',
+        'equal'))
+
+    get_document_cls = Mock(side_effect=MODELS.__getitem__)
+    with patch.object(wrappers, 'engine', Mock(
+            get_document_cls=get_document_cls)):
+        for audience, user in users:
+            request = Mock(user=user)
+            wrapper_classes = (
+                ('nefertari', wrappers.apply_privacy),
+                ('compiled', serializers.apply_compiled_privacy),
+            )
+            times, results = {}, {}
+            for name, wrapper_cls in wrapper_classes:
+                # Wrappers change 'data' of listing in place
+                inputs = [copy.deepcopy(listing) for _ in range(repeat)]
+
+                def serialize():
+                    return wrapper_cls(request)(result=inputs.pop())
+                times[name] = best(serialize, repeat)
+                results[name] = wrapper_cls(request)(
+                    result=copy.deepcopy(listing))
+            print('{:>14} {:>8} {:>14.1f} {:>14.1f} {:>7.1f}x {:>6}'.format(
+                audience, size, times['nefertari'] * 1e3,
+                times['compiled'] * 1e3,
+                times['nefertari'] / times['compiled'],
+                str(results['nefertari'] == results['compiled'])))
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    run(size, repeat)
@@ -12,15 +12,22 @@ log = logging.getLogger(__name__)
 def includeme(config):
     from .generators import generate_server, generate_models
     Settings = dictset(config.registry.settings)
+    if Settings.asbool('metrics.enable'):
+        # DB calls are only counted on connections made after this
+        config.include('ramses.metrics')
     config.include('nefertari.engine')
 
     config.registry.database_acls = Settings.asbool('database_acls')
     if config.registry.database_acls:
         config.include('nefertari_guards')
+    config.registry.atomic_iterables = Settings.asbool('atomic_iterables')
+    if Settings.get('db_replicas.urls'):
+        config.include('ramses.replicas')
 
     config.include('nefertari')
     config.include('nefertari.view')
     config.include('nefertari.json_httpexceptions')
+    config.include('ramses.cache')
 
     # Process nefertari settings
     if Settings.asbool('enable_get_tunneling'):
@@ -35,6 +42,9 @@ def includeme(config):
     if Settings.asbool('request_timing.enable'):
         config.add_tween('nefertari.tweens.request_timing')
 
+    if Settings.asbool('server_timing.enable'):
+        config.include('ramses.timing')
+
     # Set root factory
     config.root_factory = NefertariRootACL
 
@@ -48,6 +58,9 @@ def includeme(config):
     log.info('Starting models generation')
     generate_models(config, raml_resources=raml_root.resources)
 
+    if Settings.asbool('password_pool.enable'):
+        config.include('ramses.passwords')
+
     if root_auth:
         from .auth import setup_auth_policies, get_authuser_model
         if getattr(config.registry, 'auth_model', None) is None:
@@ -55,6 +68,17 @@ def includeme(config):
         setup_auth_policies(config, raml_root)
 
     config.include('nefertari.elasticsearch')
+    # Client has to be rebuilt before its methods are wrapped below
+    config.include('ramses.esclient')
+    if Settings.asbool('es_write_behind.enable'):
+        config.include('ramses.indexing')
+    if Settings.asbool('metrics.enable'):
+        # Slow log has to wrap the counter to see callers of ES client
+        from nefertari.elasticsearch import ES
+        from .metrics import count_es_calls
+        count_es_calls(ES.api, config.registry.metrics)
+    if Settings.get('es_slow_log.threshold_ms'):
+        config.include('ramses.slowlog')
 
     log.info('Starting server generation')
     generate_server(raml_root, config)
@@ -69,4 +93,10 @@ def includeme(config):
     if root_auth:
         config.include('ramses.auth')
 
+    if Settings.asbool('profiler.enable'):
+        if root_auth:
+            config.include('ramses.profiler')
+        else:
+            log.warning('Profiler is not enabled: it requires RAML auth')
+
     log.info('Server succesfully generated\n')
\ No newline at end of file
@@ -2,15 +2,21 @@
 import logging
 
 import six
+from pyramid.authorization import ACLAuthorizationPolicy
+from pyramid.location import lineage
 from pyramid.security import (
     Allow, Deny,
     Everyone, Authenticated,
-    ALL_PERMISSIONS)
+    ALL_PERMISSIONS, ACLAllowed, ACLDenied)
 from nefertari.acl import CollectionACL
 from nefertari.resource import PERMISSIONS
 from nefertari.elasticsearch import ES
 
 from .utils import resolve_to_callable, is_callable_tag
+from .cache import get_identity_map, get_request_cache
+from .metrics import record_cache
+from .esclient import get_es_accessor
+from .timing import timed_method
 
 
 log = logging.getLogger(__name__)
@@ -26,6 +32,18 @@ special_principals = {
 }
 ALLOW_ALL = (Allow, Everyone, ALL_PERMISSIONS)
 
+""" Map of {ACL key: parsed ACL} used to share identical parsed ACLs """
+_parsed_acls = {}
+
+""" Map of {ACL key: compiled ACL} used to share decision tables """
+_compiled_acls = {}
+
+""" Map of {structural key: ACL class} of generated ACL classes """
+_acl_classes = {}
+
+""" Map of {DecisionTable: stringified ACEs} of static item ACL parts """
+_stringified_tables = {}
+
 
 def validate_permissions(perms):
     """ Validate :perms: contains valid permissions.
@@ -59,6 +77,39 @@ def parse_permissions(perms):
     return validate_permissions(perms)
 
 
+def _perms_key(perms):
+    if isinstance(perms, (list, tuple)):
+        return tuple(perms)
+    # ALL_PERMISSIONS is not hashable
+    if perms == ALL_PERMISSIONS:
+        return 'ALL_PERMISSIONS'
+    return perms
+
+
+def _acl_key(acl):
+    """ Get hashable key of parsed :acl: """
+    return tuple(
+        (action, principal, _perms_key(perms))
+        for action, principal, perms in acl)
+
+
+def intern_acl(acl):
+    """ Get shared instance of parsed ACL that is identical to :acl:.
+
+    Shared ACLs are tuples of ACEs whose permission lists are converted
+    to tuples, so they can't be changed by their users.
+
+    :param acl: List of ACEs as returned by `parse_acl`.
+    """
+    key = _acl_key(acl)
+    if key not in _parsed_acls:
+        _parsed_acls[key] = tuple(
+            (action, principal,
+             tuple(perms) if isinstance(perms, list) else perms)
+            for action, principal, perms in acl)
+    return _parsed_acls[key]
+
+
 def parse_acl(acl_string):
     """ Parse raw string :acl_string: of RAML-defined ACLs.
 
@@ -72,10 +123,12 @@ def parse_acl(acl_string):
     Permissions must be comma-separated.
     E.g. 'allow everyone view,create,update' and 'deny authenticated delete'
 
+    Identical parsed ACLs are shared (see `intern_acl`).
+
     :param acl_string: Raw RAML string containing defined ACEs.
     """
     if not acl_string:
-        return [ALLOW_ALL]
+        return intern_acl([ALLOW_ALL])
 
     aces_list = acl_string.replace('\n', ';').split(';')
     aces_list = [ace.strip().split(' ', 2) for ace in aces_list if ace]
@@ -105,16 +158,211 @@ def parse_acl(acl_string):
 
         result_acl.append((action, principal, permissions))
 
-    return result_acl
+    return intern_acl(result_acl)
+
+
+class DecisionTable(object):
+    """ Static ACEs compiled into a map of
+    {permission: {principal: (position, ACE)}}.
+
+    Each principal is mapped to the first ACE that applies to it, so
+    deciding on a permission costs a lookup per principal regardless of
+    the number of ACEs. Decisions are cached by (principals,
+    permission).
+    """
+    max_cache_size = 10000
+
+    def __init__(self, aces):
+        self.aces = tuple(aces)
+        self._cache = {}
+        self.all_permissions = {}
+        self.permissions = {}
+        for position, ace in enumerate(self.aces):
+            action, principal, perms = ace
+            if perms == ALL_PERMISSIONS:
+                self.all_permissions.setdefault(principal, (position, ace))
+                continue
+            if isinstance(perms, six.string_types):
+                perms = [perms]
+            for perm in perms:
+                # Like in Pyramid, ALL_PERMISSIONS only matches on its own
+                if perm == ALL_PERMISSIONS:
+                    continue
+                entries = self.permissions.setdefault(perm, {})
+                entries.setdefault(principal, (position, ace))
+        for entries in self.permissions.values():
+            for principal, entry in self.all_permissions.items():
+                current = entries.get(principal)
+                if current is None or entry[0] < current[0]:
+                    entries[principal] = entry
+
+    def decide(self, principals, permission):
+        """ Get the first ACE that applies to any of :principals: and
+        :permission: or None.
+        """
+        key = (frozenset(principals), permission)
+        if key in self._cache:
+            return self._cache[key]
+        entries = self.permissions.get(permission, self.all_permissions)
+        match = None
+        for principal in principals:
+            entry = entries.get(principal)
+            if entry is not None and (match is None or entry[0] < match[0]):
+                match = entry
+        ace = match[1] if match is not None else None
+        if len(self._cache) >= self.max_cache_size:
+            self._cache.clear()
+        self._cache[key] = ace
+        return ace
+
+
+class CompiledACL(tuple):
+    """ ACL whose runs of static ACEs are compiled into decision tables.
+
+    Behaves as a tuple of ACEs. `segments` holds DecisionTable instances
+    and ACEs with callable principals in ACL order.
+    """
+    def __new__(cls, aces):
+        self = super(CompiledACL, cls).__new__(cls, aces)
+        self.segments = cls._compile(self)
+        self.has_callables = not all(
+            isinstance(segment, DecisionTable) for segment in self.segments)
+        return self
+
+    @staticmethod
+    def _compile(aces):
+        segments = []
+        static = []
+        for ace in aces:
+            if six.callable(ace[1]):
+                if static:
+                    segments.append(DecisionTable(static))
+                    static = []
+                segments.append(ace)
+            else:
+                static.append(ace)
+        if static:
+            segments.append(DecisionTable(static))
+        return segments
+
+    def decide(self, principals, permission):
+        """ Get the first ACE that applies to any of :principals: and
+        :permission: or None. Only valid for ACLs without callable
+        principals.
+        """
+        for table in self.segments:
+            ace = table.decide(principals, permission)
+            if ace is not None:
+                return ace
+        return None
+
+
+def compile_acl(acl):
+    """ Get shared CompiledACL of :acl:.
+
+    :param acl: List of ACEs as returned by `parse_acl`.
+    """
+    key = _acl_key(acl)
+    if key not in _compiled_acls:
+        _compiled_acls[key] = CompiledACL(acl)
+    return _compiled_acls[key]
+
+
+def request_principal(func):
+    """ Mark callable principal :func: as depending only on the request.
+
+    Results of such principals don't depend on the `obj` argument and
+    are cached for the duration of a request, so they are called at most
+    once per request for each ACE. E.g.::
+
+        @registry.add
+        @request_principal
+        def staff_only(ace, request, obj):
+            ...
+    """
+    func.depends_on_obj = False
+    return func
+
+
+def _find_ace(acl, principals, permission):
+    """ Get the first ACE of :acl: that applies to any of :principals:
+    and :permission: or None. Walks ACEs one by one like Pyramid
+    `ACLAuthorizationPolicy` does.
+    """
+    for ace in acl:
+        action, principal, perms = ace
+        if principal in principals:
+            if isinstance(perms, six.string_types):
+                perms = [perms]
+            if permission in perms:
+                return ace
+    return None
+
+
+class CompiledACLAuthorizationPolicy(ACLAuthorizationPolicy):
+    """ ACL authorization policy that decides on static compiled ACLs
+    using their decision tables, so checks cost the same regardless of
+    the number of ACEs.
+
+    ACLs with callable principals applied and ACLs that are not
+    compiled, such as database ACLs, are checked ACE by ACE.
+    """
+    def permits(self, context, principals, permission):
+        acl = '<No ACL found on any object in resource lineage>'
+        for location in lineage(context):
+            try:
+                acl = location.__acl__
+            except AttributeError:
+                continue
+            if acl and callable(acl):
+                acl = acl()
+            if isinstance(acl, CompiledACL) and not acl.has_callables:
+                ace = acl.decide(principals, permission)
+            else:
+                ace = _find_ace(acl, principals, permission)
+            if ace is None:
+                continue
+            result_cls = ACLAllowed if ace[0] == Allow else ACLDenied
+            return result_cls(ace, acl, permission, principals, location)
+        return ACLDenied(
+            '<default deny>', acl, permission, principals, context)
 
 
 class BaseACL(CollectionACL):
     """ ACL Base class. """
 
     es_based = False
-    _collection_acl = (ALLOW_ALL, )
-    _item_acl = (ALLOW_ALL, )
+    _collection_acl = compile_acl([ALLOW_ALL])
+    _item_acl = compile_acl([ALLOW_ALL])
 
+    def _call_principal(self, ace, obj=None):
+        """ Call callable principal of :ace: and get list of ACEs it
+        returns.
+
+        Results of principals marked with `request_principal` are
+        looked up in the request-scoped cache first.
+        """
+        principal = ace[1]
+        if getattr(principal, 'depends_on_obj', True):
+            return self._evaluate_principal(ace, obj=obj)
+        cache = get_request_cache(self.request, 'acl_principals')
+        key = (principal, ace[0], _perms_key(ace[2]))
+        if key in cache:
+            record_cache('acl_principals', hits=1)
+            return cache[key]
+        record_cache('acl_principals', misses=1)
+        cache[key] = self._evaluate_principal(ace, obj=obj)
+        return cache[key]
+
+    def _evaluate_principal(self, ace, obj=None):
+        aces = ace[1](ace=ace, request=self.request, obj=obj)
+        if not aces:
+            return []
+        if not isinstance(aces[0], (list, tuple)):
+            aces = [aces]
+        return [(a, b, validate_permissions(c)) for a, b, c in aces]
+
+    @timed_method('acl')
     def _apply_callables(self, acl, obj=None):
         """ Iterate over ACEs from :acl: and apply callable principals
         if any.
@@ -126,24 +374,44 @@ class BaseACL(CollectionACL):
             :obj: Object instance to be accessed via the ACL
         Principals must return a single ACE or a list of ACEs.
 
+        Compiled ACLs without callable principals are returned as is.
+
         :param acl: Sequence of valid Pyramid ACEs which will be processed
         :param obj: Object to be accessed via the ACL
         """
+        if isinstance(acl, CompiledACL) and not acl.has_callables:
+            return acl
+
         new_acl = []
         for i, ace in enumerate(acl):
-            principal = ace[1]
-            if six.callable(principal):
-                ace = principal(ace=ace, request=self.request, obj=obj)
-                if not ace:
-                    continue
-                if not isinstance(ace[0], (list, tuple)):
-                    ace = [ace]
-                ace = [(a, b, validate_permissions(c)) for a, b, c in ace]
+            if six.callable(ace[1]):
+                new_acl += self._call_principal(ace, obj=obj)
             else:
-                ace = [ace]
-            new_acl += ace
+                new_acl.append(ace)
         return tuple(new_acl)
 
+    def static_item_decision(self, principals, permission):
+        """ Decide whether :principals: have :permission: on every item
+        using static ACEs of `self._item_acl`.
+
+        Item ACL is the same for all items of a resource unless it has
+        callable principals, thus ACEs preceding the first callable
+        principal decide for all items.
+
+        Returns True or False if these ACEs allow or deny
+        :permission:, and None if they don't decide.
+        """
+        acl = self._item_acl
+        if not isinstance(acl, CompiledACL):
+            return None
+        for segment in acl.segments:
+            if not isinstance(segment, DecisionTable):
+                return None
+            ace = segment.decide(principals, permission)
+            if ace is not None:
+                return ace[0] == Allow
+        return None
+
     def __acl__(self):
         """ Apply callables to `self._collection_acl` and return result. """
         return self._apply_callables(acl=self._collection_acl)
@@ -160,6 +428,28 @@ class BaseACL(CollectionACL):
         """ Apply callables to `self._item_acl` and return result. """
         return self.generate_item_acl(item)
 
+    def stringified_item_acl(self, item):
+        """ Generate ACL of :item: stringified for storing in database.
+
+        Static parts of compiled `self._item_acl` are stringified once
+        and reused, so only callable principals are evaluated and
+        stringified for each item.
+        """
+        from nefertari_guards import engine as guards_engine
+        stringify = guards_engine.ACLField.stringify_acl
+        acl = self._item_acl
+        if not isinstance(acl, CompiledACL):
+            return stringify(self.generate_item_acl(item))
+        result = []
+        for segment in acl.segments:
+            if not isinstance(segment, DecisionTable):
+                result += stringify(self._call_principal(segment, obj=item))
+                continue
+            if segment not in _stringified_tables:
+                _stringified_tables[segment] = stringify(segment.aces)
+            result += [dict(ace) for ace in _stringified_tables[segment]]
+        return result
+
     def item_db_id(self, key):
         # ``self`` can be used for current authenticated user key
         if key != 'self':
@@ -170,13 +460,27 @@ class BaseACL(CollectionACL):
         return getattr(user, user.pk_field())
 
     def __getitem__(self, key):
-        """ Get item using method depending on value of `self.es_based` """
+        """ Get item using method depending on value of `self.es_based`
+
+        Items are looked up in the request identity map first, so each
+        object is fetched at most once per request.
+        """
+        identity_map = get_identity_map(self.request)
+        obj = identity_map.get(self.item_model, self.es_based, key)
+        if obj is not None:
+            obj.__acl__ = self.item_acl(obj)
+            obj.__parent__ = self
+            return obj
+
         if not self.es_based:
-            return super(BaseACL, self).__getitem__(key)
-        return self.getitem_es(self.item_db_id(key))
+            obj = super(BaseACL, self).__getitem__(key)
+        else:
+            obj = self.getitem_es(self.item_db_id(key))
+        identity_map.add(self.item_model, self.es_based, key, obj)
+        return obj
 
     def getitem_es(self, key):
-        es = ES(self.item_model.__name__)
+        es = get_es_accessor(ES, self.item_model.__name__)
         obj = es.get_item(id=key)
         obj.__acl__ = self.item_acl(obj)
         obj.__parent__ = self
@@ -184,6 +488,30 @@ class BaseACL(CollectionACL):
         return obj
 
 
+def get_request_acl(request, factory):
+    """ Get instance of ACL :factory: shared within :request: """
+    cache = get_request_cache(request, 'acl_factories')
+    if factory not in cache:
+        cache[factory] = factory(request)
+    return cache[factory]
+
+
+def stringify_item_acl(request, factory, item):
+    """ Generate ACL of :item: using ACL :factory: and stringify it for
+    storing in database.
+
+    Generated ACL factories are instantiated once per request and reuse
+    stringified static parts of their item ACLs (see
+    `BaseACL.stringified_item_acl`), which makes creating many objects
+    in a request cheaper.
+    """
+    if isinstance(factory, type) and issubclass(factory, BaseACL):
+        return get_request_acl(request, factory).stringified_item_acl(item)
+    from nefertari_guards import engine as guards_engine
+    acl = factory(request).generate_item_acl(item)
+    return guards_engine.ACLField.stringify_acl(acl)
+
+
 class DatabaseACLMixin(object):
     """ Mixin to be used when ACLs are stored in database. """
 
@@ -203,7 +531,7 @@ class DatabaseACLMixin(object):
         `ACLFilterES`.
         """
         from nefertari_guards.elasticsearch import ACLFilterES
-        es = ACLFilterES(self.item_model.__name__)
+        es = get_es_accessor(ACLFilterES, self.item_model.__name__)
         params = {
             'id': key,
             'request': self.request,
@@ -228,6 +556,10 @@ def generate_acl(config, model_cls, raml_resource, es_based=True):
     If the `collection` or `item` settings are empty, then ALLOW_ALL ACL
     is used.
 
+    Parsed ACLs are compiled into decision tables (see `CompiledACL`).
+    Resources with the same model and identical ACLs share a single
+    generated ACL class.
+
     :param model_cls: Generated model class
     :param raml_resource: Instance of ramlfications.raml.ResourceNode
         for which ACL is being generated
@@ -238,14 +570,22 @@ def generate_acl(config, model_cls, raml_resource, es_based=True):
     schemes = [sch for sch in schemes if sch.type == 'x-ACL']
 
     if not schemes:
-        collection_acl = item_acl = []
+        collection_acl = item_acl = compile_acl([])
         log.debug('No ACL scheme applied. Using ACL: {}'.format(item_acl))
     else:
         sec_scheme = schemes[0]
         log.debug('{} ACL scheme applied'.format(sec_scheme.name))
         settings = sec_scheme.settings or {}
-        collection_acl = parse_acl(acl_string=settings.get('collection'))
-        item_acl = parse_acl(acl_string=settings.get('item'))
+        collection_acl = compile_acl(
+            parse_acl(acl_string=settings.get('collection')))
+        item_acl = compile_acl(parse_acl(acl_string=settings.get('item')))
+
+    database_acls = bool(config.registry.database_acls)
+    key = (model_cls, es_based, database_acls,
+           _acl_key(collection_acl), _acl_key(item_acl))
+    if key in _acl_classes:
+        log.debug('Reusing generated ACL class')
+        return _acl_classes[key]
 
     class GeneratedACLBase(object):
         item_model = model_cls
@@ -257,9 +597,10 @@ def generate_acl(config, model_cls, raml_resource, es_based=True):
             self._item_acl = item_acl
 
     bases = [GeneratedACLBase]
-    if config.registry.database_acls:
+    if database_acls:
         from nefertari_guards.acl import DatabaseACLMixin as GuardsMixin
         bases += [DatabaseACLMixin, GuardsMixin]
     bases.append(BaseACL)
 
-    return type('GeneratedACL', tuple(bases), {})
\ No newline at end of file
+    _acl_classes[key] = type('GeneratedACL', tuple(bases), {})
+    return _acl_classes[key]
\ No newline at end of file
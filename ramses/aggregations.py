@@ -0,0 +1,170 @@
+"""
+Elasticsearch aggregations of generated collections.
+
+Aggregations are requested using the `_aggregate` query param of
+collection GET requests. Its value is a comma-separated list of
+aggregation specs in the form `field:type[:option]`, e.g.::
+
+    /stories?_aggregate=status:terms,created_at:date_histogram:month
+
+Supported aggregation types and their options:
+    * terms: number of buckets to return. Defaults to 10.
+    * date_histogram: interval. Defaults to 'day'.
+    * sum, avg, min, max, cardinality: no options.
+
+Results are keyed by '<field>_<type>'.
+
+Aggregations defined with nefertari `_aggregations` query params are
+supported too when `elasticsearch.enable_aggregations` setting is true.
+Both kinds of aggregations are performed by `ESAggregator` on objects
+that belong to parent view's queryset.
+"""
+import logging
+
+from nefertari.utils import dictset
+from nefertari.view_helpers import ESAggregator as NefertariESAggregator
+from nefertari.json_httpexceptions import JHTTPBadRequest
+
+from .utils import get_model_field_names
+from .serializers import get_visible_fields, get_audience
+
+
+log = logging.getLogger(__name__)
+
+
+METRIC_AGGREGATIONS = ('sum', 'avg', 'min', 'max', 'cardinality')
+DATE_INTERVALS = (
+    'year', 'quarter', 'month', 'week', 'day', 'hour', 'minute')
+DEFAULT_TERMS_SIZE = 10
+MAX_TERMS_SIZE = 1000
+
+
+def _terms(field, option):
+    size = DEFAULT_TERMS_SIZE
+    if option is not None:
+        try:
+            size = int(option)
+        except ValueError:
+            raise JHTTPBadRequest(
+                'Invalid terms aggregation size: {}'.format(option))
+        if not 0 < size <= MAX_TERMS_SIZE:
+            raise JHTTPBadRequest(
+                'Terms aggregation size must be between 1 and {}'.format(
+                    MAX_TERMS_SIZE))
+    return {'terms': {'field': field, 'size': size}}
+
+
+def _date_histogram(field, option):
+    interval = option or 'day'
+    if interval not in DATE_INTERVALS:
+        raise JHTTPBadRequest(
+            'Invalid date_histogram interval: {}. Valid intervals: '
+            '{}'.format(interval, ', '.join(DATE_INTERVALS)))
+    return {'date_histogram': {'field': field, 'interval': interval}}
+
+
+def parse_aggregations(value):
+    """ Parse value of `_aggregate` query param.
+
+    Returns list of (field, type, option) tuples.
+
+    :param value: Comma-separated string or list of aggregation specs.
+    """
+    if not isinstance(value, (list, tuple)):
+        value = value.split(',')
+    specs = []
+    for spec in value:
+        spec = spec.strip()
+        if not spec:
+            continue
+        parts = [part.strip() for part in spec.split(':', 2)]
+        if len(parts) < 2:
+            raise JHTTPBadRequest(
+                'Invalid aggregation: {}. Aggregations must be defined '
+                'as field:type[:option]'.format(spec))
+        parts += [None] * (3 - len(parts))
+        specs.append(tuple(parts))
+    if not specs:
+        raise JHTTPBadRequest('Missing aggregations')
+    return specs
+
+
+def build_aggregations(specs, allowed_fields):
+    """ Build ES aggregations body from :specs:.
+
+    :param specs: List of (field, type, option) tuples as returned by
+        `parse_aggregations`.
+    :param allowed_fields: Collection of names of fields that may be
+        aggregated.
+    """
+    aggregations = {}
+    for field, agg_type, option in specs:
+        if field not in allowed_fields:
+            raise JHTTPBadRequest(
+                'Aggregation on field `{}` is not allowed'.format(field))
+        if agg_type == 'terms':
+            body = _terms(field, option)
+        elif agg_type == 'date_histogram':
+            body = _date_histogram(field, option)
+        elif agg_type in METRIC_AGGREGATIONS:
+            body = {agg_type: {'field': field}}
+        else:
+            raise JHTTPBadRequest(
+                'Unknown aggregation type: {}'.format(agg_type))
+        aggregations['{}_{}'.format(field, agg_type)] = body
+    return aggregations
+
+
+def get_aggregation_fields(model_cls, request, auth_enabled=True):
+    """ Get names of :model_cls: fields which may be aggregated by the
+    user of :request:.
+
+    Fields that may be aggregated are the fields that are displayed to
+    the user according to model's privacy rules. All fields may be
+    aggregated when auth is not enabled.
+    """
+    fields = set(get_model_field_names(model_cls))
+    if not auth_enabled:
+        return fields
+    visible = get_visible_fields(model_cls, get_audience(request))
+    if visible is None:
+        return fields
+    return fields & visible
+
+
+class ESAggregator(NefertariESAggregator):
+    """ nefertari ESAggregator that supports `_aggregate` query param
+    and runs aggregations using `view.aggregate_es`.
+    """
+    def __init__(self, view):
+        super(ESAggregator, self).__init__(view)
+        self._fields_checked = False
+
+    def pop_aggregations_params(self):
+        """ Pop and return aggregations params built from `_aggregate`
+        query param or nefertari aggregations params.
+        """
+        if '_aggregate' not in self.view._query_params:
+            return super(ESAggregator, self).pop_aggregations_params()
+        self._query_params = dictset(self.view._query_params)
+        specs = parse_aggregations(self._query_params.pop('_aggregate'))
+        fields = get_aggregation_fields(
+            self.view.Model, self.view.request,
+            auth_enabled=getattr(self.view, '_auth_enabled', True))
+        self._fields_checked = True
+        return build_aggregations(specs, fields)
+
+    def check_aggregations_privacy(self, aggregations_params):
+        # Fields of `_aggregate` specs are checked when specs are built
+        if not self._fields_checked:
+            super(ESAggregator, self).check_aggregations_privacy(
+                aggregations_params)
+
+    def aggregate(self):
+        """ Perform aggregation and return response. """
+        aggregations_params = self.pop_aggregations_params()
+        if getattr(self.view, '_auth_enabled', True):
+            self.check_aggregations_privacy(aggregations_params)
+        self.stub_wrappers()
+        return self.view.aggregate_es(
+            aggregations_params, self._query_params)
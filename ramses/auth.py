@@ -9,23 +9,44 @@ In particular:
     :create_system_user: Function that creates system/admin user
     :_setup_ticket_policy: Setup Pyramid AuthTktAuthenticationPolicy
     :_setup_apikey_policy: Setup nefertari.ApiKeyAuthenticationPolicy
+    :_setup_signed_token_policy: Setup SignedTokenAuthenticationPolicy
     :setup_auth_policies: Runs generation of particular auth policy
+    :AuthUserCache: Worker-wide cache of authenticated users
+    :ApiKeyCache: Worker-wide cache of API key checks
 """
+import hashlib
 import logging
 
 import transaction
 from pyramid.authentication import AuthTktAuthenticationPolicy
-from pyramid.authorization import ACLAuthorizationPolicy
-from pyramid.security import Allow, ALL_PERMISSIONS
+from pyramid.security import (
+    Allow, ALL_PERMISSIONS, authenticated_userid, forget)
+from pyramid.settings import aslist
 import cryptacular.bcrypt
 
 from nefertari.utils import dictset
 from nefertari.json_httpexceptions import *
 from nefertari.authentication.policies import ApiKeyAuthenticationPolicy
 
+from .acl import CompiledACLAuthorizationPolicy, stringify_item_acl
+from .cache import TTLCache
+from .passwords import limit_auth_requests
+from .tokens import (
+    SignedTokenAuthenticationPolicy, DEFAULT_MAX_AGE,
+    DEFAULT_REVOCATION_CHECK_INTERVAL)
+from .utils import is_sqla_model, is_mongo_model
+
 log = logging.getLogger(__name__)
 
 
+DEFAULT_USER_CACHE_SIZE = 1000
+DEFAULT_USER_CACHE_TTL = 60
+DEFAULT_API_KEY_CACHE_SIZE = 1000
+DEFAULT_API_KEY_CACHE_TTL = 30
+DEFAULT_API_KEY_FAILURE_CACHE_SIZE = 1000
+DEFAULT_API_KEY_FAILURE_CACHE_TTL = 5
+
+
 class ACLAssignRegisterMixin(object):
     """ Mixin that sets ``User._acl`` field after user is registered. """
     def register(self, *args, **kwargs):
@@ -35,15 +56,228 @@ class ACLAssignRegisterMixin(object):
         user = self.request._user
         mapping = self.request.registry._model_collections
         if not user._acl and self.Model.__name__ in mapping:
-            from nefertari_guards import engine as guards_engine
             factory = mapping[self.Model.__name__].view._factory
-            acl = factory(self.request).generate_item_acl(user)
-            acl = guards_engine.ACLField.stringify_acl(acl)
+            acl = stringify_item_acl(self.request, factory, user)
             user.update({'_acl': acl})
 
         return response
 
 
+class AuthUserCache(object):
+    """ Worker-wide TTL/LRU cache of users of :auth_model:.
+
+    Provides cached versions of `get_groups_by_userid`,
+    `get_authuser_by_userid` and `get_authuser_by_name` methods of
+    nefertari auth models. Users are cached by (field name, value) and
+    dropped when the auth model is updated or deleted through the API
+    (see `invalidate`). Changes made elsewhere become visible when
+    cached users expire.
+
+    nefertari-sqla users are cached detached from DB sessions and are
+    merged into the session of the request that gets them.
+    nefertari-mongodb users are not bound to sessions, so each request
+    gets its own copy of the cached user to not share it across threads.
+    """
+    def __init__(self, auth_model, max_size=DEFAULT_USER_CACHE_SIZE,
+                 ttl=DEFAULT_USER_CACHE_TTL):
+        self.auth_model = auth_model
+        self.users = TTLCache(max_size, ttl, name='auth_users')
+
+    @staticmethod
+    def _detach(user):
+        if is_sqla_model(type(user)):
+            from sqlalchemy.orm import object_session
+            session = object_session(user)
+            if session is not None:
+                session.expunge(user)
+        return user
+
+    @staticmethod
+    def _attach(user):
+        if is_sqla_model(type(user)):
+            from pyramid_sqlalchemy import Session
+            return Session.merge(user, load=False)
+        if is_mongo_model(type(user)):
+            return type(user)._from_son(user.to_mongo())
+        return user
+
+    def get_user(self, request, field, value):
+        """ Get user whose :field: equals :value:.
+
+        The user is stored as `request._user` like nefertari does.
+        """
+        user = getattr(request, '_user', None)
+        if user is not None and getattr(user, field, None) == value:
+            return user
+        cached = self.users.get((field, value))
+        if cached is None:
+            cached = self._detach(
+                self.auth_model.get_item(**{field: value}))
+            self.users.set((field, value), cached)
+        request._user = self._attach(cached)
+        return request._user
+
+    def invalidate(self, event):
+        """ Drop users changed by model :event: from cache. """
+        user = getattr(event, 'instance', None)
+        if user is None:
+            self.users.clear()
+            return
+        pk_field = self.auth_model.pk_field()
+        for field in (pk_field, 'username'):
+            self.users.discard((field, getattr(user, field, None)))
+
+    def get_groups_by_userid(self, userid, request):
+        """ Cached `auth_model.get_groups_by_userid`. """
+        try:
+            user = self.get_user(request, self.auth_model.pk_field(), userid)
+        except Exception as ex:
+            log.error(str(ex))
+            forget(request)
+        else:
+            if user:
+                return ['g:%s' % g for g in user.groups]
+
+    def get_authuser_by_userid(self, request):
+        """ Cached `auth_model.get_authuser_by_userid`. """
+        userid = authenticated_userid(request)
+        if userid:
+            return self.get_user(request, self.auth_model.pk_field(), userid)
+
+    def get_authuser_by_name(self, request):
+        """ Cached `auth_model.get_authuser_by_name`. """
+        username = authenticated_userid(request)
+        if username:
+            return self.get_user(request, 'username', username)
+
+
+class ApiKeyCache(object):
+    """ Worker-wide cache of results of API key :check: callable.
+
+    Results are cached by SHA-256 hash of (username, token), so tokens
+    aren't kept in memory. Successful checks are kept for :ttl: seconds
+    and failed checks are kept separately for :failure_ttl: seconds, so
+    requests with invalid keys can't push valid keys out of the cache.
+    """
+    def __init__(self, check,
+                 max_size=DEFAULT_API_KEY_CACHE_SIZE,
+                 ttl=DEFAULT_API_KEY_CACHE_TTL,
+                 failure_max_size=DEFAULT_API_KEY_FAILURE_CACHE_SIZE,
+                 failure_ttl=DEFAULT_API_KEY_FAILURE_CACHE_TTL):
+        self.check = check
+        self.verified = TTLCache(max_size, ttl, name='api_keys')
+        self.failures = TTLCache(
+            failure_max_size, failure_ttl, name='api_key_failures')
+
+    @staticmethod
+    def _key(username, token):
+        value = u'{}\x00{}'.format(username, token)
+        return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+    def get_groups_by_token(self, username, token, request):
+        """ Cached `auth_model.get_groups_by_token`. """
+        key = self._key(username, token)
+        entry = self.verified.get(key)
+        if entry is not None:
+            return list(entry[1])
+        if self.failures.get(key) is not None:
+            return None
+        groups = self.check(username, token, request)
+        if groups is None:
+            self.failures.set(key, username)
+        else:
+            self.verified.set(key, (username, list(groups)))
+        return groups
+
+    def invalidate_user(self, username):
+        """ Drop cached checks of keys of user :username:. """
+        self.verified.discard_if(lambda key, entry: entry[0] == username)
+        self.failures.discard_if(lambda key, value: value == username)
+
+    def clear(self):
+        self.verified.clear()
+        self.failures.clear()
+
+    def invalidate(self, event):
+        """ Drop checks of users changed by model :event: from cache. """
+        user = getattr(event, 'instance', None)
+        if user is None:
+            self.clear()
+        else:
+            self.invalidate_user(user.username)
+
+
+class ApiKeyCacheResetMixin(object):
+    """ Mixin that drops cached API key checks of user after the user
+    resets their token.
+    """
+    def create(self, *args, **kwargs):
+        response = super(ApiKeyCacheResetMixin, self).create(
+            *args, **kwargs)
+        api_key_cache = self.request.registry.api_key_cache
+        user = getattr(self, 'user', None)
+        if user is None:
+            api_key_cache.clear()
+        else:
+            api_key_cache.invalidate_user(user.username)
+        return response
+
+
+def _subscribe_to_user_changes(config, subscriber):
+    """ Subscribe :subscriber: to events of auth model changes. """
+    from nefertari import events
+    event_objects = [
+        events.AFTER_EVENTS[action] for action in (
+            'update', 'replace', 'delete', 'update_many', 'delete_many')]
+    config.subscribe_to_events(
+        subscriber, event_objects, model=config.registry.auth_model)
+
+
+def _setup_api_key_cache(config):
+    """ Create ApiKeyCache if `api_key_cache.enable` setting is true.
+
+    Returns None if the cache is disabled.
+    """
+    Settings = dictset(config.registry.settings)
+    if not Settings.asbool('api_key_cache.enable'):
+        return None
+    api_key_cache = ApiKeyCache(
+        config.registry.auth_model.get_groups_by_token,
+        max_size=int(Settings.get(
+            'api_key_cache.max_size', DEFAULT_API_KEY_CACHE_SIZE)),
+        ttl=float(Settings.get(
+            'api_key_cache.ttl', DEFAULT_API_KEY_CACHE_TTL)),
+        failure_max_size=int(Settings.get(
+            'api_key_cache.failure_max_size',
+            DEFAULT_API_KEY_FAILURE_CACHE_SIZE)),
+        failure_ttl=float(Settings.get(
+            'api_key_cache.failure_ttl', DEFAULT_API_KEY_FAILURE_CACHE_TTL)))
+    _subscribe_to_user_changes(config, api_key_cache.invalidate)
+    config.registry.api_key_cache = api_key_cache
+    log.info('API key cache enabled')
+    return api_key_cache
+
+
+def _setup_user_cache(config):
+    """ Create AuthUserCache if `auth_cache.enable` setting is true.
+
+    Returns None if the cache is disabled.
+    """
+    Settings = dictset(config.registry.settings)
+    if not Settings.asbool('auth_cache.enable'):
+        return None
+    auth_model = config.registry.auth_model
+    user_cache = AuthUserCache(
+        auth_model,
+        max_size=int(Settings.get(
+            'auth_cache.max_size', DEFAULT_USER_CACHE_SIZE)),
+        ttl=float(Settings.get('auth_cache.ttl', DEFAULT_USER_CACHE_TTL)))
+    _subscribe_to_user_changes(config, user_cache.invalidate)
+    config.registry.auth_user_cache = user_cache
+    log.info('Auth user cache enabled')
+    return user_cache
+
+
 def _setup_ticket_policy(config, params):
     """ Setup Pyramid AuthTktAuthenticationPolicy.
 
@@ -51,6 +285,8 @@ def _setup_ticket_policy(config, params):
       * Initial `secret` params value is considered to be a name of config
         param that represents a cookie name.
       * `auth_model.get_groups_by_userid` is used as a `callback`.
+      * Cached methods of AuthUserCache are used instead of auth model
+        methods when `auth_cache.enable` setting is true.
       * Also connects basic routes to perform authentication actions.
 
     :param config: Pyramid Configurator instance.
@@ -68,10 +304,11 @@ def _setup_ticket_policy(config, params):
     params['secret'] = config.registry.settings[params['secret']]
 
     auth_model = config.registry.auth_model
-    params['callback'] = auth_model.get_groups_by_userid
+    user_source = _setup_user_cache(config) or auth_model
+    params['callback'] = user_source.get_groups_by_userid
 
     config.add_request_method(
-        auth_model.get_authuser_by_userid, 'user', reify=True)
+        user_source.get_authuser_by_userid, 'user', reify=True)
 
     policy = AuthTktAuthenticationPolicy(**params)
 
@@ -80,11 +317,13 @@ def _setup_ticket_policy(config, params):
         class RegisterViewBase(ACLAssignRegisterMixin,
                                TicketAuthRegisterView):
             pass
+    RegisterViewBase = limit_auth_requests(config, RegisterViewBase)
 
     class RamsesTicketAuthRegisterView(RegisterViewBase):
         Model = config.registry.auth_model
 
-    class RamsesTicketAuthLoginView(TicketAuthLoginView):
+    class RamsesTicketAuthLoginView(
+            limit_auth_requests(config, TicketAuthLoginView)):
         Model = config.registry.auth_model
 
     class RamsesTicketAuthLogoutView(TicketAuthLogoutView):
@@ -113,6 +352,10 @@ def _setup_apikey_policy(config, params):
         token check
       * `auth_model.get_token_credentials` is used to get username and
         token from userid
+      * Cached `get_authuser_by_name` of AuthUserCache is used when
+        `auth_cache.enable` setting is true.
+      * Cached `get_groups_by_token` of ApiKeyCache is used when
+        `api_key_cache.enable` setting is true.
       * Also connects basic routes to perform authentication actions.
 
     Arguments:
@@ -125,11 +368,15 @@ def _setup_apikey_policy(config, params):
     log.info('Configuring ApiKey Authn policy')
 
     auth_model = config.registry.auth_model
+    api_key_cache = _setup_api_key_cache(config)
     params['check'] = auth_model.get_groups_by_token
+    if api_key_cache is not None:
+        params['check'] = api_key_cache.get_groups_by_token
     params['credentials_callback'] = auth_model.get_token_credentials
     params['user_model'] = auth_model
+    user_source = _setup_user_cache(config) or auth_model
     config.add_request_method(
-        auth_model.get_authuser_by_name, 'user', reify=True)
+        user_source.get_authuser_by_name, 'user', reify=True)
 
     policy = ApiKeyAuthenticationPolicy(**params)
 
@@ -138,14 +385,22 @@ def _setup_apikey_policy(config, params):
         class RegisterViewBase(ACLAssignRegisterMixin,
                                TokenAuthRegisterView):
             pass
+    RegisterViewBase = limit_auth_requests(config, RegisterViewBase)
 
     class RamsesTokenAuthRegisterView(RegisterViewBase):
         Model = auth_model
 
-    class RamsesTokenAuthClaimView(TokenAuthClaimView):
+    class RamsesTokenAuthClaimView(
+            limit_auth_requests(config, TokenAuthClaimView)):
         Model = auth_model
 
-    class RamsesTokenAuthResetView(TokenAuthResetView):
+    ResetViewBase = TokenAuthResetView
+    if api_key_cache is not None:
+        class ResetViewBase(ApiKeyCacheResetMixin, TokenAuthResetView):
+            pass
+    ResetViewBase = limit_auth_requests(config, ResetViewBase)
+
+    class RamsesTokenAuthResetView(ResetViewBase):
         Model = auth_model
 
     common_kw = {
@@ -161,6 +416,80 @@ def _setup_apikey_policy(config, params):
     return policy
 
 
+def _setup_signed_token_policy(config, params):
+    """ Setup `ramses.tokens.SignedTokenAuthenticationPolicy`.
+
+    Notes:
+      * Initial `secret` params value is considered to be a name of config
+        param that holds whitespace-separated list of signing keys. The
+        first key signs new tokens.
+      * `max_age` param sets number of seconds tokens are valid for.
+      * `revocation_check_interval` param sets number of seconds groups
+        of token users are cached for by revocation checks.
+      * `request.user` is built from the token and only loads the user
+        from DB (or user cache) when other attributes are read.
+      * Also connects basic routes to perform authentication actions.
+        Login and register responses return the token in `Authorization`
+        header. Logout revokes the token in the current worker.
+
+    :param config: Pyramid Configurator instance.
+    :param params: Nefertari dictset which contains security scheme
+        `settings`.
+    """
+    from nefertari.authentication.views import (
+        TicketAuthRegisterView, TicketAuthLoginView,
+        TicketAuthLogoutView)
+
+    log.info('Configuring signed token Authn policy')
+    if 'secret' not in params:
+        raise ValueError(
+            'Missing required security scheme settings: secret')
+    secrets = aslist(config.registry.settings[params['secret']])
+
+    auth_model = config.registry.auth_model
+    user_source = _setup_user_cache(config) or auth_model
+    policy = SignedTokenAuthenticationPolicy(
+        auth_model, secrets,
+        max_age=int(params.get('max_age', DEFAULT_MAX_AGE)),
+        revocation_check_interval=float(params.get(
+            'revocation_check_interval',
+            DEFAULT_REVOCATION_CHECK_INTERVAL)),
+        load_user=user_source.get_authuser_by_userid)
+    if policy.revocation_check_interval:
+        _subscribe_to_user_changes(config, policy.invalidate)
+
+    config.add_request_method(policy.get_user, 'user', reify=True)
+
+    RegisterViewBase = TicketAuthRegisterView
+    if config.registry.database_acls:
+        class RegisterViewBase(ACLAssignRegisterMixin,
+                               TicketAuthRegisterView):
+            pass
+    RegisterViewBase = limit_auth_requests(config, RegisterViewBase)
+
+    class RamsesTokenRegisterView(RegisterViewBase):
+        Model = auth_model
+
+    class RamsesTokenLoginView(
+            limit_auth_requests(config, TicketAuthLoginView)):
+        Model = auth_model
+
+    class RamsesTokenLogoutView(TicketAuthLogoutView):
+        Model = auth_model
+
+    common_kw = {
+        'prefix': 'auth',
+        'factory': 'nefertari.acl.AuthenticationACL',
+    }
+
+    root = config.get_root_resource()
+    root.add('register', view=RamsesTokenRegisterView, **common_kw)
+    root.add('login', view=RamsesTokenLoginView, **common_kw)
+    root.add('logout', view=RamsesTokenLogoutView, **common_kw)
+
+    return policy
+
+
 """ Map of `security_scheme_type`: `generator_function`, where:
 
   * `security_scheme_type`: String that represents RAML security scheme type
@@ -173,6 +502,7 @@ def _setup_apikey_policy(config, params):
 AUTHENTICATION_POLICIES = {
     'x-ApiKey': _setup_apikey_policy,
     'x-Ticket': _setup_ticket_policy,
+    'x-SignedToken': _setup_signed_token_policy,
 }
 
 
@@ -214,13 +544,15 @@ def setup_auth_policies(config, raml_root):
     config.set_authentication_policy(authn_policy)
 
     # Setup Authorization policy
-    authz_policy = ACLAuthorizationPolicy()
+    authz_policy = CompiledACLAuthorizationPolicy()
     config.set_authorization_policy(authz_policy)
 
 
 def create_system_user(config):
     log.info('Creating system user')
-    crypt = cryptacular.bcrypt.BCRYPTPasswordManager()
+    crypt = getattr(config.registry, 'password_pool', None)
+    if crypt is None:
+        crypt = cryptacular.bcrypt.BCRYPTPasswordManager()
     settings = config.registry.settings
     try:
         auth_model = config.registry.auth_model
@@ -0,0 +1,182 @@
+"""
+Caches used by generated views and ACLs.
+
+Request-scoped caches are stored on the request object and are
+shared with blank requests created to process parent resources (see
+`share_request_cache`), so data loaded while processing a request is
+available at all levels of nested resources.
+
+`TTLCache` is a worker-wide cache shared by requests processed by the
+worker.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from .metrics import record_cache
+
+
+log = logging.getLogger(__name__)
+
+
+def get_request_cache(request, name):
+    """ Get request-scoped cache dict named :name:.
+
+    :param request: Pyramid Request instance.
+    :param name: String name of the cache.
+    """
+    caches = getattr(request, '_ramses_cache', None)
+    if not isinstance(caches, dict):
+        caches = {}
+        request._ramses_cache = caches
+    return caches.setdefault(name, {})
+
+
+def share_request_cache(source, target):
+    """ Make request :target: use request-scoped caches of :source:.
+
+    Used to share caches with blank requests created from :source:.
+    """
+    get_request_cache(source, 'identity_map')
+    target._ramses_cache = source._ramses_cache
+
+
+class IdentityMap(object):
+    """ Request-scoped map of objects loaded by ACLs.
+
+    Objects are keyed by (model name, backend, id) where backend is
+    either 'es' or 'db'. `hits` holds the number of fetches avoided.
+    """
+    def __init__(self):
+        self._objects = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(model_cls, es_based, key):
+        backend = 'es' if es_based else 'db'
+        return (model_cls.__name__, backend, str(key))
+
+    def get(self, model_cls, es_based, key):
+        obj = self._objects.get(self._key(model_cls, es_based, key))
+        if obj is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            log.debug('Identity map hit: {}({}). Fetches avoided: {}'.format(
+                model_cls.__name__, key, self.hits))
+        return obj
+
+    def add(self, model_cls, es_based, key, obj):
+        self._objects[self._key(model_cls, es_based, key)] = obj
+
+    def discard(self, model_cls, key):
+        for es_based in (True, False):
+            self._objects.pop(self._key(model_cls, es_based, key), None)
+
+    def clear(self):
+        self._objects.clear()
+
+
+def get_identity_map(request):
+    """ Get IdentityMap instance of :request: """
+    cache = get_request_cache(request, 'identity_map')
+    if 'map' not in cache:
+        cache['map'] = IdentityMap()
+    return cache['map']
+
+
+def invalidate_identity_map(event):
+    """ Drop objects changed by nefertari model :event: from identity
+    map of the event request.
+
+    Objects changed by update/delete of a single item are dropped.
+    The whole map is cleared on bulk updates and deletions.
+    """
+    caches = getattr(event.view.request, '_ramses_cache', None)
+    if not isinstance(caches, dict):
+        return
+    identity_map = caches.get('identity_map', {}).get('map')
+    if identity_map is None:
+        return
+    instance = getattr(event, 'instance', None)
+    if instance is None:
+        identity_map.clear()
+        return
+    pk_value = getattr(instance, event.model.pk_field(), None)
+    identity_map.discard(event.model, pk_value)
+    # Current user may have been looked up by 'self' key
+    identity_map.discard(event.model, 'self')
+
+
+class TTLCache(object):
+    """ Thread-safe LRU cache whose entries expire after :ttl: seconds.
+
+    Hits and misses are recorded in metrics of cache :name:.
+
+    :param max_size: Max number of entries. Least recently used entries
+        are dropped when the cache is full.
+    :param ttl: Number of seconds entries are kept for.
+    :param name: String name of the cache used in metrics.
+    """
+    def __init__(self, max_size, ttl, name):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.name = name
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > now:
+                self._entries[key] = entry
+                value = entry[1]
+            else:
+                entry = None
+        if entry is None:
+            record_cache(self.name, misses=1)
+            return default
+        record_cache(self.name, hits=1)
+        return value
+
+    def set(self, key, value, ttl=None):
+        """ Store :value: under :key: for :ttl: seconds (defaults to
+        cache TTL).
+        """
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard_if(self, predicate):
+        """ Drop entries for which :predicate:(key, value) is true. """
+        with self._lock:
+            keys = [key for key, (_, value) in self._entries.items()
+                    if predicate(key, value)]
+            for key in keys:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def includeme(config):
+    from nefertari import events
+    event_objects = [
+        events.AFTER_EVENTS[action] for action in (
+            'update', 'replace', 'delete', 'update_many', 'delete_many')]
+    config.subscribe_to_events(invalidate_identity_map, event_objects)
@@ -0,0 +1,96 @@
+"""
+Shared Elasticsearch accessors and client connection pool settings.
+
+Accessors (`nefertari.elasticsearch.ES` and its subclasses) used by
+generated ACLs and views are created once per model and reused by
+`get_es_accessor`.
+
+Connection pool of the Elasticsearch client is configured with::
+
+    es_pool.maxsize = 25
+    es_pool.timeout = 10
+    es_pool.max_retries = 3
+    es_pool.retry_on_timeout = true
+
+    * es_pool.maxsize: Max number of kept-alive connections to each
+      Elasticsearch node.
+    * es_pool.timeout: Timeout of Elasticsearch requests in seconds.
+    * es_pool.max_retries: Number of retries of failed requests.
+    * es_pool.retry_on_timeout: Whether requests that timed out are
+      retried.
+
+The client created by nefertari is replaced with a client that uses the
+same hosts, serializer and connection class with these settings.
+"""
+import logging
+import threading
+
+from pyramid.settings import asbool
+from nefertari.utils import dictset
+
+
+log = logging.getLogger(__name__)
+
+
+POOL_SETTINGS = (
+    ('maxsize', int),
+    ('timeout', float),
+    ('max_retries', int),
+    ('retry_on_timeout', asbool),
+)
+
+""" Map of {(accessor class, model name): accessor} """
+_accessors = {}
+_lock = threading.Lock()
+
+
+def get_es_accessor(es_cls, model_name):
+    """ Get shared instance of ES accessor :es_cls: for :model_name: """
+    key = (es_cls, model_name)
+    accessor = _accessors.get(key)
+    if accessor is None:
+        with _lock:
+            if key not in _accessors:
+                _accessors[key] = es_cls(model_name)
+            accessor = _accessors[key]
+    return accessor
+
+
+def get_pool_params(settings):
+    """ Get client params from `es_pool.*` :settings:. """
+    params = {}
+    for name, converter in POOL_SETTINGS:
+        key = 'es_pool.' + name
+        if key in settings:
+            params[name] = converter(settings[key])
+    return params
+
+
+def rebuild_client(client, params, sniff_on_start=False):
+    """ Create ES client with settings of :client: and pool :params:. """
+    transport = client.transport
+    kwargs = dict(getattr(transport, 'kwargs', {}))
+    kwargs.update(params)
+    new_client = type(client)(
+        hosts=transport.hosts,
+        serializer=transport.serializer,
+        connection_class=transport.connection_class,
+        sniff_on_start=sniff_on_start,
+        sniff_on_connection_fail=getattr(
+            transport, 'sniff_on_connection_fail', False),
+        **kwargs)
+    if hasattr(transport, 'close'):
+        transport.close()
+    return new_client
+
+
+def includeme(config):
+    from nefertari.elasticsearch import ES
+    Settings = dictset(config.registry.settings)
+    params = get_pool_params(Settings)
+    if not params:
+        return
+    ES.api = rebuild_client(
+        ES.api, params,
+        sniff_on_start=Settings.asbool('elasticsearch.sniff', default=False))
+    log.info('Elasticsearch connection pool configured: {}'.format(params))
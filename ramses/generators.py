@@ -3,7 +3,10 @@ import logging
 
 from inflection import singularize
 
-from .views import generate_rest_view
+from pyramid.events import BeforeTraversal
+
+from .views import (
+    generate_rest_view, get_allowed_methods, reject_not_allowed_methods)
 from .acl import generate_acl
 from .utils import (
     is_dynamic_uri,
@@ -120,7 +123,19 @@ def generate_resource(config, raml_resource, parent_resource):
     if not is_singular:
         resource_args += (clean_uri,)
 
-    return parent_resource.add(*resource_args, **resource_kwargs)
+    new_resource = parent_resource.add(*resource_args, **resource_kwargs)
+
+    # Store HTTP methods allowed on resource routes to reject other
+    # methods before views are created
+    collection_methods, item_methods = get_allowed_methods(
+        view_attrs, singular=is_singular)
+    route_map = new_resource.action_route_map
+    allowed_methods = config.registry.allowed_methods
+    allowed_methods[route_map['show']] = item_methods
+    if 'index' in route_map:
+        allowed_methods[route_map['index']] = collection_methods
+
+    return new_resource
 
 
 def generate_server(raml_root, config):
@@ -136,6 +151,8 @@ def generate_server(raml_root, config):
 
     root_resource = config.get_root_resource()
     generated_resources = {}
+    config.registry.allowed_methods = {}
+    config.add_subscriber(reject_not_allowed_methods, BeforeTraversal)
 
     for raml_resource in raml_root.resources:
         if raml_resource.path in generated_resources:
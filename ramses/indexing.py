@@ -0,0 +1,270 @@
+"""
+Write-behind indexing of documents in Elasticsearch.
+
+By default nefertari sends changes of ES-based documents to
+Elasticsearch synchronously while processing the request that changed
+them. When write-behind indexing is enabled with::
+
+    es_write_behind.enable = true
+
+bulk actions are queued instead and sent to Elasticsearch by a
+background thread. Actions of a request are queued when the request is
+finished, and only if it finished without an error. The following
+settings control the queue:
+
+    * es_write_behind.flush_interval: Max number of seconds actions wait
+      in the queue. Defaults to 1.
+    * es_write_behind.batch_size: Max number of actions sent in a single
+      bulk request. Defaults to 500.
+    * es_write_behind.max_retries: Number of retries of a failed bulk
+      request. Defaults to 5.
+    * es_write_behind.retry_backoff: Number of seconds to wait before
+      the first retry. The delay doubles with each retry. Defaults
+      to 0.5.
+    * es_write_behind.spill_file: Path to a file actions are appended to
+      when all retries fail. Spilled actions are sent again on startup
+      and after the next successful bulk request. The file may be shared
+      by worker processes: it is locked while actions are appended to
+      it or taken from it.
+
+Requests that need to read their own writes can pass the
+`_refresh_index` query param: their actions are sent synchronously and
+the index is refreshed as usual.
+"""
+import os
+import json
+import time
+import fcntl
+import atexit
+import logging
+import threading
+
+from nefertari.utils import dictset
+
+from .utils import json_default
+
+
+log = logging.getLogger(__name__)
+
+
+REFRESH_PARAM = '_refresh_index'
+
+
+class WriteBehindQueue(object):
+    """ Queue of ES bulk actions flushed by a background thread.
+
+    :param send: Callable that sends list of actions to ES in a single
+        bulk request.
+    :param flush_interval: Max number of seconds actions wait in the
+        queue.
+    :param batch_size: Max number of actions sent at once.
+    :param max_retries: Number of retries of a failed batch.
+    :param retry_backoff: Delay before the first retry in seconds.
+    :param spill_file: Path to a file failed batches are appended to.
+    """
+    def __init__(self, send, flush_interval=1.0, batch_size=500,
+                 max_retries=5, retry_backoff=0.5, spill_file=None):
+        self.send = send
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.spill_file = spill_file
+        self._actions = []
+        self._condition = threading.Condition()
+        self._send_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+
+    def __len__(self):
+        return len(self._actions)
+
+    def put(self, actions):
+        """ Queue list of bulk :actions:. """
+        with self._condition:
+            self._actions.extend(actions)
+            self._start()
+            if len(self._actions) >= self.batch_size:
+                self._condition.notify()
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name='es-write-behind')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _take_batch(self):
+        batch = self._actions[:self.batch_size]
+        del self._actions[:self.batch_size]
+        return batch
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._actions) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                if self._stopped:
+                    return
+            self._send_next()
+
+    def _send_next(self):
+        """ Take next batch of queued actions and send it.
+
+        Batches are taken and sent under a single lock by the background
+        thread and by `flush`, so they are sent one at a time and in
+        order. Returns False if the queue is empty.
+        """
+        with self._send_lock:
+            with self._condition:
+                batch = self._take_batch()
+            if not batch:
+                return False
+            self.send_batch(batch)
+            return True
+
+    def send_batch(self, batch):
+        """ Send :batch: of actions retrying on errors.
+
+        Batch is spilled to file if all retries fail. Returns boolean
+        indicating whether batch was sent.
+        """
+        delay = self.retry_backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.send(batch)
+            except Exception as ex:
+                log.warning(
+                    'Failed to send {} actions to Elasticsearch '
+                    '(attempt {}): {}'.format(len(batch), attempt + 1, ex))
+                if attempt < self.max_retries:
+                    time.sleep(delay)
+                    delay *= 2
+            else:
+                self.replay_spilled()
+                return True
+        self.spill(batch)
+        return False
+
+    def spill(self, batch):
+        """ Append :batch: to spill file. """
+        if not self.spill_file:
+            log.error('Dropped {} Elasticsearch actions'.format(len(batch)))
+            return
+        with open(self.spill_file, 'a') as spill_file:
+            fcntl.flock(spill_file, fcntl.LOCK_EX)
+            for action in batch:
+                spill_file.write(json.dumps(action, default=json_default))
+                spill_file.write('\n')
+            spill_file.flush()
+        log.error('Spilled {} Elasticsearch actions to {}'.format(
+            len(batch), self.spill_file))
+
+    def replay_spilled(self):
+        """ Queue actions from spill file and truncate it.
+
+        The file is locked while it is read and truncated, so actions
+        spilled by other processes in the meantime are not lost.
+        """
+        if not self.spill_file or not os.path.exists(self.spill_file):
+            return
+        if not os.path.getsize(self.spill_file):
+            return
+        with open(self.spill_file, 'r+') as spill_file:
+            fcntl.flock(spill_file, fcntl.LOCK_EX)
+            actions = [
+                json.loads(line) for line in spill_file if line.strip()]
+            spill_file.truncate(0)
+        if not actions:
+            return
+        log.info('Replaying {} spilled Elasticsearch actions'.format(
+            len(actions)))
+        self.put(actions)
+
+    def flush(self):
+        """ Send all queued actions synchronously. """
+        while self._send_next():
+            pass
+
+    def stop(self):
+        """ Stop background thread and flush queued actions. """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self.flush()
+
+
+def is_refresh_requested(request):
+    """ Determine if :request: wants to read its own writes. """
+    return request is not None and REFRESH_PARAM in request.params
+
+
+def install_write_behind(es_module, queue):
+    """ Make `_bulk_body` function of nefertari :es_module: queue bulk
+    actions to :queue: instead of sending them to ES synchronously.
+    """
+    sync_bulk_body = es_module._bulk_body
+
+    def _bulk_body(documents_actions, request):
+        if is_refresh_requested(request):
+            # Queued actions are sent first to keep actions in order
+            queue.flush()
+            return sync_bulk_body(documents_actions, request)
+        actions = list(documents_actions)
+        if request is None:
+            queue.put(actions)
+            return
+
+        def queue_actions(request):
+            if getattr(request, 'exception', None) is None:
+                queue.put(actions)
+        request.add_finished_callback(queue_actions)
+
+    es_module._bulk_body = _bulk_body
+
+
+def is_missing_delete(error):
+    """ Determine if bulk :error: is a deletion of missing document. """
+    return error.get('delete', {}).get('status') == 404
+
+
+def send_bulk(client, actions):
+    """ Send :actions: to ES using :client:.
+
+    Raises exception if any of actions fails, except deletions of
+    documents that are already gone.
+    """
+    from elasticsearch import helpers
+    executed, errors = helpers.bulk(
+        client=client, actions=actions, raise_on_error=False)
+    errors = [error for error in errors if not is_missing_delete(error)]
+    if errors:
+        raise Exception('{} Elasticsearch actions failed: {}'.format(
+            len(errors), errors[0]))
+    log.info('Successfully executed {} Elasticsearch action(s)'.format(
+        executed))
+
+
+def includeme(config):
+    from nefertari import elasticsearch
+    from nefertari.elasticsearch import ES
+    Settings = dictset(config.registry.settings)
+
+    def send(batch):
+        send_bulk(ES.api, batch)
+
+    queue = WriteBehindQueue(
+        send=send,
+        flush_interval=float(Settings.get(
+            'es_write_behind.flush_interval', 1)),
+        batch_size=int(Settings.get('es_write_behind.batch_size', 500)),
+        max_retries=int(Settings.get('es_write_behind.max_retries', 5)),
+        retry_backoff=float(Settings.get(
+            'es_write_behind.retry_backoff', 0.5)),
+        spill_file=Settings.get('es_write_behind.spill_file'),
+    )
+    config.registry.es_write_behind_queue = queue
+    install_write_behind(elasticsearch, queue)
+    queue.replay_spilled()
+    atexit.register(queue.stop)
+    log.info('Elasticsearch write-behind indexing enabled')
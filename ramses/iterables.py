@@ -0,0 +1,279 @@
+"""
+Atomic updates of ListField/DictField attribute subresources.
+
+Functions in this module change a single iterable field of an object
+in place using native operations of the underlying database instead of
+loading the whole field, changing it in python and saving the object
+back. The new value of the field is then sent to Elasticsearch as a
+partial document update once the change is committed.
+
+Supported engines/fields:
+    * nefertari_sqla: ListField (PostgreSQL ARRAY)
+    * nefertari_mongodb: ListField, DictField
+
+Other fields and engines are reported as unsupported by
+`supports_atomic_update` so callers can fall back to
+`update_iterables`. Fields that have field processors and fields of
+models that have event handlers are reported as unsupported too, as
+processors and handlers expect the whole new value of the field.
+
+Params follow the format accepted by nefertari `update_iterables`:
+keys prefixed with '-' are removed, other keys are added (list fields)
+or set (dict fields). Keys starting with '__' are ignored.
+"""
+import logging
+
+import transaction
+from nefertari.json_httpexceptions import JHTTPBadRequest
+
+from .utils import is_sqla_model, is_mongo_model
+from .esclient import get_es_accessor
+
+
+log = logging.getLogger(__name__)
+
+
+# Map of {model class: set of field names} of fields that are never
+# updated atomically. None in place of the set excludes all the fields.
+_excluded_fields = {}
+
+
+def exclude_from_atomic_update(model_cls, field=None):
+    """ Exclude field :field: of :model_cls: from atomic updates.
+
+    All the fields of :model_cls: are excluded if :field: is None.
+    """
+    if field is None:
+        _excluded_fields[model_cls] = None
+        return
+    fields = _excluded_fields.setdefault(model_cls, set())
+    if fields is not None:
+        fields.add(field)
+
+
+def is_excluded(model_cls, attr):
+    """ Determine if field :attr: of :model_cls: is excluded from
+    atomic updates.
+    """
+    if model_cls not in _excluded_fields:
+        return False
+    fields = _excluded_fields[model_cls]
+    return fields is None or attr in fields
+
+
+def split_keys(keys):
+    """ Split :keys: into lists of positive and negative keys.
+
+    Negative keys are those that start with '-'. The '-' prefix is
+    stripped from them.
+
+    :param keys: Iterable of string keys.
+    """
+    positive, negative = [], []
+    for key in keys:
+        if key.startswith('__'):
+            continue
+        if key.startswith('-'):
+            negative.append(key[1:])
+        else:
+            positive.append(key.strip())
+    return positive, negative
+
+
+def _field_type_name(model_cls, attr):
+    """ Get name of nefertari field class used for field :attr: """
+    if is_sqla_model(model_cls):
+        column = model_cls.__table__.columns.get(attr)
+        return type(column).__name__ if column is not None else None
+    if is_mongo_model(model_cls):
+        field = model_cls._fields.get(attr)
+        return type(field).__name__ if field is not None else None
+
+
+def supports_atomic_update(model_cls, attr):
+    """ Determine if field :attr: of :model_cls: can be updated
+    atomically.
+    """
+    if is_excluded(model_cls, attr):
+        return False
+    field_type = _field_type_name(model_cls, attr)
+    if is_sqla_model(model_cls):
+        return field_type == 'ListField'
+    if is_mongo_model(model_cls):
+        return field_type in ('ListField', 'DictField')
+    return False
+
+
+def _convert(value, value_type):
+    """ Convert :value: to :value_type: if it's not None. """
+    if value_type is None:
+        return value
+    try:
+        return value_type(value)
+    except (TypeError, ValueError):
+        raise JHTTPBadRequest('Invalid value: {}'.format(value))
+
+
+def _list_changes(params, current=None, value_type=None):
+    """ Get (positive, negative) lists of values from :params:.
+
+    Empty :params: mean removal of all :current: values.
+    """
+    if params is None or params == '':
+        return [], list(current or [])
+    keys = list(params.keys()) if isinstance(params, dict) else params
+    positive, negative = split_keys(keys)
+    if not (positive + negative):
+        raise JHTTPBadRequest('Missing params')
+    positive = [_convert(val, value_type) for val in positive]
+    negative = [_convert(val, value_type) for val in negative]
+    return positive, negative
+
+
+def _dict_changes(params, current=None, value_type=None):
+    """ Get (values to set, keys to unset) from :params:. """
+    if params is None or params == '':
+        return {}, list((current or {}).keys())
+    positive, negative = split_keys(list(params.keys()))
+    to_set = {
+        str(key): _convert(params[key], value_type) for key in positive}
+    to_unset = [key for key in negative if key not in to_set]
+    return to_set, to_unset
+
+
+def _update_sqla_list(obj, attr, positive, negative, unique):
+    from sqlalchemy import or_, not_
+    from sqlalchemy.orm import object_session
+    from sqlalchemy.sql import func
+
+    model_cls = type(obj)
+    table = model_cls.__table__
+    column = table.c[attr]
+    pk_column = table.c[model_cls.pk_field()]
+    pk_value = getattr(obj, model_cls.pk_field())
+    session = object_session(obj)
+    statement = table.update().where(pk_column == pk_value)
+
+    if positive:
+        if unique:
+            # One statement per value so the value is not appended if it
+            # has been added concurrently
+            for value in positive:
+                session.execute(statement.where(
+                    or_(column == None, not_(column.any(value)))  # noqa
+                ).values({attr: func.array_append(column, value)}))
+        else:
+            session.execute(statement.values({
+                attr: func.array_cat(column, positive)}))
+
+    for value in negative:
+        session.execute(statement.values({
+            attr: func.array_remove(column, value)}))
+
+    session.refresh(obj, [attr])
+
+
+def _update_mongo(obj, attr, positive, negative, unique, is_dict):
+    model_cls = type(obj)
+    collection = model_cls._get_collection()
+    db_field = model_cls._fields[attr].db_field
+    query = {'_id': obj.pk}
+
+    if is_dict:
+        update = {}
+        if positive:
+            update['$set'] = {
+                '{}.{}'.format(db_field, key): val
+                for key, val in positive.items()}
+        if negative:
+            update['$unset'] = {
+                '{}.{}'.format(db_field, key): '' for key in negative}
+        if update:
+            collection.update_one(query, update)
+    else:
+        # Mongo doesn't allow pushing to and pulling from the same
+        # field in a single update, thus two updates are performed
+        if positive:
+            operator = '$addToSet' if unique else '$push'
+            collection.update_one(
+                query, {operator: {db_field: {'$each': positive}}})
+        if negative:
+            collection.update_one(
+                query, {'$pullAll': {db_field: negative}})
+
+    obj.reload(attr)
+
+
+def index_field_es(obj, attr, request=None):
+    """ Send value of field :attr: of :obj: to ES as a partial
+    document update.
+
+    The update is sent through nefertari bulk indexing, thus it is
+    queued when write-behind indexing is enabled. Updates of
+    nefertari-sqla objects are sent once the DB transaction commits and
+    are dropped if it doesn't. MongoDB updates are not transactional, so
+    updates of nefertari-mongodb objects are sent right away.
+    """
+    from nefertari import elasticsearch
+    model_cls = type(obj)
+    if not getattr(model_cls, '_index_enabled', False):
+        return
+    es = get_es_accessor(elasticsearch.ES, model_cls.__name__)
+    action = {
+        '_op_type': 'update',
+        '_index': es.index_name,
+        '_type': es.doc_type,
+        '_id': str(getattr(obj, model_cls.pk_field())),
+        'doc': {attr: getattr(obj, attr)},
+    }
+
+    def send():
+        # Looked up on call as write-behind indexing replaces it
+        elasticsearch._bulk_body([action], request)
+
+    if not is_sqla_model(model_cls):
+        send()
+        return
+
+    def send_committed(success):
+        if success:
+            send()
+    transaction.get().addAfterCommitHook(send_committed)
+
+
+def atomic_update_iterables(obj, params, attr, unique=False,
+                            value_type=None, request=None):
+    """ Atomically update iterable field :attr: of :obj: using :params:.
+
+    Updated field value is set on :obj: and indexed in ES.
+    `supports_atomic_update` must be used to check whether the field
+    can be updated using this function.
+
+    :param obj: Instance of generated model.
+    :param params: Dict or list of params in format accepted by
+        nefertari `update_iterables`.
+    :param attr: Name of ListField or DictField to be updated.
+    :param unique: Boolean indicating if values added to a list field
+        must be unique.
+    :param value_type: Type list values and dict values are converted
+        to. Values are not converted if None.
+    :param request: Current request. Used to index the field in ES.
+    """
+    model_cls = type(obj)
+    is_dict = _field_type_name(model_cls, attr) == 'DictField'
+    current = getattr(obj, attr, None)
+    if is_dict:
+        positive, negative = _dict_changes(params, current, value_type)
+    else:
+        positive, negative = _list_changes(params, current, value_type)
+
+    log.debug('Atomically updating {}.{}: +{} -{}'.format(
+        model_cls.__name__, attr, positive, negative))
+
+    if is_sqla_model(model_cls):
+        _update_sqla_list(obj, attr, positive, negative, unique)
+    else:
+        _update_mongo(obj, attr, positive, negative, unique, is_dict)
+
+    index_field_es(obj, attr, request=request)
+    return getattr(obj, attr, None)
@@ -0,0 +1,400 @@
+"""
+Metrics of generated API in Prometheus text format.
+
+Enabled with::
+
+    metrics.enable = true
+    metrics.route = /metrics
+    metrics.directory = /var/run/myapp/metrics
+
+Collected metrics:
+    * ramses_requests_total{route,method,status}: number of requests;
+    * ramses_request_duration_seconds{route,method}: histogram of
+      request latency;
+    * ramses_requests_in_flight: number of requests being processed;
+    * ramses_es_calls_total{operation}: number of Elasticsearch calls;
+    * ramses_db_calls_total{backend}: number of database queries;
+    * ramses_cache_hits_total{cache} and ramses_cache_misses_total{cache}:
+      hits and misses of ramses caches;
+    * gauges set by other modules with `set_gauge`, e.g. queue depth of
+      `ramses.passwords` pool.
+
+Metrics are exposed at `metrics.route` (defaults to '/metrics').
+
+When `metrics.directory` is set, each worker process periodically
+writes its metrics to a file in that directory, and metrics of all
+workers are summed when exposed. Counters of exited workers are kept,
+their in-flight requests and gauges are not.
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from timeit import default_timer
+
+from pyramid.tweens import INGRESS
+from pyramid.response import Response
+from nefertari.utils import dictset
+
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ES_OPERATIONS = (
+    'search', 'count', 'get', 'get_source', 'mget', 'bulk', 'index',
+    'update', 'delete')
+
+_metrics = None
+
+
+def get_metrics():
+    """ Get Metrics instance or None if metrics are disabled. """
+    return _metrics
+
+
+def record_cache(name, hits=0, misses=0):
+    """ Record :hits: and :misses: of cache :name: if metrics are
+    enabled.
+    """
+    if _metrics is None:
+        return
+    labels = (('cache', name),)
+    if hits:
+        _metrics.inc('ramses_cache_hits_total', labels, hits)
+    if misses:
+        _metrics.inc('ramses_cache_misses_total', labels, misses)
+
+
+def set_gauge(name, value, labels=()):
+    """ Set gauge :name: to :value: if metrics are enabled. """
+    if _metrics is not None:
+        _metrics.set_gauge(name, labels, value)
+
+
+def inc(name, labels=(), value=1):
+    """ Increment counter :name: if metrics are enabled. """
+    if _metrics is not None:
+        _metrics.inc(name, labels, value)
+
+
+def _labels(**labels):
+    return tuple(sorted(labels.items()))
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class Metrics(object):
+    """ Metrics of a worker process.
+
+    :param directory: Directory shared by worker processes.
+    :param buckets: Upper bounds of histogram buckets in seconds.
+    :param flush_interval: Min number of seconds between writes of
+        metrics to :directory:.
+    """
+    def __init__(self, directory=None, buckets=DEFAULT_BUCKETS,
+                 flush_interval=1.0):
+        self.directory = directory
+        self.buckets = tuple(buckets)
+        self.flush_interval = flush_interval
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.in_flight = 0
+        self._flushed_at = 0
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            key = (name, labels)
+            if key not in self.histograms:
+                self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            histogram = self.histograms[key]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def set_gauge(self, name, labels, value):
+        with self._lock:
+            self.gauges[(name, labels)] = value
+
+    def track_in_flight(self, delta):
+        with self._lock:
+            self.in_flight += delta
+
+    def snapshot(self):
+        """ Get JSON-serializable snapshot of metrics. """
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'buckets': list(self.buckets),
+                'in_flight': self.in_flight,
+                'counters': [
+                    [name, list(labels), value]
+                    for (name, labels), value in self.counters.items()],
+                'histograms': [
+                    [name, list(labels), list(buckets), total, count]
+                    for (name, labels), (buckets, total, count)
+                    in self.histograms.items()],
+                'gauges': [
+                    [name, list(labels), value]
+                    for (name, labels), value in self.gauges.items()],
+            }
+
+    def _path(self, pid):
+        return os.path.join(self.directory, 'ramses_{}.json'.format(pid))
+
+    def flush(self, force=False):
+        """ Write metrics of this process to shared directory. """
+        if not self.directory:
+            return
+        now = time.time()
+        if not force and now - self._flushed_at < self.flush_interval:
+            return
+        self._flushed_at = now
+        path = self._path(os.getpid())
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as metrics_file:
+            json.dump(self.snapshot(), metrics_file)
+        os.rename(tmp_path, path)
+
+    def _snapshots(self):
+        own = self.snapshot()
+        snapshots = [own]
+        if not self.directory or not os.path.isdir(self.directory):
+            return snapshots
+        for filename in os.listdir(self.directory):
+            if not (filename.startswith('ramses_') and
+                    filename.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    snapshot = json.load(f)
+            except (IOError, ValueError) as ex:
+                log.warning('Failed to read metrics file {}: {}'.format(
+                    filename, ex))
+                continue
+            if snapshot.get('pid') == own['pid']:
+                continue
+            if not _process_exists(snapshot.get('pid')):
+                snapshot['in_flight'] = 0
+                snapshot['gauges'] = []
+            snapshots.append(snapshot)
+        return snapshots
+
+    def collect(self):
+        """ Sum metrics of all worker processes.
+
+        Returns tuple of (counters, histograms, in_flight).
+        """
+        return self._collect()[:3]
+
+    def _collect(self):
+        counters, histograms, in_flight, gauges = {}, {}, 0, {}
+        for snapshot in self._snapshots():
+            in_flight += snapshot['in_flight']
+            for name, labels, value in snapshot.get('gauges', []):
+                key = (name, tuple(tuple(label) for label in labels))
+                gauges[key] = gauges.get(key, 0) + value
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(label) for label in labels))
+                counters[key] = counters.get(key, 0) + value
+            if snapshot['buckets'] != list(self.buckets):
+                continue
+            for name, labels, buckets, total, count in \
+                    snapshot['histograms']:
+                key = (name, tuple(tuple(label) for label in labels))
+                merged = histograms.setdefault(
+                    key, [[0] * len(self.buckets), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+                merged[1] += total
+                merged[2] += count
+        return counters, histograms, in_flight, gauges
+
+    def render(self):
+        """ Render metrics of all workers in Prometheus text format. """
+        counters, histograms, in_flight, gauges = self._collect()
+        lines = []
+        for name in sorted(set(name for name, _ in counters)):
+            lines.append('# TYPE {} counter'.format(name))
+            for (key_name, labels), value in sorted(counters.items()):
+                if key_name == name:
+                    lines.append('{}{} {}'.format(
+                        name, _format_labels(labels), value))
+        for name in sorted(set(name for name, _ in histograms)):
+            lines.append('# TYPE {} histogram'.format(name))
+            for (key_name, labels), (buckets, total, count) in \
+                    sorted(histograms.items()):
+                if key_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(self.buckets, buckets):
+                    cumulative += bucket
+                    lines.append('{}_bucket{} {}'.format(
+                        name, _format_labels(labels + (('le', bound),)),
+                        cumulative))
+                lines.append('{}_bucket{} {}'.format(
+                    name, _format_labels(labels + (('le', '+Inf'),)),
+                    count))
+                lines.append('{}_sum{} {}'.format(
+                    name, _format_labels(labels), total))
+                lines.append('{}_count{} {}'.format(
+                    name, _format_labels(labels), count))
+        for name in sorted(set(name for name, _ in gauges)):
+            lines.append('# TYPE {} gauge'.format(name))
+            for (key_name, labels), value in sorted(gauges.items()):
+                if key_name == name:
+                    lines.append('{}{} {}'.format(
+                        name, _format_labels(labels), value))
+        lines.append('# TYPE ramses_requests_in_flight gauge')
+        lines.append('ramses_requests_in_flight {}'.format(in_flight))
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(key, str(value).replace('"', '\\"'))
+        for key, value in labels) + '}'
+
+
+def _route_name(request):
+    route = getattr(request, 'matched_route', None)
+    return getattr(route, 'name', None) or 'none'
+
+
+def _record_request_caches(request):
+    caches = getattr(request, '_ramses_cache', None)
+    if not isinstance(caches, dict):
+        return
+    identity_map = caches.get('identity_map', {}).get('map')
+    if identity_map is not None:
+        record_cache(
+            'identity_map', identity_map.hits, identity_map.misses)
+
+
+def metrics_tween_factory(handler, registry):
+    def metrics_tween(request):
+        metrics = _metrics
+        metrics.track_in_flight(1)
+        start = default_timer()
+        status = 500
+        try:
+            response = handler(request)
+            status = response.status_code
+            return response
+        finally:
+            duration = default_timer() - start
+            metrics.track_in_flight(-1)
+            labels = _labels(route=_route_name(request),
+                             method=request.method)
+            metrics.inc('ramses_requests_total',
+                        labels + (('status', status),))
+            metrics.observe(
+                'ramses_request_duration_seconds', labels, duration)
+            _record_request_caches(request)
+            metrics.flush()
+    return metrics_tween
+
+
+def metrics_view(request):
+    return Response(
+        body=_metrics.render().encode('utf-8'),
+        content_type='text/plain',
+        charset='utf-8')
+
+
+def count_es_calls(client, metrics):
+    """ Wrap methods of ES :client: to count calls. """
+    def wrap(operation, method):
+        labels = (('operation', operation),)
+
+        def wrapper(*args, **kwargs):
+            metrics.inc('ramses_es_calls_total', labels)
+            return method(*args, **kwargs)
+        wrapper.__name__ = operation
+        return wrapper
+
+    for operation in ES_OPERATIONS:
+        method = getattr(client, operation, None)
+        if method is not None:
+            setattr(client, operation, wrap(operation, method))
+
+
+def count_db_calls(metrics):
+    """ Count queries of database engines that are installed.
+
+    pymongo command listeners only apply to clients created after they
+    are registered, so this has to be called before the engine connects.
+    """
+    try:
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+    except ImportError:
+        pass
+    else:
+        labels = (('backend', 'sqla'),)
+
+        def before_cursor_execute(*args, **kwargs):
+            metrics.inc('ramses_db_calls_total', labels)
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+
+    try:
+        from pymongo import monitoring
+    except ImportError:
+        pass
+    else:
+        class CommandCounter(monitoring.CommandListener):
+            labels = (('backend', 'mongodb'),)
+
+            def started(self, event):
+                metrics.inc('ramses_db_calls_total', self.labels)
+
+            def succeeded(self, event):
+                pass
+
+            def failed(self, event):
+                pass
+        monitoring.register(CommandCounter())
+
+
+def includeme(config):
+    """ Set up metrics. Included before the database engine, since DB
+    calls are only counted on connections made after that. Calls of ES
+    client are counted by `count_es_calls`, which is called once the
+    client is built.
+    """
+    global _metrics
+    Settings = dictset(config.registry.settings)
+    directory = Settings.get('metrics.directory')
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    _metrics = Metrics(directory=directory)
+    config.registry.metrics = _metrics
+
+    count_db_calls(_metrics)
+    # Included before other tweens are added, so order it explicitly
+    config.add_tween('ramses.metrics.metrics_tween_factory', over=INGRESS)
+    config.add_route('ramses_metrics', Settings.get(
+        'metrics.route', '/metrics'))
+    config.add_view(metrics_view, route_name='ramses_metrics')
+    atexit.register(_metrics.flush, force=True)
+    log.info('Metrics enabled')
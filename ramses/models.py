@@ -8,7 +8,9 @@ from .utils import (
     resolve_to_callable, is_callable_tag,
     resource_schema, generate_model_name,
     get_events_map)
-from . import registry
+from .serializers import compile_serializers
+from .iterables import exclude_from_atomic_update
+from . import registry, timing
 
 
 log = logging.getLogger(__name__)
@@ -116,6 +118,7 @@ def generate_model_cls(config, schema, model_name, raml_resource,
         '__tablename__': model_name.lower(),
         '_public_fields': schema.get('_public_fields') or [],
         '_auth_fields': schema.get('_auth_fields') or [],
+        '_owner_fields': schema.get('_owner_fields') or [],
         '_hidden_fields': schema.get('_hidden_fields') or [],
         '_nested_relationships': schema.get('_nested_relationships') or [],
     }
@@ -167,6 +170,7 @@ def generate_model_cls(config, schema, model_name, raml_resource,
     model_cls = metaclass(model_name, tuple(bases), attrs)
     setup_model_event_subscribers(config, model_cls, schema)
     setup_fields_processors(config, model_cls, schema)
+    compile_serializers(model_cls)
     return model_cls, auth_model
 
 
@@ -222,6 +226,8 @@ def setup_model_event_subscribers(config, model_cls, schema):
     events_map = get_events_map()
     model_events = schema.get('_event_handlers', {})
     event_kwargs = {'model': model_cls}
+    if model_events:
+        exclude_from_atomic_update(model_cls)
 
     for event_tag, subscribers in model_events.items():
         type_, action = event_tag.split('_')
@@ -232,6 +238,8 @@ def setup_model_event_subscribers(config, model_cls, schema):
 
         for sub_name in subscribers:
             sub_func = resolve_to_callable(sub_name)
+            if timing.is_enabled():
+                sub_func = timing.timed_event_handler(sub_func)
             config.subscribe_to_events(
                 sub_func, event_objects, **event_kwargs)
 
@@ -256,6 +264,7 @@ def setup_fields_processors(config, model_cls, schema):
             processors = [resolve_to_callable(val) for val in processors]
             setup_kwargs = {'model': model_cls, 'field': field_name}
             config.add_field_processors(processors, **setup_kwargs)
+            exclude_from_atomic_update(model_cls, field_name)
 
         if backref_processors:
             db_settings = props.get('_db_settings', {})
@@ -272,4 +281,6 @@ def setup_fields_processors(config, model_cls, schema):
                 'field': backref_name
             }
             config.add_field_processors(
-                backref_processors, **setup_kwargs)
\ No newline at end of file
+                backref_processors, **setup_kwargs)
+            exclude_from_atomic_update(
+                setup_kwargs['model'], setup_kwargs['field'])
\ No newline at end of file
@@ -0,0 +1,221 @@
+"""
+Bounded pool of threads that hash and check passwords.
+
+Enabled with::
+
+    password_pool.enable = true
+    password_pool.workers = 2
+    password_pool.max_pending = 50
+    password_pool.rounds = 12
+    password_pool.max_auth_requests = 2
+
+bcrypt hashing and checks of passwords of nefertari auth models (done
+by login, register, token claim and token reset views and on user
+creation) and of the system user run in `password_pool.workers` threads
+(defaults to 2) instead of request threads. When
+`password_pool.max_pending` operations (defaults to 50) are already
+queued or running, new operations fail with 503 right away.
+`password_pool.rounds` sets bcrypt work factor of new hashes.
+
+Auth views that check passwords are limited to
+`password_pool.max_auth_requests` requests (defaults to
+`password_pool.workers`) processed by a worker at the same time. Other
+requests to these views get 503 without waiting. Each limited request
+holds a request thread while it waits for the pool, so the limit must
+be lower than the number of request threads of the WSGI server (e.g.
+`threads` of waitress, 4 by default). Otherwise a burst of logins takes
+all request threads before any of them is rejected.
+
+Metrics:
+    * ramses_password_queue_depth: number of queued and running
+      password operations;
+    * ramses_auth_requests_in_progress: number of auth view requests
+      being processed;
+    * ramses_password_rejected_total{reason}: number of password
+      operations ('pool_full') and auth view requests ('auth_requests')
+      rejected because of limits.
+"""
+import os
+import logging
+import threading
+
+import cryptacular.bcrypt
+from six.moves import queue
+from nefertari.json_httpexceptions import JHTTPServiceUnavailable
+from nefertari.utils import dictset
+
+from .metrics import inc, set_gauge
+
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_PENDING = 50
+
+
+class PasswordPool(object):
+    """ Runs password hashing and checks in a bounded pool of threads.
+
+    Implements `encode`, `check` and `match` methods of cryptacular
+    password managers, so it can replace them.
+
+    :param workers: Number of threads.
+    :param max_pending: Max number of queued and running operations.
+    :param rounds: bcrypt work factor of new hashes. Default work factor
+        of :manager: is used if None.
+    :param manager: cryptacular password manager.
+    """
+    def __init__(self, workers=DEFAULT_WORKERS,
+                 max_pending=DEFAULT_MAX_PENDING, rounds=None,
+                 manager=None):
+        if manager is None:
+            manager = cryptacular.bcrypt.BCRYPTPasswordManager()
+        self.manager = manager
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self.pending = 0
+        self._pid = None
+        self._threads = []
+        self._tasks = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _start(self):
+        """ Start threads of this process. Called under lock. """
+        if self._pid != os.getpid():
+            # Threads and queued tasks don't survive fork
+            self._pid = os.getpid()
+            self._threads = []
+            self._tasks = queue.Queue()
+            self.pending = 0
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(
+                target=self._work, args=(self._tasks,),
+                name='ramses-password-{}'.format(len(self._threads)))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _set_pending(self, delta):
+        """ Change number of pending operations. Called under lock. """
+        self.pending += delta
+        set_gauge('ramses_password_queue_depth', self.pending)
+
+    @staticmethod
+    def _work(tasks):
+        while True:
+            func, args, done, result = tasks.get()
+            try:
+                result.append((True, func(*args)))
+            except Exception as ex:
+                result.append((False, ex))
+            finally:
+                done.set()
+
+    def run(self, func, *args):
+        """ Call :func: with :args: in pool thread and return result.
+
+        Raises JHTTPServiceUnavailable if the pool is full.
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                inc('ramses_password_rejected_total',
+                    (('reason', 'pool_full'),))
+                raise JHTTPServiceUnavailable(
+                    'Too many password operations in progress')
+            self._start()
+            self._set_pending(1)
+            tasks = self._tasks
+        done = threading.Event()
+        result = []
+        try:
+            tasks.put((func, args, done, result))
+            done.wait()
+        finally:
+            with self._lock:
+                self._set_pending(-1)
+        success, value = result[0]
+        if not success:
+            raise value
+        return value
+
+    def encode(self, text, rounds=None):
+        if rounds is None:
+            rounds = self.rounds
+        if rounds is None:
+            return self.run(self.manager.encode, text)
+        return self.run(self.manager.encode, text, rounds)
+
+    def check(self, encoded, text):
+        return self.run(self.manager.check, encoded, text)
+
+    def match(self, encoded):
+        return self.manager.match(encoded)
+
+
+class AuthRequestLimiter(object):
+    """ Limits number of auth view requests processed at the same time.
+
+    Used as a context manager which raises JHTTPServiceUnavailable when
+    :max_requests: requests are already being processed.
+    """
+    def __init__(self, max_requests):
+        self.max_requests = max_requests
+        self.in_progress = 0
+        self._lock = threading.Lock()
+
+    def _set_in_progress(self, delta):
+        """ Change number of requests in progress. Called under lock. """
+        self.in_progress += delta
+        set_gauge('ramses_auth_requests_in_progress', self.in_progress)
+
+    def __enter__(self):
+        with self._lock:
+            if self.in_progress >= self.max_requests:
+                inc('ramses_password_rejected_total',
+                    (('reason', 'auth_requests'),))
+                raise JHTTPServiceUnavailable(
+                    'Too many authentication requests in progress')
+            self._set_in_progress(1)
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self._set_in_progress(-1)
+
+
+class AuthRequestLimitMixin(object):
+    """ Mixin that limits requests to auth view with
+    `registry.auth_request_limiter`.
+    """
+    def create(self, *args, **kwargs):
+        with self.request.registry.auth_request_limiter:
+            return super(AuthRequestLimitMixin, self).create(
+                *args, **kwargs)
+
+
+def limit_auth_requests(config, view_cls):
+    """ Get subclass of auth :view_cls: whose requests are limited if
+    password pool is enabled. Returns :view_cls: otherwise.
+    """
+    if getattr(config.registry, 'password_pool', None) is None:
+        return view_cls
+    return type(view_cls.__name__, (AuthRequestLimitMixin, view_cls), {})
+
+
+def includeme(config):
+    from nefertari.authentication import models
+    Settings = dictset(config.registry.settings)
+    rounds = Settings.get('password_pool.rounds')
+    pool = PasswordPool(
+        workers=int(Settings.get('password_pool.workers', DEFAULT_WORKERS)),
+        max_pending=int(Settings.get(
+            'password_pool.max_pending', DEFAULT_MAX_PENDING)),
+        rounds=int(rounds) if rounds else None)
+    config.registry.password_pool = pool
+    # Only requests the pool can serve right away hold request threads
+    config.registry.auth_request_limiter = AuthRequestLimiter(int(
+        Settings.get('password_pool.max_auth_requests', pool.workers)))
+    # Route hashing done by nefertari auth models through the pool
+    models.crypt = pool
+    log.info('Password pool enabled')
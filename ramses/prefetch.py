@@ -0,0 +1,136 @@
+"""
+Batched loading of relationships of collection items.
+
+Nefertari engines serialize an object by accessing each of its
+relationship fields: objects listed in `_nested_relationships` are
+serialized down to `_nesting_depth` levels, other related objects are
+loaded to display their primary keys. Related objects are loaded
+lazily, which results in a query per item per relationship.
+
+Functions in this module load relationships of a whole collection
+page before it is serialized:
+    * nefertari_sqla: a loader option is added to the collection query
+      for each relationship path, so each relationship is loaded with a
+      single query per nesting level (`selectinload` when available,
+      `subqueryload` otherwise). Loaded objects are stored in the
+      relationship attributes of the session objects, where `to_dict`
+      reads them from.
+    * nefertari_mongodb: references are dereferenced with
+      `select_related`, which fetches referenced documents with a
+      single query per collection per nesting level.
+
+Elasticsearch documents already contain nested documents, so
+collections read from ES need no prefetching.
+"""
+import logging
+
+import six
+from nefertari.utils import split_strip
+
+from .utils import is_sqla_model, is_mongo_model
+
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_NESTING_DEPTH = 1
+
+
+def get_nesting_depth(model_cls):
+    """ Get the depth to which relationships of :model_cls: are
+    serialized.
+    """
+    depth = getattr(model_cls, '_nesting_depth', None)
+    if depth is None:
+        return DEFAULT_NESTING_DEPTH
+    return depth
+
+
+def get_relationships(model_cls):
+    """ Get map of {relationship name: related model} of :model_cls:.
+
+    Only nefertari_sqla models are supported.
+    """
+    from sqlalchemy import inspect
+    return {rel.key: rel.mapper.class_
+            for rel in inspect(model_cls).relationships}
+
+
+def get_loader():
+    """ Get SQLAlchemy loader option used to load relationships. """
+    from sqlalchemy import orm
+    return getattr(orm, 'selectinload', orm.subqueryload)
+
+
+def sqla_loader_options(model_cls, depth, names=None, _parent=None):
+    """ Build loader options that load relationships of :model_cls:
+    objects serialized with nesting depth of :depth:.
+
+    All relationships are loaded at each level, as non-nested related
+    objects are loaded by `to_dict` to display their primary keys.
+    Nested relationships are followed while :depth: is positive.
+
+    :param names: Names of relationships to load at the top level.
+        All relationships are loaded if not provided.
+    """
+    loader = get_loader()
+    nested = getattr(model_cls, '_nested_relationships', None) or ()
+    options = []
+    for name, related_cls in get_relationships(model_cls).items():
+        if names is not None and name not in names:
+            continue
+        attr = getattr(model_cls, name)
+        if _parent is None:
+            option = loader(attr)
+        else:
+            option = getattr(_parent, loader.__name__)(attr)
+        options.append(option)
+        if depth > 0 and name in nested:
+            options += sqla_loader_options(
+                related_cls, depth - 1, _parent=option)
+    return options
+
+
+def _copy_meta(source, target):
+    meta = getattr(source, '_nefertari_meta', None)
+    if meta is not None:
+        target._nefertari_meta = meta
+    return target
+
+
+def prefetch_relationships(model_cls, objects, fields=None):
+    """ Load relationships of :objects: of :model_cls: in batches.
+
+    Returns collection that should be serialized instead of :objects:.
+    Collections which can't be prefetched are returned as is.
+
+    :param model_cls: Model class of :objects:.
+    :param objects: Collection returned by model's `get_collection` or
+        `filter_objects`.
+    :param fields: Names of fields requested with `_fields` query param.
+        Only these relationships are loaded at the top level.
+    """
+    names = None
+    if isinstance(fields, six.string_types):
+        fields = split_strip(fields)
+    if fields:
+        names = [name for name in fields if not name.startswith('-')]
+        names = set(names) or None
+    depth = get_nesting_depth(model_cls)
+
+    if is_sqla_model(model_cls) and hasattr(objects, 'options'):
+        options = sqla_loader_options(model_cls, depth, names=names)
+        if not options:
+            return objects
+        log.debug('Prefetching {} relationship paths of {}'.format(
+            len(options), model_cls.__name__))
+        return _copy_meta(objects, objects.options(*options))
+
+    if is_mongo_model(model_cls) and hasattr(objects, 'select_related'):
+        from .views import ItemsList
+        log.debug('Prefetching references of {}'.format(
+            model_cls.__name__))
+        items = ItemsList(objects.select_related(max_depth=depth + 1))
+        return _copy_meta(objects, items)
+
+    return objects
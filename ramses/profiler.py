@@ -0,0 +1,182 @@
+"""
+On-demand sampling profiler of a live worker.
+
+Enabled with::
+
+    profiler.enable = true
+    profiler.route = /_profile
+    profiler.acl = allow g:admin all
+    profiler.max_seconds = 60
+
+Requests to `profiler.route` (defaults to '/_profile') sample call
+stacks of all other threads of the worker for `seconds` query param
+seconds (defaults to 10, at most `profiler.max_seconds`, which is
+capped at 300). Stacks are sampled every `interval` milliseconds
+(defaults to 5, at least 1).
+
+Access to the route is controlled by `profiler.acl`, which uses the
+syntax of RAML x-ACL security schemes and defaults to
+'allow g:admin all', also when it is empty. The profiler is only
+enabled when authentication is enabled in RAML.
+
+The response contains collapsed stacks ready to be rendered by
+flamegraph.pl or speedscope. Each stack starts with the route name of
+the generated resource whose request the thread was processing, e.g.
+'stories;ramses.views:index;ramses.acl:_apply_callables 12'. Stacks of
+threads that weren't processing a generated resource request start
+with '-'.
+
+Sampling happens in the thread that processes the profiler request, so
+the worker has to serve requests in multiple threads. Only one profiler
+request per worker runs at a time.
+"""
+import sys
+import math
+import time
+import logging
+import threading
+
+from pyramid.response import Response
+from nefertari.json_httpexceptions import JHTTPBadRequest, JHTTPConflict
+from nefertari.utils import dictset
+
+from .acl import BaseACL, parse_acl, compile_acl
+
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_ACL = 'allow g:admin all'
+DEFAULT_SECONDS = 10
+DEFAULT_INTERVAL_MS = 5
+MIN_INTERVAL_MS = 1
+MAX_SECONDS = 300
+NO_RESOURCE = '-'
+
+
+def frame_name(frame):
+    """ Get 'module:function' name of :frame: """
+    return '{}:{}'.format(
+        frame.f_globals.get('__name__', '?'), frame.f_code.co_name)
+
+
+def find_resource(frame):
+    """ Find route name of the request processed on stack of :frame:.
+
+    Looks for the innermost ramses frame whose `self` has a request with
+    a matched route. Returns None if there is no such frame.
+    """
+    while frame is not None:
+        if frame.f_globals.get('__name__', '').startswith('ramses.'):
+            instance = frame.f_locals.get('self')
+            request = getattr(instance, 'request', None)
+            route = getattr(request, 'matched_route', None)
+            if route is not None:
+                return route.name
+        frame = frame.f_back
+    return None
+
+
+def collapse_stack(frame):
+    """ Get collapsed stack of :frame: prefixed with resource name. """
+    names = []
+    resource = find_resource(frame)
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    names.append(resource or NO_RESOURCE)
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler(object):
+    """ Samples stacks of threads of the current process.
+
+    :param interval: Number of seconds between samples.
+    """
+    def __init__(self, interval=DEFAULT_INTERVAL_MS / 1000.0):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+
+    def sample(self, exclude=()):
+        """ Record stacks of all threads except :exclude: thread ids. """
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in exclude:
+                continue
+            stack = collapse_stack(frame)
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def run(self, seconds):
+        """ Sample stacks of other threads for :seconds:. """
+        exclude = (threading.current_thread().ident,)
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            self.sample(exclude=exclude)
+            time.sleep(self.interval)
+
+    def collapsed(self):
+        """ Get collapsed stacks, most frequent first. """
+        stacks = sorted(
+            self.stacks.items(), key=lambda item: (-item[1], item[0]))
+        return ''.join(
+            '{} {}\n'.format(stack, count) for stack, count in stacks)
+
+
+class ProfilerACL(BaseACL):
+    """ ACL of the profiler route. `_collection_acl` is set from
+    `profiler.acl` setting.
+    """
+    _collection_acl = compile_acl(parse_acl(DEFAULT_ACL))
+
+
+def _float_param(request, name, default):
+    try:
+        value = float(request.params.get(name, default))
+    except ValueError:
+        value = float('nan')
+    if math.isnan(value) or math.isinf(value):
+        raise JHTTPBadRequest('{} must be a number'.format(name))
+    return value
+
+
+def profiler_view_factory(max_seconds):
+    max_seconds = min(max_seconds, MAX_SECONDS)
+    lock = threading.Lock()
+
+    def profiler_view(request):
+        seconds = min(
+            _float_param(request, 'seconds', DEFAULT_SECONDS), max_seconds)
+        interval = _float_param(request, 'interval', DEFAULT_INTERVAL_MS)
+        if seconds <= 0 or interval <= 0:
+            raise JHTTPBadRequest('seconds and interval must be positive')
+        interval = max(interval, MIN_INTERVAL_MS)
+        if not lock.acquire(False):
+            raise JHTTPConflict('Profiler is already running')
+        try:
+            profiler = SamplingProfiler(interval=interval / 1000.0)
+            log.info('Profiling for {}s'.format(seconds))
+            profiler.run(seconds)
+        finally:
+            lock.release()
+        response = Response(
+            body=profiler.collapsed().encode('utf-8'),
+            content_type='text/plain', charset='utf-8')
+        response.headers['X-Profile-Samples'] = str(profiler.samples)
+        return response
+    return profiler_view
+
+
+def includeme(config):
+    Settings = dictset(config.registry.settings)
+    # Empty ACL string parses to ALLOW_ALL, which would open the profiler
+    acl_string = (Settings.get('profiler.acl') or '').strip() or DEFAULT_ACL
+    acl = compile_acl(parse_acl(acl_string))
+    factory = type('ProfilerACL', (ProfilerACL,), {'_collection_acl': acl})
+    config.add_route(
+        'ramses_profiler', Settings.get('profiler.route', '/_profile'),
+        factory=factory)
+    config.add_view(
+        profiler_view_factory(float(Settings.get('profiler.max_seconds', 60))),
+        route_name='ramses_profiler', permission='view')
+    log.info('Sampling profiler enabled')
@@ -0,0 +1,247 @@
+"""
+Precompiled serializers that apply field privacy rules.
+
+Serializers are compiled for each generated model and each audience
+(public, authenticated, owner, admin) when the model is generated.
+Field lists of the model (`_public_fields`, `_auth_fields`,
+`_owner_fields`, `_hidden_fields`, `_nested_relationships`) are
+resolved into frozensets and tuples once, so serializing a document
+only requires a lookup of its serializer by document type and a single
+pass over its keys.
+
+Rules applied are the same as those of nefertari `apply_privacy`
+wrapper:
+    * admin users see all fields;
+    * authenticated users see `_auth_fields` except `_hidden_fields`;
+    * other users see `_public_fields` except `_hidden_fields`;
+    * `_hidden_fields` are shown to everyone when privacy is applied
+      with `drop_hidden=False`;
+    * '_type', '_pk' and '_self' are always displayed.
+In addition, authenticated users see `_owner_fields` of their own
+document of auth model (owner audience).
+
+Nested documents are serialized using serializers of their own models.
+Only relationship fields listed in `_nested_relationships` are checked
+for nested documents, down to `_nesting_depth` levels of the top-level
+document. Documents nested deeper are not produced by engines; if they
+are found, only their '_type', '_pk' and '_self' fields are kept. All
+fields are checked for nested documents of models that don't define
+`_nested_relationships`.
+"""
+import logging
+
+from nefertari.utils import dictset
+
+from .prefetch import get_nesting_depth
+from .timing import timed_method
+
+
+log = logging.getLogger(__name__)
+
+
+PUBLIC = 'public'
+AUTHENTICATED = 'authenticated'
+OWNER = 'owner'
+ADMIN = 'admin'
+AUDIENCES = (PUBLIC, AUTHENTICATED, OWNER, ADMIN)
+META_FIELDS = frozenset(['_type', '_pk', '_self'])
+
+""" Map of {(model name, audience, drop_hidden): serializer function} """
+_serializers = {}
+
+
+def get_visible_fields(model_cls, audience, drop_hidden=True):
+    """ Get frozenset of names of :model_cls: fields visible to
+    :audience: or None if all fields are visible.
+    """
+    if audience == ADMIN:
+        return None
+    if audience == PUBLIC:
+        visible = frozenset(getattr(model_cls, '_public_fields', None) or ())
+    else:
+        visible = frozenset(getattr(model_cls, '_auth_fields', None) or ())
+    if audience == OWNER:
+        visible |= frozenset(getattr(model_cls, '_owner_fields', None) or ())
+    hidden = frozenset(getattr(model_cls, '_hidden_fields', None) or ())
+    if drop_hidden:
+        return visible - hidden
+    return visible | hidden
+
+
+def get_nested_fields(model_cls):
+    """ Get tuple of names of :model_cls: fields that may contain nested
+    documents or None if any field may contain them.
+    """
+    nested = getattr(model_cls, '_nested_relationships', None)
+    if nested is None:
+        return None
+    return tuple(nested)
+
+
+def _is_document(value):
+    return isinstance(value, dict) and '_type' in value
+
+
+def _meta_only(data):
+    return dictset((key, data[key]) for key in META_FIELDS if key in data)
+
+
+def compile_serializer(model_cls, audience, drop_hidden=True):
+    """ Compile function that applies privacy rules of :model_cls: for
+    :audience: to document data.
+
+    Compiled function accepts a document dict, number of levels of
+    nested documents to serialize (defaults to `_nesting_depth`) and
+    owner key (see `get_owner`), and returns a new dictset with visible
+    fields only.
+    """
+    visible = get_visible_fields(model_cls, audience, drop_hidden)
+    allowed = None if visible is None else visible | META_FIELDS
+    nested = get_nested_fields(model_cls)
+    if nested is not None and allowed is not None:
+        nested = tuple(field for field in nested if field in allowed)
+    nesting_depth = get_nesting_depth(model_cls)
+    # Owner audience applies to the owner document only
+    nested_audience = AUTHENTICATED if audience == OWNER else audience
+
+    def serialize_value(value, depth, owner):
+        if depth <= 0:
+            return _meta_only(value)
+        return serialize_document(
+            value, nested_audience, depth - 1, owner, drop_hidden)
+
+    def serialize(data, depth=nesting_depth, owner=None):
+        if allowed is None:
+            result = dictset(data)
+        else:
+            result = dictset(
+                (key, val) for key, val in data.items() if key in allowed)
+        for key in (result.keys() if nested is None else nested):
+            val = result.get(key)
+            if _is_document(val):
+                result[key] = serialize_value(val, depth, owner)
+            elif isinstance(val, list) and val and _is_document(val[0]):
+                result[key] = [
+                    serialize_value(doc, depth, owner) for doc in val]
+        return result
+
+    serialize.__name__ = 'serialize_{}_{}{}'.format(
+        model_cls.__name__, audience, '' if drop_hidden else '_with_hidden')
+    return serialize
+
+
+def compile_serializers(model_cls):
+    """ Compile serializers of :model_cls: for all audiences. """
+    for audience in AUDIENCES:
+        for drop_hidden in (True, False):
+            key = (model_cls.__name__, audience, drop_hidden)
+            _serializers[key] = compile_serializer(
+                model_cls, audience, drop_hidden)
+
+
+def get_serializer(type_name, audience, drop_hidden=True):
+    """ Get serializer for documents of type :type_name:.
+
+    Serializers of models that were not generated by ramses are compiled
+    on first access. Returns None if model can't be found.
+    """
+    key = (type_name, audience, drop_hidden)
+    if key not in _serializers:
+        from nefertari import engine
+        try:
+            model_cls = engine.get_document_cls(type_name)
+        except ValueError as ex:
+            log.error(str(ex))
+            return None
+        compile_serializers(model_cls)
+    return _serializers[key]
+
+
+def serialize_document(data, audience, depth=None, owner=None,
+                       drop_hidden=True):
+    """ Apply privacy rules for :audience: to document :data:.
+
+    :param depth: Number of levels of nested documents to serialize.
+        Defaults to `_nesting_depth` of document model.
+    :param owner: Owner key of the user (see `get_owner`). Owner
+        audience is used for the user's own document.
+    :param drop_hidden: Whether `_hidden_fields` should be dropped.
+    """
+    type_name = data.get('_type')
+    if type_name is None:
+        return data
+    if (audience == AUTHENTICATED and owner is not None and
+            owner == (type_name, str(data.get('_pk')))):
+        audience = OWNER
+    serializer = get_serializer(type_name, audience, drop_hidden)
+    if serializer is None:
+        return data
+    if depth is None:
+        return serializer(data, owner=owner)
+    return serializer(data, depth, owner)
+
+
+def get_audience(request, is_admin=None):
+    """ Get audience of :request: user.
+
+    :param is_admin: Whether the user is admin. Determined by calling
+        `is_admin` of user model if None.
+    """
+    user = getattr(request, 'user', None)
+    if user is None:
+        return PUBLIC
+    if is_admin is None:
+        check_admin = getattr(type(user), 'is_admin', None)
+        is_admin = check_admin is not None and check_admin(user)
+    return ADMIN if is_admin else AUTHENTICATED
+
+
+def get_owner(request):
+    """ Get owner key (model name, primary key) of :request: user.
+
+    Returns None if user is not authenticated.
+    """
+    user = getattr(request, 'user', None)
+    if user is None:
+        return None
+    return (type(user).__name__, str(getattr(user, user.pk_field())))
+
+
+class apply_compiled_privacy(object):
+    """ Wrapper that applies privacy rules to JSON output using
+    precompiled serializers.
+
+    Drop-in replacement of nefertari `apply_privacy` wrapper. Accepts
+    the same `drop_hidden` and `is_admin` kwargs.
+    """
+    def __init__(self, request):
+        self.request = request
+
+    @timed_method('serialize')
+    def __call__(self, **kwargs):
+        result = kwargs['result']
+        if not isinstance(result, dict) or not self.request:
+            return result
+        data = result.get('data', result)
+        if not (data and isinstance(data, (dict, list))):
+            return result
+
+        audience = get_audience(self.request, kwargs.get('is_admin'))
+        owner = get_owner(self.request) if audience == AUTHENTICATED else None
+        serialize_kw = {
+            'owner': owner,
+            'drop_hidden': kwargs.get('drop_hidden', True),
+        }
+        if isinstance(data, dict):
+            data = serialize_document(data, audience, **serialize_kw)
+        else:
+            data = [
+                serialize_document(doc, audience, **serialize_kw)
+                if isinstance(doc, dict) else doc
+                for doc in data]
+
+        if 'data' in result:
+            result['data'] = data
+        else:
+            result = data
+        return result
@@ -0,0 +1,172 @@
+"""
+Log of slow Elasticsearch queries.
+
+Enabled with::
+
+    es_slow_log.threshold_ms = 200
+    es_slow_log.sample_rate = 0.5
+    es_slow_log.file = /var/log/myapp/es_slow.jsonl
+
+Elasticsearch read calls (search, count, get, get_source, mget) that
+take at least `es_slow_log.threshold_ms` milliseconds are logged. Only
+`es_slow_log.sample_rate` of slow calls are logged (defaults to 1, all
+slow calls). Each entry is a JSON object that contains:
+    * operation, index, doc_type, body and other params of the call;
+    * duration_ms, and took and hits from the ES response;
+    * caller: the innermost ramses function on the call stack;
+    * route, method and path of the request processed by the caller;
+    * error, if the call failed.
+
+Entries are appended to `es_slow_log.file` when it is set and logged
+with the `ramses.slowlog` logger otherwise. Fast calls only cost a
+timer read; the call stack is only inspected for slow calls.
+"""
+import sys
+import json
+import random
+import logging
+import datetime
+import threading
+from timeit import default_timer
+
+import six
+from nefertari.utils import dictset
+
+from .utils import json_default
+
+
+log = logging.getLogger(__name__)
+
+
+OPERATIONS = ('search', 'count', 'get', 'get_source', 'mget')
+
+# Modules that wrap ES client methods and thus are never the caller
+WRAPPER_MODULES = frozenset([__name__, 'ramses.metrics', 'ramses.esclient'])
+
+
+def find_caller(frame):
+    """ Find the innermost ramses function on the stack of :frame:.
+
+    Frames of modules that wrap ES client methods are skipped. Returns
+    tuple of (caller name, request of caller's instance). Both elements
+    are None if the stack has no ramses frames.
+    """
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith('ramses.') and module not in WRAPPER_MODULES:
+            instance = frame.f_locals.get('self')
+            return (
+                '{}:{}'.format(module, frame.f_code.co_name),
+                getattr(instance, 'request', None),
+            )
+        frame = frame.f_back
+    return None, None
+
+
+def _response_stats(result):
+    """ Get (took, hits) from ES response :result: """
+    if not isinstance(result, dict):
+        return None, None
+    hits = result.get('hits', {}).get('total')
+    if isinstance(hits, dict):
+        hits = hits.get('value')
+    if hits is None and 'count' in result:
+        hits = result['count']
+    if hits is None and 'docs' in result:
+        hits = len([doc for doc in result['docs'] if doc.get('found')])
+    return result.get('took'), hits
+
+
+class SlowQueryLog(object):
+    """ Records ES calls that took longer than :threshold_ms:.
+
+    :param threshold_ms: Min duration of logged calls in milliseconds.
+    :param sample_rate: Fraction of slow calls that are logged.
+    :param path: Path of JSONL file entries are appended to. Entries
+        are logged if not provided.
+    """
+    def __init__(self, threshold_ms, sample_rate=1.0, path=None):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.path = path
+        self._lock = threading.Lock()
+
+    def wrap(self, operation, func):
+        """ Wrap ES client method :func: to record slow calls. """
+        def wrapper(*args, **kwargs):
+            start = default_timer()
+            result = error = None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            except Exception as ex:
+                error = ex
+                raise
+            finally:
+                duration_ms = (default_timer() - start) * 1000
+                if duration_ms >= self.threshold_ms and self._sampled():
+                    self.record(
+                        operation, kwargs, duration_ms, result, error,
+                        frame=sys._getframe(1))
+        wrapper.__name__ = operation
+        return wrapper
+
+    def _sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def record(self, operation, params, duration_ms, result=None,
+               error=None, frame=None):
+        """ Record slow call of ES :operation: """
+        caller, request = find_caller(frame)
+        took, hits = _response_stats(result)
+        params = dict(params)
+        entry = {
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'operation': operation,
+            'index': params.pop('index', None),
+            'doc_type': params.pop('doc_type', None),
+            'body': params.pop('body', None),
+            'params': params,
+            'duration_ms': round(duration_ms, 2),
+            'took': took,
+            'hits': hits,
+            'caller': caller,
+        }
+        if request is not None:
+            route = getattr(request, 'matched_route', None)
+            entry['route'] = getattr(route, 'name', None)
+            entry['method'] = request.method
+            entry['path'] = request.path
+        if error is not None:
+            entry['error'] = six.text_type(error)
+        self.write(entry)
+
+    def write(self, entry):
+        line = json.dumps(entry, default=json_default, sort_keys=True)
+        if not self.path:
+            log.warning(line)
+            return
+        with self._lock:
+            with open(self.path, 'a') as log_file:
+                log_file.write(line + '\n')
+
+    def install(self, client):
+        """ Wrap read methods of ES :client: """
+        for operation in OPERATIONS:
+            method = getattr(client, operation, None)
+            if method is not None:
+                setattr(client, operation, self.wrap(operation, method))
+
+
+def includeme(config):
+    from nefertari.elasticsearch import ES
+    Settings = dictset(config.registry.settings)
+    slow_log = SlowQueryLog(
+        threshold_ms=float(Settings['es_slow_log.threshold_ms']),
+        sample_rate=float(Settings.get('es_slow_log.sample_rate', 1)),
+        path=Settings.get('es_slow_log.file'),
+    )
+    slow_log.install(ES.api)
+    config.registry.es_slow_log = slow_log
+    log.info('Logging Elasticsearch queries slower than {}ms'.format(
+        slow_log.threshold_ms))
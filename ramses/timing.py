@@ -0,0 +1,195 @@
+"""
+Server-Timing breakdown of requests served by generated views.
+
+Enabled with::
+
+    server_timing.enable = true
+
+When enabled, time spent by generated views and ACLs is split into the
+following categories:
+    * acl: applying ACLs and callable principals;
+    * es: Elasticsearch queries;
+    * db: database queries and object saving;
+    * parent: loading parent objects of nested resources, including
+      their ACL, ES and DB calls;
+    * events: model event handlers;
+    * serialize: applying privacy rules to the output;
+    * app: the rest of request processing, including rendering.
+
+Categories don't overlap: time of a nested call is only counted in the
+category of the innermost timed call, unless it is nested in a call of
+inclusive category (parent), which keeps all time of its calls.
+Timings are sent in the `Server-Timing` response header and logged as a
+JSON line by the `ramses.timing` logger.
+
+When disabled, timed calls only check a module-level flag.
+"""
+import json
+import logging
+import functools
+from timeit import default_timer
+
+from .cache import get_request_cache
+
+
+log = logging.getLogger(__name__)
+
+
+CATEGORIES = ('acl', 'es', 'db', 'parent', 'events', 'serialize')
+INCLUSIVE_CATEGORIES = frozenset(['parent'])
+
+_enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+class RequestTimer(object):
+    """ Accumulates exclusive time spent in each category.
+
+    Timed calls nested in a call of inclusive category are not timed
+    separately, so their time is counted in the inclusive category.
+    """
+    def __init__(self):
+        self.totals = {}
+        self._stack = []
+        # Depth of calls nested in a call of inclusive category
+        self._inclusive_depth = 0
+
+    def start(self, category):
+        if self._inclusive_depth:
+            self._inclusive_depth += 1
+            return
+        now = default_timer()
+        if self._stack:
+            self._add(*self._stack[-1], now=now)
+        self._stack.append([category, now])
+        if category in INCLUSIVE_CATEGORIES:
+            self._inclusive_depth = 1
+
+    def stop(self):
+        if self._inclusive_depth > 1:
+            self._inclusive_depth -= 1
+            return
+        self._inclusive_depth = 0
+        now = default_timer()
+        self._add(*self._stack.pop(), now=now)
+        if self._stack:
+            self._stack[-1][1] = now
+
+    def _add(self, category, started, now):
+        self.totals[category] = self.totals.get(category, 0) + now - started
+
+
+def get_timer(request):
+    """ Get RequestTimer of :request: """
+    cache = get_request_cache(request, 'timing')
+    if 'timer' not in cache:
+        cache['timer'] = RequestTimer()
+    return cache['timer']
+
+
+class _Timed(object):
+    __slots__ = ('timer', 'category')
+
+    def __init__(self, timer, category):
+        self.timer = timer
+        self.category = category
+
+    def __enter__(self):
+        self.timer.start(self.category)
+
+    def __exit__(self, *exc_info):
+        self.timer.stop()
+
+
+class _NotTimed(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_not_timed = _NotTimed()
+
+
+def timed(request, category):
+    """ Get context manager that times its block under :category:. """
+    if not _enabled:
+        return _not_timed
+    return _Timed(get_timer(request), category)
+
+
+def timed_method(category):
+    """ Decorator that times method calls under :category:.
+
+    Decorated method's instance must have a `request` attribute.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not _enabled:
+                return func(self, *args, **kwargs)
+            with timed(self.request, category):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_event_handler(func):
+    """ Wrap model event handler :func: to time its calls. """
+    @functools.wraps(func)
+    def wrapper(event):
+        request = getattr(getattr(event, 'view', None), 'request', None)
+        if request is None:
+            return func(event)
+        with timed(request, 'events'):
+            return func(event)
+    return wrapper
+
+
+def format_server_timing(totals, total):
+    """ Format `Server-Timing` header value.
+
+    :param totals: Map of {category: seconds}.
+    :param total: Total request time in seconds.
+    """
+    metrics = []
+    for category in CATEGORIES:
+        if category in totals:
+            metrics.append((category, totals[category]))
+    metrics.append(('app', max(total - sum(totals.values()), 0)))
+    metrics.append(('total', total))
+    return ', '.join(
+        '{};dur={:.2f}'.format(name, seconds * 1000)
+        for name, seconds in metrics)
+
+
+def server_timing_tween_factory(handler, registry):
+    def server_timing_tween(request):
+        start = default_timer()
+        response = handler(request)
+        total = default_timer() - start
+        totals = get_timer(request).totals
+        response.headers['Server-Timing'] = format_server_timing(
+            totals, total)
+        log.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'timings_ms': {
+                key: round(val * 1000, 2) for key, val in totals.items()},
+        }, sort_keys=True))
+        return response
+    return server_timing_tween
+
+
+def includeme(config):
+    global _enabled
+    _enabled = True
+    config.add_tween('ramses.timing.server_timing_tween_factory')
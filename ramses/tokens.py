@@ -0,0 +1,314 @@
+"""
+Stateless authentication with signed tokens.
+
+Tokens are issued on login and embed the userid, the groups of the user
+and the expiration time. They are signed with HMAC-SHA256 and sent in
+the `Authorization: Bearer <token>` request header. Checking a token
+and resolving principals of a request doesn't need a DB lookup.
+
+Token has the form `<key id>.<payload>.<signature>` where payload is
+base64-encoded JSON. Signing keys are rotated by adding a new key in
+front of the list of keys: new tokens are signed with the first key,
+while tokens signed with other keys of the list stay valid until they
+expire.
+
+When revocation checks are enabled, groups of the token user are
+loaded from DB at most once per `revocation_check_interval` seconds per
+worker. Tokens of users that were deleted or whose groups changed are
+rejected. Tokens forgotten on logout are rejected by the worker that
+handled the logout until they expire.
+
+`request.user` is a `TokenUser` built from the token, so ACLs and
+privacy rules don't need DB access either. The user is only loaded from
+DB when attributes other than its primary key and groups are read.
+"""
+import hmac
+import json
+import time
+import base64
+import hashlib
+import logging
+
+import six
+from zope.interface import implementer
+from pyramid.interfaces import IAuthenticationPolicy
+from pyramid.security import Everyone, Authenticated
+
+from .cache import TTLCache, get_request_cache
+
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_MAX_AGE = 3600
+DEFAULT_REVOCATION_CHECK_INTERVAL = 300
+DEFAULT_REVOCATION_CACHE_SIZE = 10000
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(value):
+    value = value.encode('ascii')
+    return base64.urlsafe_b64decode(value + b'=' * (-len(value) % 4))
+
+
+def _principal_group(principal):
+    """ Get group name of 'g:<group>' :principal: """
+    return principal[2:] if principal.startswith('g:') else principal
+
+
+class TokenUser(object):
+    """ Authenticated user built from signed token payload.
+
+    Holds the primary key and the groups of the user, which is enough to
+    apply ACLs and privacy rules. Other attributes are read from the
+    user loaded with `load_user` on first access. Passes isinstance
+    checks of `auth_model`.
+
+    Subclasses for auth models are created by `token_user_class`.
+    """
+    auth_model = None
+    load_user = None
+
+    def __init__(self, userid, groups, request):
+        self._request = request
+        self._user = None
+        self.groups = [_principal_group(group) for group in groups]
+        setattr(self, self.pk_field(), userid)
+
+    @property
+    def __class__(self):
+        return self.auth_model
+
+    @classmethod
+    def pk_field(cls):
+        return cls.auth_model.pk_field()
+
+    @classmethod
+    def is_admin(cls, user):
+        return cls.auth_model.is_admin(user)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._user is None:
+            self._user = self.load_user(self._request)
+        return getattr(self._user, name)
+
+
+def token_user_class(auth_model, load_user):
+    """ Create TokenUser subclass for :auth_model:.
+
+    :param load_user: Callable that gets the user of a request from DB.
+    """
+    return type(auth_model.__name__, (TokenUser,), {
+        'auth_model': auth_model,
+        'load_user': staticmethod(load_user),
+    })
+
+
+def _to_bytes(value):
+    if isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    return value
+
+
+class TokenSigner(object):
+    """ Signs and verifies tokens with HMAC-SHA256.
+
+    :param secrets: List of secret keys. The first key signs new tokens,
+        all the keys verify tokens.
+    """
+    def __init__(self, secrets):
+        if not secrets:
+            raise ValueError('At least one token secret is required')
+        self.keys = [
+            (self.key_id(secret), _to_bytes(secret)) for secret in secrets]
+        self._keys_map = dict(self.keys)
+
+    @staticmethod
+    def key_id(secret):
+        """ Get id of key :secret: which is stored in tokens. """
+        return hashlib.sha256(_to_bytes(secret)).hexdigest()[:8]
+
+    @staticmethod
+    def _signature(key, message):
+        return _b64encode(hmac.new(key, message, hashlib.sha256).digest())
+
+    def sign(self, payload):
+        """ Create token of :payload: dict. """
+        key_id, key = self.keys[0]
+        data = json.dumps(payload, separators=(',', ':'), sort_keys=True)
+        message = '{}.{}'.format(key_id, _b64encode(data.encode('utf-8')))
+        signature = self._signature(key, message.encode('ascii'))
+        return '{}.{}'.format(message, signature)
+
+    def verify(self, token):
+        """ Get payload of :token:.
+
+        Returns None if token is malformed, is signed with unknown key
+        or its signature doesn't match.
+        """
+        try:
+            key_id, data, signature = token.split('.')
+            key = self._keys_map.get(key_id)
+            if key is None:
+                return None
+            message = '{}.{}'.format(key_id, data).encode('ascii')
+            expected = self._signature(key, message)
+            if not hmac.compare_digest(
+                    expected.encode('ascii'), signature.encode('ascii')):
+                return None
+            return json.loads(_b64decode(data).decode('utf-8'))
+        except (ValueError, TypeError, UnicodeError):
+            return None
+
+
+@implementer(IAuthenticationPolicy)
+class SignedTokenAuthenticationPolicy(object):
+    """ Authentication policy that uses signed tokens.
+
+    :param auth_model: Auth model class. Its `get_groups_by_userid` is
+        used to get groups of users when tokens are issued and checked
+        for revocation.
+    :param secrets: List of secret keys. See `TokenSigner`.
+    :param max_age: Number of seconds tokens are valid for.
+    :param revocation_check_interval: Number of seconds groups of a user
+        are cached for by revocation checks. Revocation checks are
+        disabled if 0.
+    :param revocation_cache_size: Max number of users whose groups are
+        cached by revocation checks and max number of tokens revoked on
+        logout.
+    :param load_user: Callable that gets the user of a request from DB.
+        Used to load attributes of `TokenUser` that token doesn't have.
+        Defaults to `auth_model.get_authuser_by_userid`.
+    """
+    def __init__(self, auth_model, secrets, max_age=DEFAULT_MAX_AGE,
+                 revocation_check_interval=DEFAULT_REVOCATION_CHECK_INTERVAL,
+                 revocation_cache_size=DEFAULT_REVOCATION_CACHE_SIZE,
+                 load_user=None):
+        self.auth_model = auth_model
+        self.signer = TokenSigner(secrets)
+        self.max_age = max_age
+        self.revocation_check_interval = revocation_check_interval
+        self.current_groups = TTLCache(
+            revocation_cache_size, revocation_check_interval,
+            name='signed_token_users')
+        self.revoked_tokens = TTLCache(
+            revocation_cache_size, max_age, name='signed_token_revoked')
+        if load_user is None:
+            load_user = auth_model.get_authuser_by_userid
+        self.user_cls = token_user_class(auth_model, load_user)
+
+    def issue(self, userid, groups, now=None):
+        """ Create token of user :userid: who belongs to :groups:. """
+        if now is None:
+            now = int(time.time())
+        if not isinstance(userid, six.integer_types):
+            userid = str(userid)
+        return self.signer.sign({
+            'uid': userid,
+            'grp': list(groups),
+            'iat': now,
+            'exp': now + self.max_age,
+        })
+
+    @staticmethod
+    def _get_token(request):
+        scheme, _, token = request.headers.get(
+            'Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer':
+            return token.strip() or None
+
+    def _is_current(self, payload, request):
+        """ Check groups of token :payload: match groups of its user. """
+        userid = payload['uid']
+        entry = self.current_groups.get(str(userid))
+        if entry is None:
+            entry = (self.auth_model.get_groups_by_userid(userid, request),)
+            self.current_groups.set(str(userid), entry)
+        groups = entry[0]
+        return groups is not None and sorted(groups) == sorted(payload['grp'])
+
+    def _verify(self, request):
+        token = self._get_token(request)
+        if token is None:
+            return None
+        payload = self.signer.verify(token)
+        if not isinstance(payload, dict):
+            return None
+        if self.revoked_tokens.get(token) is not None:
+            return None
+        try:
+            if payload['exp'] < time.time():
+                return None
+            if (self.revocation_check_interval and
+                    not self._is_current(payload, request)):
+                log.info('Token of user {} is revoked'.format(
+                    payload['uid']))
+                return None
+        except (KeyError, TypeError):
+            return None
+        return payload
+
+    def get_payload(self, request):
+        """ Get payload of valid token of :request: or None. """
+        cache = get_request_cache(request, 'signed_token')
+        if 'payload' not in cache:
+            cache['payload'] = self._verify(request)
+        return cache['payload']
+
+    def get_user(self, request):
+        """ Get TokenUser of valid token of :request: or None. """
+        payload = self.get_payload(request)
+        if payload is not None:
+            return self.user_cls(payload['uid'], payload['grp'], request)
+
+    def invalidate(self, event):
+        """ Drop cached groups of users changed by model :event:. """
+        user = getattr(event, 'instance', None)
+        if user is None:
+            self.current_groups.clear()
+        else:
+            userid = getattr(user, self.auth_model.pk_field(), None)
+            self.current_groups.discard(str(userid))
+
+    def unauthenticated_userid(self, request):
+        token = self._get_token(request)
+        payload = self.signer.verify(token) if token else None
+        if isinstance(payload, dict):
+            return payload.get('uid')
+
+    def authenticated_userid(self, request):
+        payload = self.get_payload(request)
+        if payload is not None:
+            return payload['uid']
+
+    def effective_principals(self, request):
+        principals = [Everyone]
+        payload = self.get_payload(request)
+        if payload is not None:
+            principals += [Authenticated, payload['uid']]
+            principals += payload['grp']
+        return principals
+
+    def remember(self, request, userid, **kw):
+        """ Issue token of user :userid:.
+
+        Returns `Authorization` header with the token.
+        """
+        groups = self.auth_model.get_groups_by_userid(userid, request)
+        if groups is None:
+            return []
+        return [('Authorization', 'Bearer ' + self.issue(userid, groups))]
+
+    def forget(self, request):
+        """ Revoke token of :request: until it expires. """
+        token = self._get_token(request)
+        payload = self.get_payload(request)
+        if payload is not None:
+            ttl = max(payload['exp'] - time.time(), 0)
+            self.revoked_tokens.set(token, True, ttl=ttl)
+        return []
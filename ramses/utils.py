@@ -360,4 +360,36 @@ def get_resource_uri(raml_resource):
 
     :param raml_resource: Instance of ramlfications.raml.ResourceNode.
     """
-    return raml_resource.path.split('/')[-1].strip()
\ No newline at end of file
+    return raml_resource.path.split('/')[-1].strip()
+
+
+def is_sqla_model(model_cls):
+    """ Determine if :model_cls: is a nefertari-sqla model. """
+    return hasattr(model_cls, '__table__')
+
+
+def is_mongo_model(model_cls):
+    """ Determine if :model_cls: is a nefertari-mongodb model. """
+    return hasattr(model_cls, '_get_collection')
+
+
+def get_model_field_names(model_cls):
+    """ Get names of DB fields of :model_cls:.
+
+    :param model_cls: Generated model class.
+    """
+    if is_sqla_model(model_cls):
+        return list(model_cls.__table__.columns.keys())
+    if is_mongo_model(model_cls):
+        return list(model_cls._fields.keys())
+    return []
+
+
+def json_default(value):
+    """ Serialize :value: that isn't JSON serializable, e.g. dates.
+
+    Used as `default` of `json.dumps`.
+    """
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return six.text_type(value)
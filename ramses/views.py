@@ -2,10 +2,19 @@
 import logging
 
 import six
+from nefertari import wrappers
 from nefertari.view import BaseView as NefertariBaseView
-from nefertari.json_httpexceptions import JHTTPNotFound
+from nefertari.json_httpexceptions import (
+    JHTTPNotFound, JHTTPMethodNotAllowed)
 
 from .utils import patch_view_model
+from .cache import share_request_cache
+from .iterables import supports_atomic_update, atomic_update_iterables
+from .aggregations import ESAggregator
+from .serializers import apply_compiled_privacy
+from .prefetch import prefetch_relationships
+from .timing import timed, timed_method
+from .esclient import get_es_accessor
 
 
 log = logging.getLogger(__name__)
@@ -38,9 +47,8 @@ class SetObjectACLMixin(object):
     def set_object_acl(self, obj):
         """ Set object ACL on creation if not already present. """
         if not obj._acl:
-            from nefertari_guards import engine as guards_engine
-            acl = self._factory(self.request).generate_item_acl(obj)
-            obj._acl = guards_engine.ACLField.stringify_acl(acl)
+            from .acl import stringify_item_acl
+            obj._acl = stringify_item_acl(self.request, self._factory, obj)
 
 
 class BaseView(object):
@@ -60,6 +68,16 @@ class BaseView(object):
     def set_object_acl(self, obj):
         pass
 
+    def setup_default_wrappers(self):
+        """ Replace nefertari `apply_privacy` wrappers with wrappers that
+        use serializers precompiled for generated models.
+        """
+        super(BaseView, self).setup_default_wrappers()
+        for calls in self._after_calls.values():
+            for index, call in enumerate(calls):
+                if isinstance(call, wrappers.apply_privacy):
+                    calls[index] = apply_compiled_privacy(self.request)
+
     def resolve_kw(self, kwargs):
         """ Resolve :kwargs: like `story_id: 1` to the form of `id: 1`.
 
@@ -83,6 +101,7 @@ class BaseView(object):
             self._resource.uid,
             **{self._resource.id_name: getattr(obj, field_name)})
 
+    @timed_method('parent')
     def _parent_queryset(self):
         """ Get queryset of parent view.
 
@@ -92,6 +111,7 @@ class BaseView(object):
         if hasattr(parent, 'view'):
             req = self.request.blank(self.request.path)
             req.registry = self.request.registry
+            share_request_cache(self.request, req)
             req.matchdict = {
                 parent.id_name: self.request.matchdict.get(parent.id_name)}
             parent_view = parent.view(parent.view._factory, req)
@@ -101,6 +121,7 @@ class BaseView(object):
             prop = self._resource.collection_name
             return getattr(obj, prop, None)
 
+    @timed_method('db')
     def get_collection(self, **kwargs):
         """ Get objects collection taking into account generated queryset
         of parent view.
@@ -117,6 +138,7 @@ class BaseView(object):
                 objects, **self._query_params)
         return self.Model.get_collection(**self._query_params)
 
+    @timed_method('db')
     def get_item(self, **kwargs):
         """ Get collection item taking into account generated queryset
         of parent view.
@@ -139,16 +161,42 @@ class BaseView(object):
 
         return self.context
 
+    def prefetch_relationships(self, objects):
+        """ Load relationships of collection :objects: in batches
+        before they are serialized.
+        """
+        return prefetch_relationships(
+            self.Model, objects, fields=self._query_params.get('_fields'))
+
     def _get_context_key(self, **kwargs):
         """ Get value of `self._resource.id_name` from :kwargs: """
         return str(kwargs.get(self._resource.id_name))
 
+    def _is_head_request(self):
+        return self.request.method == 'HEAD'
+
+    def _head_response(self, count=None):
+        """ Get response to HEAD request which is returned without
+        serializing objects.
+
+        Arguments:
+            :count: Number of objects in collection to be returned in
+                `X-Total-Count` header.
+        """
+        response = self.request.response
+        response.content_type = 'application/json'
+        if count is not None:
+            response.headers['X-Total-Count'] = str(count)
+        return response
+
     def reload_context(self, es_based, **kwargs):
         """ Reload `self.context` object into a DB or ES object.
 
         A reload is performed by getting the object ID from :kwargs: and then
         getting a context key item from the new instance of `self._factory`
-        which is an ACL class used by the current view.
+        which is an ACL class used by the current view. Objects already
+        loaded during the current request are taken from the request
+        identity map by the ACL.
 
         Arguments:
             :es_based: Boolean. Whether to init ACL ac es-based or not. This
@@ -156,8 +204,18 @@ class BaseView(object):
             :kwargs: Kwargs that contain value for current resource 'id_name'
                 key
         """
-        from .acl import BaseACL
         key = self._get_context_key(**kwargs)
+        acl = self._get_acl(es_based=es_based)
+        with timed(self.request, 'es' if es_based else 'db'):
+            self.context = acl[key]
+
+    def _get_acl(self, es_based):
+        """ Get new instance of `self._factory` ACL class.
+
+        Arguments:
+            :es_based: Boolean. Whether to init ACL as es-based or not.
+        """
+        from .acl import BaseACL
         kwargs = {'request': self.request}
         if issubclass(self._factory, BaseACL):
             kwargs['es_based'] = es_based
@@ -165,26 +223,133 @@ class BaseView(object):
         acl = self._factory(**kwargs)
         if acl.item_model is None:
             acl.item_model = self.Model
+        return acl
 
-        self.context = acl[key]
+    def _pop_ids_param(self):
+        """ Pop and parse comma-separated `_ids` query param.
+
+        Returns list of unique IDs in the order they were requested or
+        None if param is not present.
+        """
+        ids = self._query_params.pop('_ids', None)
+        if ids is None:
+            return None
+        if isinstance(ids, six.string_types):
+            ids = ids.split(',')
+        unique_ids = []
+        for id_ in ids:
+            id_ = str(id_).strip()
+            if id_ and id_ not in unique_ids:
+                unique_ids.append(id_)
+        return unique_ids
+
+    def _viewable_items(self, ids, objects, es_based):
+        """ Order :objects: by :ids: and drop objects current user is not
+        allowed to view according to item ACL.
+
+        Returns list of objects which contains `_nefertari_meta` with IDs
+        of missing objects under the 'missing' key.
+
+        Arguments:
+            :ids: List of requested object IDs.
+            :objects: Found objects.
+            :es_based: Boolean indicating whether :objects: are ES objects.
+        """
+        from nefertari.resource import PERMISSIONS
+        pk_field = self.Model.pk_field()
+        acl = self._get_acl(es_based=es_based)
+        found = {str(getattr(obj, pk_field)): obj for obj in objects}
+
+        items = ItemsList()
+        missing = []
+        for id_ in ids:
+            obj = found.get(id_)
+            if obj is not None and hasattr(acl, 'item_acl'):
+                obj.__acl__ = acl.item_acl(obj)
+                obj.__parent__ = acl
+                obj.__name__ = id_
+                if not self.request.has_permission(PERMISSIONS['show'], obj):
+                    obj = None
+            if obj is None:
+                missing.append(id_)
+            else:
+                items.append(obj)
+
+        items._nefertari_meta = dict(
+            total=len(items),
+            start=0,
+            fields=self._query_params.get('_fields'),
+            missing=missing,
+        )
+        return items
+
+    @timed_method('db')
+    def get_items(self, ids):
+        """ Get multiple collection items by :ids: using a single DB query.
+
+        Objects are returned in the order of :ids:. Objects which are not
+        found, don't belong to parent view's queryset or can't be viewed
+        according to item ACL are listed as missing.
+        """
+        requested_ids = ids
+        objects = self._parent_queryset()
+        if objects is not None:
+            pk_field = self.Model.pk_field()
+            parent_ids = set(str(getattr(obj, pk_field)) for obj in objects)
+            ids = [id_ for id_ in ids if id_ in parent_ids]
+        found = []
+        if ids:
+            found = self.Model.get_collection(**{
+                self.Model.pk_field(): ids,
+                '_limit': len(ids),
+            })
+            found = self.prefetch_relationships(found)
+        return self._viewable_items(requested_ids, found, es_based=False)
+
+
+class ItemsList(list):
+    """ List of objects returned by multi-get views. """
 
 
 class CollectionView(BaseView):
     """ View that works with database and implements handlers for all
     available CRUD operations.
 
+    Collection GET requests with `_ids` query param (e.g.
+    /stories?_ids=1,2,3) return items with given IDs.
+
+    HEAD requests are handled without loading and serializing the
+    collection: collection HEAD returns the number of objects in
+    `X-Total-Count` header.
+
+    Relationships of returned objects are loaded in batches.
     """
     def index(self, **kwargs):
+        if self._is_head_request():
+            return self._head_response(count=self.count())
+        ids = self._pop_ids_param()
+        if ids is not None:
+            return self.get_items(ids)
+        return self.prefetch_relationships(self.get_collection())
+
+    def count(self):
+        """ Count objects in collection without loading them. """
+        self._query_params['_count'] = True
         return self.get_collection()
 
     def show(self, **kwargs):
-        return self.get_item(**kwargs)
+        obj = self.get_item(**kwargs)
+        if self._is_head_request():
+            return self._head_response()
+        return obj
 
+    @timed_method('db')
     def create(self, **kwargs):
         obj = self.Model(**self._json_params)
         self.set_object_acl(obj)
         return obj.save(self.request)
 
+    @timed_method('db')
     def update(self, **kwargs):
         obj = self.get_item(**kwargs)
         return obj.update(self._json_params, self.request)
@@ -192,14 +357,17 @@ class CollectionView(BaseView):
     def replace(self, **kwargs):
         return self.update(**kwargs)
 
+    @timed_method('db')
     def delete(self, **kwargs):
         obj = self.get_item(**kwargs)
         obj.delete(self.request)
 
+    @timed_method('db')
     def delete_many(self, **kwargs):
         objects = self.get_collection()
         return self.Model._delete_many(objects, self.request)
 
+    @timed_method('db')
     def update_many(self, **kwargs):
         objects = self.get_collection(**self._query_params)
         return self.Model._update_many(
@@ -216,6 +384,7 @@ class ESBaseView(BaseView):
     to the set of objects and individual object respectively which are
     valid at the current level.
     """
+    @timed_method('parent')
     def _parent_queryset_es(self):
         """ Get queryset (list of object IDs) of parent view.
 
@@ -226,6 +395,7 @@ class ESBaseView(BaseView):
         if hasattr(parent, 'view'):
             req = self.request.blank(self.request.path)
             req.registry = self.request.registry
+            share_request_cache(self.request, req)
             req.matchdict = {
                 parent.id_name: self.request.matchdict.get(parent.id_name)}
             parent_view = parent.view(parent.view._factory, req)
@@ -236,10 +406,13 @@ class ESBaseView(BaseView):
 
     def get_es_object_ids(self, objects):
         """ Return IDs of :objects: if they are not IDs already. """
+        if not objects:
+            return []
         id_field = self.clean_id_name
         ids = [getattr(obj, id_field, obj) for obj in objects]
         return list(set(str(id_) for id_ in ids))
 
+    @timed_method('es')
     def get_collection_es(self):
         """ Get ES objects collection taking into account the generated
         queryset of parent view.
@@ -249,16 +422,82 @@ class ESBaseView(BaseView):
         queryset, thus filtering out objects that don't belong to the parent
         object.
         """
+        if not self._limit_to_parent_es() or self._items_denied_es():
+            return 0 if '_count' in self._query_params else []
+
+        return super(ESBaseView, self).get_collection_es()
+
+    def _items_denied_es(self):
+        """ Determine if static item ACL denies the current user to view
+        all items of collection.
+
+        Items of such collections are not queried from ES, thus listings
+        and counts don't include them. Not applicable when ACLs are
+        stored in database, as these are filtered by ES itself.
+        """
+        from .acl import BaseACL
+        if isinstance(self, SetObjectACLMixin):
+            return False
+        if not getattr(self, '_auth_enabled', True):
+            return False
+        factory = getattr(self, '_factory', None)
+        if not (isinstance(factory, type) and issubclass(factory, BaseACL)):
+            return False
+        acl = self._get_acl(es_based=True)
+        principals = self.request.effective_principals
+        return acl.static_item_decision(principals, 'view') is False
+
+    def _limit_to_parent_es(self, params=None):
+        """ Limit ES query :params: (defaults to `self._query_params`)
+        to IDs of objects from parent view's queryset.
+
+        Returns False if parent view's queryset is empty.
+        """
+        if params is None:
+            params = self._query_params
         objects_ids = self._parent_queryset_es()
 
         if objects_ids is not None:
             objects_ids = self.get_es_object_ids(objects_ids)
             if not objects_ids:
-                return []
-            self._query_params['id'] = objects_ids
+                return False
+            params['id'] = objects_ids
+        return True
 
-        return super(ESBaseView, self).get_collection_es()
+    def _setup_aggregation(self, aggregator=None):
+        if aggregator is None:
+            aggregator = ESAggregator
+        super(ESBaseView, self)._setup_aggregation(aggregator=aggregator)
+
+    def get_aggregations_es(self):
+        """ Perform aggregations defined in `_aggregate` query param
+        using a single ES request.
 
+        Only fields that may be displayed to the current user can be
+        aggregated. See `ramses.aggregations.ESAggregator`.
+        """
+        return ESAggregator(self).aggregate()
+
+    @timed_method('es')
+    def aggregate_es(self, aggregations, params):
+        """ Perform ES :aggregations: on objects that match query
+        :params: and belong to parent view's queryset.
+        """
+        from nefertari.elasticsearch import ES
+        params = dict(params)
+        if not self._limit_to_parent_es(params) or self._items_denied_es():
+            return {}
+
+        params['_aggregations_params'] = aggregations
+        if isinstance(self, SetObjectACLMixin):
+            from nefertari_guards.elasticsearch import ACLFilterES
+            es = get_es_accessor(ACLFilterES, self.Model.__name__)
+            params['request'] = self.request
+        else:
+            es = get_es_accessor(ES, self.Model.__name__)
+        return es.aggregate(**params)
+
+    @timed_method('es')
     def get_item_es(self, **kwargs):
         """ Get ES collection item taking into account generated queryset
         of parent view.
@@ -284,17 +523,56 @@ class ESBaseView(BaseView):
 
         return self.context
 
+    @timed_method('es')
+    def get_items_es(self, ids):
+        """ Get multiple collection items by :ids: using ES mget.
+
+        Objects are returned in the order of :ids:. Objects which are not
+        found, don't belong to parent view's queryset or can't be viewed
+        according to item ACL are listed as missing.
+        """
+        from nefertari.elasticsearch import ES
+        requested_ids = ids
+        objects_ids = self._parent_queryset_es()
+        if objects_ids is not None:
+            parent_ids = set(self.get_es_object_ids(objects_ids))
+            ids = [id_ for id_ in ids if id_ in parent_ids]
+        found = []
+        if ids:
+            model_name = self.Model.__name__
+            found = get_es_accessor(ES, model_name).get_by_ids(
+                [{'_type': model_name, '_id': id_} for id_ in ids],
+                _limit=len(ids))
+        return self._viewable_items(requested_ids, found, es_based=True)
+
 
 class ESCollectionView(ESBaseView, CollectionView):
     """ View that reads data from ES.
 
     Write operations are inherited from :CollectionView:
+    Collection GET requests with `_aggregate` query param return results
+    of ES aggregations. See `ramses.aggregations` for details.
     """
     def index(self, **kwargs):
+        if self._is_head_request():
+            return self._head_response(count=self.count_es())
+        if '_aggregate' in self._query_params:
+            return self.get_aggregations_es()
+        ids = self._pop_ids_param()
+        if ids is not None:
+            return self.get_items_es(ids)
+        return self.get_collection_es()
+
+    def count_es(self):
+        """ Count objects in collection using ES count API. """
+        self._query_params['_count'] = True
         return self.get_collection_es()
 
     def show(self, **kwargs):
-        return self.get_item_es(**kwargs)
+        obj = self.get_item_es(**kwargs)
+        if self._is_head_request():
+            return self._head_response()
+        return obj
 
     def update(self, **kwargs):
         """ Explicitly reload context with DB usage to get access
@@ -375,7 +653,14 @@ class ItemAttributeView(ItemSubresourceBaseView):
     You may subclass ItemAttributeView in your project when you want to
     define custom attribute subroute and view of a item route defined in
     RAML and generated by ramses.
+
+    Set `atomic_iterables` to True to update supported fields using
+    native database operations instead of saving the whole parent object.
+    Fields that have field processors and fields of models that have
+    event handlers are always updated by saving the parent object.
     """
+    atomic_iterables = False
+
     def __init__(self, *args, **kw):
         super(ItemAttributeView, self).__init__(*args, **kw)
         self.attr = self.request.path.split('/')[-1]
@@ -386,8 +671,14 @@ class ItemAttributeView(ItemSubresourceBaseView):
         obj = self.get_item(**kwargs)
         return getattr(obj, self.attr)
 
+    @timed_method('db')
     def create(self, **kwargs):
         obj = self.get_item(**kwargs)
+        if self.atomic_iterables and supports_atomic_update(
+                type(obj), self.attr):
+            return atomic_update_iterables(
+                obj, self._json_params, self.attr, unique=self.unique,
+                value_type=self.value_type, request=self.request)
         obj.update_iterables(
             self._json_params, self.attr,
             unique=self.unique,
@@ -422,6 +713,7 @@ class ItemSingularView(ItemSubresourceBaseView):
         parent_obj = self.get_item(**kwargs)
         return getattr(parent_obj, self.attr)
 
+    @timed_method('db')
     def create(self, **kwargs):
         parent_obj = self.get_item(**kwargs)
         obj = self.Model(**self._json_params)
@@ -430,6 +722,7 @@ class ItemSingularView(ItemSubresourceBaseView):
         parent_obj.update({self.attr: obj}, self.request)
         return obj
 
+    @timed_method('db')
     def update(self, **kwargs):
         parent_obj = self.get_item(**kwargs)
         obj = getattr(parent_obj, self.attr)
@@ -439,16 +732,29 @@ class ItemSingularView(ItemSubresourceBaseView):
     def replace(self, **kwargs):
         return self.update(**kwargs)
 
+    @timed_method('db')
     def delete(self, **kwargs):
         parent_obj = self.get_item(**kwargs)
         obj = getattr(parent_obj, self.attr)
         obj.delete(self.request)
 
 
+""" Map of {structural key: view class} of shared generated view bases """
+_view_classes = {}
+
+
+def _attr_error(*args, **kwargs):
+    raise AttributeError
+
+
 def generate_rest_view(config, model_cls, attrs=None, es_based=True,
                        attr_view=False, singular=False):
     """ Generate REST view for a model class.
 
+    Resources with the same base classes, model and supported methods
+    share a single generated base class. Each call returns a new thin
+    subclass of it.
+
     :param model_cls: Generated DB model class.
     :param attr: List of strings that represent names of view methods, new
         generated view should support. Not supported methods are replaced
@@ -481,12 +787,69 @@ def generate_rest_view(config, model_cls, attrs=None, es_based=True,
         bases = [SetObjectACLMixin] + bases + [ACLFilterViewMixin]
     bases.append(NefertariBaseView)
 
-    RESTView = type('RESTView', tuple(bases), {'Model': model_cls})
+    class_attrs = {'Model': model_cls}
+    if attr_view:
+        class_attrs['atomic_iterables'] = config.registry.atomic_iterables
+
+    key = (tuple(bases), frozenset(missing_attrs),
+           tuple(sorted(class_attrs.items())))
+    base = _view_classes.get(key)
+    if base is None:
+        base = type('RESTViewBase', tuple(bases), class_attrs)
+        for attr in missing_attrs:
+            setattr(base, attr, property(_attr_error))
+        _view_classes[key] = base
+    else:
+        log.debug('Reusing generated view base class')
+
+    # Resource-specific attributes are set on view classes when
+    # resources are created, so each resource gets its own subclass
+    return type('RESTView', (base,), {})
+
+
+def _http_methods(methods_map, attrs, exclude=()):
+    return frozenset(
+        method.upper() for method, attr in methods_map.items()
+        if attr in attrs and method not in exclude)
 
-    def _attr_error(*args, **kwargs):
-        raise AttributeError
 
-    for attr in missing_attrs:
-        setattr(RESTView, attr, property(_attr_error))
+def get_allowed_methods(attrs, singular=False):
+    """ Get HTTP methods allowed on routes of a generated resource.
 
-    return RESTView
\ No newline at end of file
+    Returns tuple of (collection methods, item methods) where each
+    element is a frozenset of uppercase HTTP method names.
+
+    :param attrs: Names of view methods supported by resource view.
+    :param singular: Boolean indicating if resource is singular.
+    """
+    if singular:
+        methods = _http_methods(item_methods, attrs)
+        return methods, methods
+    return (
+        _http_methods(collection_methods, attrs),
+        _http_methods(item_methods, attrs, exclude=('post',)),
+    )
+
+
+def reject_not_allowed_methods(event):
+    """ Respond with 405 to requests with HTTP methods that generated
+    resource doesn't support.
+
+    Subscribed to `BeforeTraversal`, thus disallowed requests are
+    rejected before ACL context and view are created. Allowed methods of
+    generated resources are looked up by route name in
+    `registry.allowed_methods`.
+    """
+    request = event.request
+    route = getattr(request, 'matched_route', None)
+    if route is None:
+        return
+    allowed_methods = getattr(request.registry, 'allowed_methods', {})
+    methods = allowed_methods.get(route.name)
+    if methods is None:
+        return
+    if request.method not in methods:
+        error = JHTTPMethodNotAllowed(
+            'Method {} is not allowed'.format(request.method))
+        error.headers['Allow'] = ', '.join(sorted(methods))
+        raise error
@@ -54,4 +54,6 @@ def config_mock():
     from mock import Mock
     config = Mock()
     config.registry.database_acls = False
+    config.registry.atomic_iterables = False
+    config.registry.allowed_methods = {}
     return config
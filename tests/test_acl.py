@@ -1,4 +1,6 @@
 
+import random
+
 import pytest
 from mock import Mock, patch, call
 from pyramid.security import (
@@ -45,7 +47,7 @@ class TestACLHelpers(object):
 
     def test_parse_acl_no_string(self):
         perms = acl.parse_acl('')
-        assert perms == [acl.ALLOW_ALL]
+        assert perms == (acl.ALLOW_ALL,)
 
     def test_parse_acl_unknown_action(self):
         with pytest.raises(ValueError) as ex:
@@ -71,14 +73,29 @@ class TestACLHelpers(object):
         mock_perms.return_value = 'Foo'
         perms = acl.parse_acl('allow everyone all')
         mock_perms.assert_called_once_with(['all'])
-        assert perms == [(Allow, Everyone, 'Foo')]
+        assert perms == ((Allow, Everyone, 'Foo'),)
+
+    def test_parse_acl_interned(self):
+        perms = acl.parse_acl('allow everyone view;deny g:admin all')
+        assert acl.parse_acl(
+            'allow everyone view\ndeny g:admin all;') is perms
+        assert acl.parse_acl('allow everyone create') is not perms
+        assert acl.parse_acl('') is acl.parse_acl(None)
+
+    def test_intern_acl_immutable(self):
+        perms = ['view']
+        parsed = acl.intern_acl([(Allow, 'g:intern', perms)])
+        assert parsed == ((Allow, 'g:intern', ('view',)),)
+        perms.append('delete')
+        assert acl.intern_acl([(Allow, 'g:intern', ['view'])]) is parsed
+        assert parsed[0][2] == ('view',)
 
     @patch.object(acl, 'parse_permissions')
     def test_parse_acl_group_principal(self, mock_perms):
         mock_perms.return_value = 'Foo'
         perms = acl.parse_acl('allow g:admin all')
         mock_perms.assert_called_once_with(['all'])
-        assert perms == [(Allow, 'g:admin', 'Foo')]
+        assert perms == ((Allow, 'g:admin', 'Foo'),)
 
     @patch.object(acl, 'resolve_to_callable')
     @patch.object(acl, 'parse_permissions')
@@ -88,12 +105,15 @@ class TestACLHelpers(object):
         perms = acl.parse_acl('allow {{my_user}} all')
         mock_perms.assert_called_once_with(['all'])
         mock_res.assert_called_once_with('{{my_user}}')
-        assert perms == [(Allow, 'registry callable', 'Foo')]
+        assert perms == ((Allow, 'registry callable', 'Foo'),)
 
 
 @patch.object(acl, 'parse_acl')
 class TestGenerateACL(object):
 
+    def setup_method(self, method):
+        acl._acl_classes.clear()
+
     def test_no_security(self, mock_parse):
         config = config_mock()
         acl_cls = acl.generate_acl(
@@ -104,8 +124,8 @@ class TestGenerateACL(object):
         assert issubclass(acl_cls, acl.BaseACL)
         instance = acl_cls(request=None)
         assert instance.es_based
-        assert instance._collection_acl == []
-        assert instance._item_acl == []
+        assert instance._collection_acl == ()
+        assert instance._item_acl == ()
         assert not mock_parse.called
 
     def test_wrong_security_scheme_type(self, mock_parse):
@@ -122,10 +142,11 @@ class TestGenerateACL(object):
         assert issubclass(acl_cls, acl.BaseACL)
         instance = acl_cls(request=None)
         assert not instance.es_based
-        assert instance._collection_acl == []
-        assert instance._item_acl == []
+        assert instance._collection_acl == ()
+        assert instance._item_acl == ()
 
     def test_correct_security_scheme(self, mock_parse):
+        mock_parse.return_value = [(Allow, Everyone, ['view'])]
         raml_resource = Mock(security_schemes=[
             Mock(type='x-ACL', settings={'collection': 4, 'item': 7})
         ])
@@ -139,11 +160,13 @@ class TestGenerateACL(object):
             call(acl_string=7),
         ])
         instance = acl_cls(request=None)
-        assert instance._collection_acl == mock_parse()
-        assert instance._item_acl == mock_parse()
+        assert isinstance(instance._collection_acl, acl.CompiledACL)
+        assert instance._collection_acl == ((Allow, Everyone, ['view']),)
+        assert instance._item_acl is instance._collection_acl
         assert not instance.es_based
 
     def test_database_acls_option(self, mock_parse):
+        mock_parse.return_value = []
         raml_resource = Mock(security_schemes=[
             Mock(type='x-ACL', settings={'collection': 4, 'item': 7})
         ])
@@ -160,6 +183,25 @@ class TestGenerateACL(object):
         acl_cls = acl.generate_acl(config, **kwargs)
         assert issubclass(acl_cls, acl.DatabaseACLMixin)
 
+    def test_identical_acls_share_class(self, mock_parse):
+        mock_parse.side_effect = lambda acl_string: [
+            (Allow, Everyone, [acl_string])]
+        config = config_mock()
+
+        def generate(model_cls='Foo', item='view', es_based=True):
+            raml_resource = Mock(security_schemes=[Mock(
+                type='x-ACL',
+                settings={'collection': 'view', 'item': item})])
+            return acl.generate_acl(
+                config, model_cls=model_cls,
+                raml_resource=raml_resource, es_based=es_based)
+
+        acl_cls = generate()
+        assert generate() is acl_cls
+        assert generate(model_cls='Bar') is not acl_cls
+        assert generate(item='update') is not acl_cls
+        assert generate(es_based=False) is not acl_cls
+
 
 class TestBaseACL(object):
 
@@ -252,7 +294,8 @@ class TestBaseACL(object):
         assert result == obj._apply_callables()
 
     def test_magic_getitem_es_based(self):
-        obj = acl.BaseACL('req')
+        obj = acl.BaseACL(Mock())
+        obj.item_model = Mock(__name__='Foo')
         obj.item_db_id = Mock(return_value=42)
         obj.getitem_es = Mock()
         obj.es_based = True
@@ -260,10 +303,42 @@ class TestBaseACL(object):
         obj.item_db_id.assert_called_once_with(1)
         obj.getitem_es.assert_called_once_with(42)
 
+    def test_magic_getitem_identity_map(self):
+        from ramses.cache import get_identity_map
+        request = Mock()
+        obj = acl.BaseACL(request)
+        obj.item_model = Mock(__name__='Foo')
+        obj.item_acl = Mock(return_value='acl')
+        obj.getitem_es = Mock(return_value=Mock())
+        obj.es_based = True
+        first = obj.__getitem__(1)
+        other = acl.BaseACL(request)
+        other.item_model = obj.item_model
+        other.item_acl = Mock(return_value='other acl')
+        other.es_based = True
+        assert other.__getitem__('1') is first
+        assert obj.getitem_es.call_count == 1
+        assert first.__acl__ == 'other acl'
+        assert first.__parent__ is other
+        assert get_identity_map(request).hits == 1
+
+    @patch('nefertari.acl.CollectionACL.__getitem__')
+    def test_magic_getitem_identity_map_backends(self, mock_getitem):
+        obj = acl.BaseACL(Mock())
+        obj.item_model = Mock(__name__='Foo')
+        obj.getitem_es = Mock(return_value=Mock())
+        obj.es_based = True
+        es_obj = obj.__getitem__(1)
+        obj.es_based = False
+        db_obj = obj.__getitem__(1)
+        mock_getitem.assert_called_once_with(1)
+        assert db_obj is not es_obj
+        assert obj.getitem_es.call_count == 1
+
     def test_magic_getitem_db_based(self):
-        obj = acl.BaseACL('req')
+        obj = acl.BaseACL(Mock())
         obj.item_db_id = Mock(return_value=42)
-        obj.item_model = Mock()
+        obj.item_model = Mock(__name__='Foo')
         obj.item_model.pk_field.return_value = 'id'
         obj.es_based = False
         obj.__getitem__(1)
@@ -285,4 +360,429 @@ class TestBaseACL(object):
         obj.item_acl.assert_called_once_with(found_obj)
         assert value.__acl__ == obj.item_acl()
         assert value.__parent__ is obj
-        assert value.__name__ == 'varvar'
\ No newline at end of file
+        assert value.__name__ == 'varvar'
+
+
+class TestCompiledACL(object):
+
+    def test_decision_table_first_match_wins(self):
+        table = acl.DecisionTable([
+            (Deny, 'g:banned', ALL_PERMISSIONS),
+            (Allow, Everyone, ['view']),
+            (Allow, 'g:admin', ALL_PERMISSIONS),
+            (Deny, Everyone, ['update']),
+        ])
+        assert table.decide(['g:banned', Everyone], 'view') == (
+            Deny, 'g:banned', ALL_PERMISSIONS)
+        assert table.decide([Everyone], 'view') == (
+            Allow, Everyone, ['view'])
+        assert table.decide([Everyone, 'g:admin'], 'update') == (
+            Allow, 'g:admin', ALL_PERMISSIONS)
+        assert table.decide([Everyone], 'update') == (
+            Deny, Everyone, ['update'])
+        assert table.decide([Everyone], 'delete') is None
+        assert table.decide(['g:admin'], 'delete') == (
+            Allow, 'g:admin', ALL_PERMISSIONS)
+
+    def test_decision_table_string_permission(self):
+        table = acl.DecisionTable([(Allow, Everyone, 'view')])
+        assert table.decide([Everyone], 'view') == (Allow, Everyone, 'view')
+        assert table.decide([Everyone], 'v') is None
+
+    def test_decision_table_cache(self):
+        table = acl.DecisionTable([(Allow, Everyone, ['view'])])
+        table.decide([Everyone], 'view')
+        assert table._cache == {
+            (frozenset([Everyone]), 'view'): (Allow, Everyone, ['view'])}
+        table.permissions = {}
+        assert table.decide([Everyone], 'view') == (
+            Allow, Everyone, ['view'])
+
+    def test_decision_table_cache_size(self):
+        table = acl.DecisionTable([(Allow, Everyone, ['view'])])
+        table.max_cache_size = 1
+        table.decide([Everyone], 'view')
+        table.decide(['u:1'], 'view')
+        assert list(table._cache) == [(frozenset(['u:1']), 'view')]
+
+    def test_compiled_acl_segments(self):
+        principal = lambda ace, request, obj: None
+        aces = [
+            (Allow, 'a', ['view']),
+            (Allow, 'b', ['view']),
+            (Deny, principal, ['view']),
+            (Allow, 'c', ['view']),
+        ]
+        compiled = acl.CompiledACL(aces)
+        assert compiled == tuple(aces)
+        assert compiled.has_callables
+        first, callable_ace, last = compiled.segments
+        assert first.aces == tuple(aces[:2])
+        assert callable_ace == aces[2]
+        assert last.aces == (aces[3],)
+
+    def test_compile_acl_shared(self):
+        first = acl.compile_acl([(Allow, 'a', ['view'])])
+        assert acl.compile_acl([(Allow, 'a', ['view'])]) is first
+        assert not first.has_callables
+        assert acl.compile_acl([(Allow, 'b', ['view'])]) is not first
+
+    def test_apply_callables_static_compiled(self):
+        compiled = acl.compile_acl([(Allow, 'a', ['view'])])
+        obj = acl.BaseACL('req')
+        assert obj._apply_callables(acl=compiled) is compiled
+
+    def test_apply_callables_compiled(self):
+        principal = Mock(return_value=(Allow, 'u:1', 'update'))
+        compiled = acl.CompiledACL([
+            (Allow, 'a', ['view']),
+            (Allow, principal, ['update']),
+        ])
+        obj = acl.BaseACL('req')
+        applied = obj._apply_callables(acl=compiled, obj='obj')
+        principal.assert_called_once_with(
+            ace=(Allow, principal, ['update']), request='req', obj='obj')
+        assert applied == (
+            (Allow, 'a', ['view']),
+            (Allow, 'u:1', ['update']),
+        )
+        assert not isinstance(applied, acl.CompiledACL)
+
+
+class TestCompiledACLAuthorizationPolicy(object):
+
+    def _context(self, acl_value, parent=None):
+        context = type('Context', (object,), {})()
+        context.__acl__ = acl_value
+        context.__parent__ = parent
+        return context
+
+    def test_compiled_acl(self):
+        policy = acl.CompiledACLAuthorizationPolicy()
+        compiled = acl.CompiledACL([
+            (Allow, 'g:admin', ALL_PERMISSIONS),
+            (Deny, Everyone, ALL_PERMISSIONS),
+        ])
+        context = self._context(compiled)
+        with patch.object(acl, '_find_ace') as mock_find:
+            assert policy.permits(context, [Everyone, 'g:admin'], 'delete')
+            result = policy.permits(context, [Everyone], 'view')
+        assert not mock_find.called
+        assert not result
+        assert result.ace == (Deny, Everyone, ALL_PERMISSIONS)
+
+    def test_plain_acl_and_lineage(self):
+        policy = acl.CompiledACLAuthorizationPolicy()
+        parent = self._context(acl.CompiledACL([(Allow, Everyone, 'view')]))
+        context = self._context(
+            lambda: [(Deny, 'u:1', ['view'])], parent=parent)
+        assert policy.permits(context, [Everyone], 'view')
+        assert not policy.permits(context, [Everyone, 'u:1'], 'view')
+
+    def test_compiled_acl_with_callables_walked(self):
+        policy = acl.CompiledACLAuthorizationPolicy()
+        principal = Mock()
+        context = self._context(acl.CompiledACL([
+            (Allow, principal, ['view']),
+            (Allow, Everyone, ['view']),
+        ]))
+        assert policy.permits(context, [Everyone], 'view')
+        assert not principal.called
+
+    def test_default_deny(self):
+        policy = acl.CompiledACLAuthorizationPolicy()
+        context = self._context(acl.CompiledACL([]))
+        result = policy.permits(context, [Everyone], 'view')
+        assert not result
+        assert result.ace == '<default deny>'
+
+
+class TestRequestPrincipals(object):
+
+    def test_request_principal(self):
+        def principal(ace, request, obj):
+            pass
+        assert acl.request_principal(principal) is principal
+        assert not principal.depends_on_obj
+
+    def test_request_principal_called_once(self):
+        principal = acl.request_principal(
+            Mock(return_value=(Allow, 'u:1', 'view')))
+        compiled = acl.CompiledACL([(Allow, principal, ['view'])])
+        obj = acl.BaseACL(Mock(_ramses_cache=None))
+        first = obj._apply_callables(acl=compiled, obj='foo')
+        second = obj._apply_callables(acl=compiled, obj='bar')
+        assert first == second == ((Allow, 'u:1', ['view']),)
+        principal.assert_called_once_with(
+            ace=(Allow, principal, ['view']), request=obj.request,
+            obj='foo')
+
+    def test_request_principal_cache_keyed_by_ace(self):
+        principal = acl.request_principal(Mock(return_value=None))
+        obj = acl.BaseACL(Mock(_ramses_cache=None))
+        obj._apply_callables(acl=[(Allow, principal, ['view'])])
+        obj._apply_callables(acl=[(Deny, principal, ['view'])])
+        obj._apply_callables(acl=[(Allow, principal, ['view'])])
+        assert principal.call_count == 2
+
+    def test_obj_principal_not_cached(self):
+        principal = Mock(return_value=None)
+        obj = acl.BaseACL(Mock(_ramses_cache=None))
+        obj._apply_callables(acl=[(Allow, principal, ['view'])], obj='foo')
+        obj._apply_callables(acl=[(Allow, principal, ['view'])], obj='foo')
+        assert principal.call_count == 2
+
+
+class TestStaticItemDecision(object):
+
+    def _acl(self, aces):
+        obj = acl.BaseACL('req')
+        obj._item_acl = acl.CompiledACL(aces)
+        return obj
+
+    def test_static_aces_decide(self):
+        obj = self._acl([
+            (Deny, 'g:banned', ALL_PERMISSIONS),
+            (Allow, Everyone, ['view']),
+        ])
+        assert obj.static_item_decision(['g:banned', Everyone], 'view') \
+            is False
+        assert obj.static_item_decision([Everyone], 'view') is True
+        assert obj.static_item_decision([Everyone], 'update') is None
+
+    def test_callable_principal_stops_decision(self):
+        principal = lambda ace, request, obj: None
+        obj = self._acl([
+            (Allow, 'g:admin', ALL_PERMISSIONS),
+            (Allow, principal, ['view']),
+            (Deny, Everyone, ALL_PERMISSIONS),
+        ])
+        assert obj.static_item_decision(['g:admin'], 'view') is True
+        assert obj.static_item_decision([Everyone], 'view') is None
+
+    def test_not_compiled(self):
+        obj = acl.BaseACL('req')
+        obj._item_acl = [(Deny, Everyone, ALL_PERMISSIONS)]
+        assert obj.static_item_decision([Everyone], 'view') is None
+
+
+class TestStringifyItemACL(object):
+
+    def setup_method(self, method):
+        acl._stringified_tables.clear()
+
+    def _stringify(self, aces):
+        return [{'action': a, 'principal': p, 'permission': perms}
+                for a, p, perms in aces]
+
+    def _patch_guards(self):
+        guards = Mock()
+        return patch.dict('sys.modules', {
+            'nefertari_guards': guards,
+            'nefertari_guards.engine': guards.engine,
+        }), guards.engine
+
+    def test_get_request_acl(self):
+        factory = Mock()
+        request = Mock(_ramses_cache=None)
+        first = acl.get_request_acl(request, factory)
+        assert acl.get_request_acl(request, factory) is first
+        factory.assert_called_once_with(request)
+
+    def test_stringified_static_parts_reused(self):
+        patch_guards, guards_engine = self._patch_guards()
+        stringify = guards_engine.ACLField.stringify_acl
+        stringify.side_effect = self._stringify
+        principal = Mock(return_value=(Allow, 'u:1', 'update'))
+        obj = acl.BaseACL(Mock(_ramses_cache=None))
+        obj._item_acl = acl.CompiledACL([
+            (Allow, 'g:admin', ALL_PERMISSIONS),
+            (Allow, principal, ['update']),
+        ])
+        with patch_guards:
+            first = obj.stringified_item_acl('item1')
+            second = obj.stringified_item_acl('item2')
+        assert first == second == [
+            {'action': Allow, 'principal': 'g:admin',
+             'permission': ALL_PERMISSIONS},
+            {'action': Allow, 'principal': 'u:1',
+             'permission': ['update']},
+        ]
+        assert first[0] is not second[0]
+        assert principal.call_count == 2
+        assert stringify.call_count == 3
+
+    def test_stringified_not_compiled(self):
+        patch_guards, guards_engine = self._patch_guards()
+        stringify = guards_engine.ACLField.stringify_acl
+        obj = acl.BaseACL(Mock(_ramses_cache=None))
+        obj._item_acl = [(Allow, 'g:admin', ['view'])]
+        with patch_guards:
+            result = obj.stringified_item_acl('item')
+        assert result == stringify.return_value
+        stringify.assert_called_once_with(((Allow, 'g:admin', ['view']),))
+
+    def test_stringify_item_acl_generated_factory(self):
+        class Factory(acl.BaseACL):
+            instances = 0
+
+            def __init__(self, request):
+                super(Factory, self).__init__(request)
+                Factory.instances += 1
+
+            def stringified_item_acl(self, item):
+                return [item]
+
+        request = Mock(_ramses_cache=None)
+        assert acl.stringify_item_acl(request, Factory, 1) == [1]
+        assert acl.stringify_item_acl(request, Factory, 2) == [2]
+        assert Factory.instances == 1
+
+    def test_stringify_item_acl_other_factory(self):
+        patch_guards, guards_engine = self._patch_guards()
+        factory = Mock()
+        with patch_guards:
+            result = acl.stringify_item_acl('req', factory, 'item')
+        factory.assert_called_once_with('req')
+        factory().generate_item_acl.assert_called_once_with('item')
+        stringify = guards_engine.ACLField.stringify_acl
+        stringify.assert_called_once_with(factory().generate_item_acl())
+        assert result == stringify()
+
+
+def fuzz_owner(ace, request, obj):
+    if obj is None:
+        return None
+    return (ace[0], 'u:{}'.format(obj), ace[2])
+
+
+@acl.request_principal
+def fuzz_staff(ace, request, obj):
+    return [(Allow, 'g:staff', ['view']), (ace[0], Authenticated, ace[2])]
+
+
+class TestACLFuzz(object):
+    """ Compare compiled ACLs with Pyramid ACL checks on random ACLs. """
+    principals = [
+        'everyone', 'authenticated', 'g:admin', 'g:staff', 'u:1', 'u:2',
+        '{{fuzz_owner}}', '{{fuzz_staff}}']
+    user_principals = [Authenticated, 'g:admin', 'g:staff', 'u:1', 'u:2']
+    iterations = 300
+
+    def setup_method(self, method):
+        from ramses import registry
+        registry.add('fuzz_owner', fuzz_owner)
+        registry.add('fuzz_staff', fuzz_staff)
+        self.permissions = sorted(set(acl.PERMISSIONS.values()))
+        self.random = random.Random(42)
+
+    def teardown_method(self, method):
+        from ramses import registry
+        registry.registry.pop('fuzz_owner', None)
+        registry.registry.pop('fuzz_staff', None)
+
+    def _random_spec(self, size):
+        spec = []
+        for _ in range(size):
+            if self.random.random() < 0.2:
+                perms = ['all']
+            else:
+                perms = self.random.sample(
+                    self.permissions, self.random.randint(1, 3))
+            spec.append((
+                self.random.choice(['allow', 'deny']),
+                self.random.choice(self.principals),
+                perms))
+        return spec
+
+    def _acl_string(self, spec):
+        separator = self.random.choice(['\n', ';'])
+        return separator.join(
+            '{} {} {}'.format(action, principal, ','.join(perms))
+            for action, principal, perms in spec)
+
+    def _random_principals(self):
+        principals = [Everyone] + [
+            principal for principal in self.user_principals
+            if self.random.random() < 0.3]
+        self.random.shuffle(principals)
+        return principals
+
+    def _context(self, acl_value):
+        context = type('Context', (object,), {})()
+        context.__acl__ = acl_value
+        return context
+
+    def _random_acls(self):
+        for _ in range(self.iterations):
+            spec = self._random_spec(self.random.randint(0, 12))
+            yield spec, acl.parse_acl(self._acl_string(spec))
+
+    def test_parse_acl(self):
+        special = {'everyone': Everyone, 'authenticated': Authenticated}
+        callables = {
+            '{{fuzz_owner}}': fuzz_owner, '{{fuzz_staff}}': fuzz_staff}
+        for spec, parsed in self._random_acls():
+            if not spec:
+                assert parsed == (acl.ALLOW_ALL,)
+                continue
+            expected = []
+            for action, principal, perms in spec:
+                principal = special.get(principal, principal)
+                principal = callables.get(principal, principal)
+                perms = ALL_PERMISSIONS if 'all' in perms else tuple(perms)
+                expected.append((
+                    Allow if action == 'allow' else Deny, principal, perms))
+            assert parsed == tuple(expected)
+
+    def test_effective_acls_match(self):
+        for spec, parsed in self._random_acls():
+            compiled = acl.CompiledACL(parsed)
+            for obj in (None, 1, 2):
+                base = acl.BaseACL(Mock(_ramses_cache=None))
+                plain = base._apply_callables(acl=list(parsed), obj=obj)
+                optimized = base._apply_callables(acl=compiled, obj=obj)
+                assert optimized == plain
+
+    def test_decisions_match(self):
+        from pyramid.authorization import ACLAuthorizationPolicy
+        pyramid_policy = ACLAuthorizationPolicy()
+        policy = acl.CompiledACLAuthorizationPolicy()
+        permissions = self.permissions + ['unknown']
+        for spec, parsed in self._random_acls():
+            static = [ace for ace in parsed if not callable(ace[1])]
+            base = acl.BaseACL(Mock(_ramses_cache=None))
+            # Static compiled ACL is decided by decision tables, ACL with
+            # applied callables is walked ACE by ACE
+            acls = [
+                (static, acl.CompiledACL(static)),
+                (base._apply_callables(acl=list(parsed), obj=1),
+                 base._apply_callables(acl=acl.CompiledACL(parsed), obj=1)),
+            ]
+            for plain, optimized in acls:
+                for _ in range(5):
+                    principals = self._random_principals()
+                    for permission in permissions:
+                        expected = pyramid_policy.permits(
+                            self._context(plain), principals, permission)
+                        result = policy.permits(
+                            self._context(optimized), principals,
+                            permission)
+                        assert bool(result) == bool(expected)
+                        assert result.ace == expected.ace
+
+    def test_static_item_decision_matches(self):
+        from pyramid.authorization import ACLAuthorizationPolicy
+        pyramid_policy = ACLAuthorizationPolicy()
+        for spec, parsed in self._random_acls():
+            base = acl.BaseACL(Mock(_ramses_cache=None))
+            base._item_acl = acl.CompiledACL(parsed)
+            principals = self._random_principals()
+            decision = base.static_item_decision(principals, 'view')
+            if decision is None:
+                continue
+            for obj in (None, 1, 2):
+                applied = base._apply_callables(acl=list(parsed), obj=obj)
+                expected = pyramid_policy.permits(
+                    self._context(applied), principals, 'view')
+                assert bool(expected) == decision
@@ -0,0 +1,166 @@
+import pytest
+from mock import Mock, patch
+
+from nefertari.json_httpexceptions import JHTTPBadRequest
+
+from ramses import aggregations
+
+
+class TestParseAggregations(object):
+
+    def test_parse(self):
+        specs = aggregations.parse_aggregations(
+            'status:terms:5, created:date_histogram,price:avg')
+        assert specs == [
+            ('status', 'terms', '5'),
+            ('created', 'date_histogram', None),
+            ('price', 'avg', None),
+        ]
+
+    def test_parse_list(self):
+        specs = aggregations.parse_aggregations(['price:max'])
+        assert specs == [('price', 'max', None)]
+
+    def test_parse_invalid_spec(self):
+        with pytest.raises(JHTTPBadRequest) as ex:
+            aggregations.parse_aggregations('price')
+        assert 'Invalid aggregation: price' in str(ex.value)
+
+    def test_parse_empty(self):
+        with pytest.raises(JHTTPBadRequest):
+            aggregations.parse_aggregations(' , ')
+
+
+class TestBuildAggregations(object):
+
+    def test_build(self):
+        result = aggregations.build_aggregations([
+            ('status', 'terms', '5'),
+            ('created', 'date_histogram', 'month'),
+            ('price', 'avg', None),
+            ('author', 'cardinality', None),
+        ], allowed_fields=['status', 'created', 'price', 'author'])
+        assert result == {
+            'status_terms': {'terms': {'field': 'status', 'size': 5}},
+            'created_date_histogram': {'date_histogram': {
+                'field': 'created', 'interval': 'month'}},
+            'price_avg': {'avg': {'field': 'price'}},
+            'author_cardinality': {'cardinality': {'field': 'author'}},
+        }
+
+    def test_build_terms_default_size(self):
+        result = aggregations.build_aggregations(
+            [('status', 'terms', None)], allowed_fields=['status'])
+        assert result['status_terms']['terms']['size'] == 10
+
+    def test_build_terms_invalid_size(self):
+        with pytest.raises(JHTTPBadRequest):
+            aggregations.build_aggregations(
+                [('status', 'terms', 'foo')], allowed_fields=['status'])
+        with pytest.raises(JHTTPBadRequest):
+            aggregations.build_aggregations(
+                [('status', 'terms', '100000')], allowed_fields=['status'])
+
+    def test_build_invalid_interval(self):
+        with pytest.raises(JHTTPBadRequest) as ex:
+            aggregations.build_aggregations(
+                [('created', 'date_histogram', 'decade')],
+                allowed_fields=['created'])
+        assert 'Invalid date_histogram interval' in str(ex.value)
+
+    def test_build_field_not_allowed(self):
+        with pytest.raises(JHTTPBadRequest) as ex:
+            aggregations.build_aggregations(
+                [('password', 'terms', None)], allowed_fields=['status'])
+        assert 'field `password` is not allowed' in str(ex.value)
+
+    def test_build_unknown_type(self):
+        with pytest.raises(JHTTPBadRequest) as ex:
+            aggregations.build_aggregations(
+                [('status', 'stats', None)], allowed_fields=['status'])
+        assert 'Unknown aggregation type: stats' in str(ex.value)
+
+
+@patch('ramses.aggregations.get_model_field_names')
+class TestGetAggregationFields(object):
+
+    def _model(self):
+        return Mock(
+            _public_fields=['a'],
+            _auth_fields=['a', 'b', 'c'],
+            _hidden_fields=['c'])
+
+    def _user(self, admin):
+        class User(object):
+            @classmethod
+            def is_admin(cls, user):
+                return admin
+        return User()
+
+    def test_admin(self, mock_fields):
+        mock_fields.return_value = ['a', 'b', 'c', 'd']
+        request = Mock(user=self._user(True))
+        fields = aggregations.get_aggregation_fields(self._model(), request)
+        assert fields == {'a', 'b', 'c', 'd'}
+
+    def test_authenticated(self, mock_fields):
+        mock_fields.return_value = ['a', 'b', 'c', 'd']
+        request = Mock(user=self._user(False))
+        fields = aggregations.get_aggregation_fields(self._model(), request)
+        assert fields == {'a', 'b'}
+
+    def test_public(self, mock_fields):
+        mock_fields.return_value = ['a', 'b', 'c', 'd']
+        request = Mock(user=None)
+        fields = aggregations.get_aggregation_fields(self._model(), request)
+        assert fields == {'a'}
+
+    def test_auth_not_enabled(self, mock_fields):
+        mock_fields.return_value = ['a', 'b', 'c', 'd']
+        request = Mock(user=None)
+        fields = aggregations.get_aggregation_fields(
+            self._model(), request, auth_enabled=False)
+        assert fields == {'a', 'b', 'c', 'd'}
+
+
+class TestESAggregator(object):
+
+    def _view(self, **query_params):
+        view = Mock(_auth_enabled=True, _query_params=query_params,
+                    _aggregations_keys=None)
+        view._after_calls = {'index': ['wrapper']}
+        return view
+
+    @patch('ramses.aggregations.get_aggregation_fields')
+    def test_aggregate(self, mock_fields):
+        mock_fields.return_value = {'status'}
+        view = self._view(_aggregate='status:terms:5', foo='bar')
+        aggregator = aggregations.ESAggregator(view)
+        with patch.object(aggregations.NefertariESAggregator,
+                          'check_aggregations_privacy') as mock_check:
+            result = aggregator.aggregate()
+        assert not mock_check.called
+        mock_fields.assert_called_once_with(
+            view.Model, view.request, auth_enabled=True)
+        view.aggregate_es.assert_called_once_with(
+            {'status_terms': {'terms': {'field': 'status', 'size': 5}}},
+            {'foo': 'bar'})
+        assert result == view.aggregate_es()
+        assert view._after_calls['index'] == []
+        assert view._query_params['_aggregate'] == 'status:terms:5'
+
+    def test_aggregate_nefertari_params(self):
+        view = self._view(**{'_aggregations.max_price.max.field': 'price'})
+        aggregator = aggregations.ESAggregator(view)
+        with patch.object(aggregations.NefertariESAggregator,
+                          'check_aggregations_privacy') as mock_check:
+            aggregator.aggregate()
+        params = {'max_price': {'max': {'field': 'price'}}}
+        mock_check.assert_called_once_with(params)
+        view.aggregate_es.assert_called_once_with(params, {})
+
+    def test_aggregate_no_params(self):
+        view = self._view(foo='bar')
+        with pytest.raises(KeyError):
+            aggregations.ESAggregator(view).aggregate()
+        assert view._after_calls['index'] == ['wrapper']
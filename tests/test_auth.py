@@ -143,6 +143,7 @@ class TestSetupApiKeyPolicy(object):
         from ramses import auth
         auth_model = Mock()
         config = Mock()
+        config.registry.settings = {}
         config.registry.auth_model = auth_model
         policy = auth._setup_apikey_policy(config, {'foo': 'bar'})
         mock_policy.assert_called_once_with(
@@ -157,6 +158,7 @@ class TestSetupApiKeyPolicy(object):
         from ramses import auth
         auth_model = Mock()
         config = Mock()
+        config.registry.settings = {}
         config.registry.auth_model = auth_model
         root = Mock()
         config.get_root_resource.return_value = root
@@ -182,6 +184,280 @@ class TestSetupApiKeyPolicy(object):
         assert register_kwargs['factory'] == 'nefertari.acl.AuthenticationACL'
 
 
+@pytest.mark.usefixtures('engine_mock')
+class TestSetupSignedTokenPolicy(object):
+
+    def test_no_secret(self):
+        from ramses import auth
+        with pytest.raises(ValueError) as ex:
+            auth._setup_signed_token_policy(config='', params={})
+        expected = 'Missing required security scheme settings: secret'
+        assert expected == str(ex.value)
+
+    def test_policy_params(self):
+        from ramses import auth
+        config = Mock()
+        config.registry.auth_model.__name__ = 'User'
+        config.registry.settings = {'token_secrets': 'new\nold'}
+        policy = auth._setup_signed_token_policy(
+            config=config, params={
+                'secret': 'token_secrets',
+                'max_age': '600',
+                'revocation_check_interval': '30',
+            })
+        assert isinstance(policy, auth.SignedTokenAuthenticationPolicy)
+        assert policy.auth_model == config.registry.auth_model
+        assert [key for _, key in policy.signer.keys] == [b'new', b'old']
+        assert policy.max_age == 600
+        assert policy.current_groups.ttl == 30
+        config.subscribe_to_events.assert_called_once_with(
+            policy.invalidate, config.subscribe_to_events.call_args[0][1],
+            model=config.registry.auth_model)
+        config.add_request_method.assert_called_once_with(
+            policy.get_user, 'user', reify=True)
+        assert policy.user_cls.load_user == \
+            config.registry.auth_model.get_authuser_by_userid
+
+    def test_no_revocation_checks(self):
+        from ramses import auth
+        config = Mock()
+        config.registry.auth_model.__name__ = 'User'
+        config.registry.settings = {'token_secrets': 'secret'}
+        auth._setup_signed_token_policy(
+            config=config, params={
+                'secret': 'token_secrets',
+                'revocation_check_interval': '0',
+            })
+        assert not config.subscribe_to_events.called
+
+    def test_routes_views_added(self):
+        from ramses import auth
+        config = Mock()
+        config.registry.auth_model.__name__ = 'User'
+        config.registry.settings = {'token_secrets': 'secret'}
+        root = Mock()
+        config.get_root_resource.return_value = root
+        auth._setup_signed_token_policy(
+            config=config, params={'secret': 'token_secrets'})
+        names = [call[0][0] for call in root.add.call_args_list]
+        assert names == ['register', 'login', 'logout']
+        for call in root.add.call_args_list:
+            assert call[1]['prefix'] == 'auth'
+            assert call[1]['factory'] == 'nefertari.acl.AuthenticationACL'
+
+    def test_scheme_registered(self):
+        from ramses import auth
+        assert auth.AUTHENTICATION_POLICIES['x-SignedToken'] == \
+            auth._setup_signed_token_policy
+
+
+@pytest.mark.usefixtures('engine_mock')
+class TestAuthUserCache(object):
+
+    def _cache(self):
+        from ramses import auth
+        auth_model = Mock()
+        auth_model.pk_field.return_value = 'id'
+        auth_model.get_item.side_effect = lambda **kw: Mock(
+            id=1, username='user1', groups=['admin'])
+        return auth.AuthUserCache(auth_model, max_size=10, ttl=60)
+
+    def test_get_groups_by_userid_cached(self):
+        user_cache = self._cache()
+        assert user_cache.get_groups_by_userid(
+            1, Mock(_user=None)) == ['g:admin']
+        request = Mock(_user=None)
+        assert user_cache.get_groups_by_userid(1, request) == ['g:admin']
+        user_cache.auth_model.get_item.assert_called_once_with(id=1)
+        assert request._user.username == 'user1'
+
+    def test_get_user_request_user(self):
+        user_cache = self._cache()
+        request = Mock(_user=Mock(id=1))
+        assert user_cache.get_user(request, 'id', 1) is request._user
+        assert not user_cache.auth_model.get_item.called
+
+    def test_get_user_mongo_copied(self):
+        class User(object):
+            _get_collection = Mock()
+            to_mongo = Mock(return_value={'_id': 1})
+            _from_son = Mock(side_effect=lambda son: Mock(id=1))
+
+        user_cache = self._cache()
+        cached = User()
+        user_cache.auth_model.get_item.side_effect = lambda **kw: cached
+        first = user_cache.get_user(Mock(_user=None), 'id', 1)
+        second = user_cache.get_user(Mock(_user=None), 'id', 1)
+        assert first is not second
+        assert first is not cached
+        User._from_son.assert_called_with({'_id': 1})
+        user_cache.auth_model.get_item.assert_called_once_with(id=1)
+
+    @patch('ramses.auth.forget')
+    def test_get_groups_by_userid_error(self, mock_forget):
+        user_cache = self._cache()
+        user_cache.auth_model.get_item.side_effect = Exception('foo')
+        request = Mock(_user=None)
+        assert user_cache.get_groups_by_userid(1, request) is None
+        mock_forget.assert_called_once_with(request)
+        assert len(user_cache.users) == 0
+
+    @patch('ramses.auth.authenticated_userid')
+    def test_get_authuser_by_name(self, mock_userid):
+        mock_userid.return_value = 'user1'
+        user_cache = self._cache()
+        user = user_cache.get_authuser_by_name(Mock(_user=None))
+        assert user.username == 'user1'
+        user_cache.get_authuser_by_name(Mock(_user=None))
+        user_cache.auth_model.get_item.assert_called_once_with(
+            username='user1')
+
+    @patch('ramses.auth.authenticated_userid')
+    def test_get_authuser_by_userid_anonymous(self, mock_userid):
+        mock_userid.return_value = None
+        user_cache = self._cache()
+        assert user_cache.get_authuser_by_userid(Mock(_user=None)) is None
+        assert not user_cache.auth_model.get_item.called
+
+    def test_invalidate_instance(self):
+        user_cache = self._cache()
+        user_cache.users.set(('id', 1), 'a')
+        user_cache.users.set(('username', 'user1'), 'a')
+        user_cache.users.set(('id', 2), 'b')
+        user_cache.invalidate(Mock(instance=Mock(id=1, username='user1')))
+        assert user_cache.users.get(('id', 1)) is None
+        assert user_cache.users.get(('username', 'user1')) is None
+        assert user_cache.users.get(('id', 2)) == 'b'
+
+    def test_invalidate_no_instance(self):
+        user_cache = self._cache()
+        user_cache.users.set(('id', 1), 'a')
+        user_cache.invalidate(Mock(instance=None))
+        assert len(user_cache.users) == 0
+
+    def test_setup_user_cache_disabled(self):
+        from ramses import auth
+        config = Mock()
+        config.registry.settings = {}
+        assert auth._setup_user_cache(config) is None
+        assert not config.subscribe_to_events.called
+
+    @patch('ramses.auth.AuthTktAuthenticationPolicy')
+    def test_ticket_policy_cached(self, mock_policy):
+        from ramses import auth
+        config = Mock()
+        config.registry.settings = {
+            'my_secret': 12345,
+            'auth_cache.enable': 'true',
+            'auth_cache.max_size': '5',
+            'auth_cache.ttl': '30',
+        }
+        auth._setup_ticket_policy(
+            config=config, params={'secret': 'my_secret'})
+        user_cache = config.registry.auth_user_cache
+        assert isinstance(user_cache, auth.AuthUserCache)
+        assert user_cache.users.max_size == 5
+        assert user_cache.users.ttl == 30
+        assert mock_policy.call_args[1]['callback'] == \
+            user_cache.get_groups_by_userid
+        config.add_request_method.assert_called_once_with(
+            user_cache.get_authuser_by_userid, 'user', reify=True)
+        subscriber, events = config.subscribe_to_events.call_args[0]
+        assert subscriber == user_cache.invalidate
+        assert len(events) == 5
+        assert config.subscribe_to_events.call_args[1] == {
+            'model': config.registry.auth_model}
+
+
+@pytest.mark.usefixtures('engine_mock')
+class TestApiKeyCache(object):
+
+    def _cache(self):
+        from ramses import auth
+        check = Mock()
+        check.side_effect = lambda username, token, request: (
+            ['g:admin'] if token == 'secret' else None)
+        return auth.ApiKeyCache(
+            check, max_size=10, ttl=60, failure_max_size=1, failure_ttl=5)
+
+    def test_token_not_stored(self):
+        from ramses import auth
+        key = auth.ApiKeyCache._key('user1', 'secret')
+        assert 'secret' not in key
+        assert key != auth.ApiKeyCache._key('user1', 'secret2')
+
+    def test_verified_cached(self):
+        api_key_cache = self._cache()
+        assert api_key_cache.get_groups_by_token(
+            'user1', 'secret', 1) == ['g:admin']
+        groups = api_key_cache.get_groups_by_token('user1', 'secret', 2)
+        assert groups == ['g:admin']
+        groups.append('g:foo')
+        assert api_key_cache.get_groups_by_token(
+            'user1', 'secret', 3) == ['g:admin']
+        api_key_cache.check.assert_called_once_with('user1', 'secret', 1)
+
+    def test_failures_cached(self):
+        api_key_cache = self._cache()
+        assert api_key_cache.get_groups_by_token('user1', 'foo', 1) is None
+        assert api_key_cache.get_groups_by_token('user1', 'foo', 2) is None
+        api_key_cache.check.assert_called_once_with('user1', 'foo', 1)
+        api_key_cache.get_groups_by_token('user1', 'bar', 3)
+        assert len(api_key_cache.failures) == 1
+        assert len(api_key_cache.verified) == 0
+
+    def test_invalidate_user(self):
+        api_key_cache = self._cache()
+        api_key_cache.get_groups_by_token('user1', 'secret', 1)
+        api_key_cache.get_groups_by_token('user2', 'secret', 1)
+        api_key_cache.get_groups_by_token('user1', 'foo', 1)
+        api_key_cache.invalidate(Mock(instance=Mock(username='user1')))
+        assert len(api_key_cache.verified) == 1
+        assert len(api_key_cache.failures) == 0
+        api_key_cache.invalidate(Mock(instance=None))
+        assert len(api_key_cache.verified) == 0
+
+    def test_reset_mixin(self):
+        from ramses import auth
+
+        class DummyBase(object):
+            def create(self):
+                self.user = Mock(username='user1')
+                return 1
+
+        class DummyView(auth.ApiKeyCacheResetMixin, DummyBase):
+            request = Mock()
+
+        view = DummyView()
+        assert view.create() == 1
+        cache = view.request.registry.api_key_cache
+        cache.invalidate_user.assert_called_once_with('user1')
+
+    @patch('ramses.auth.ApiKeyAuthenticationPolicy')
+    def test_apikey_policy_cached(self, mock_policy):
+        from ramses import auth
+        config = Mock()
+        config.registry.settings = {
+            'api_key_cache.enable': 'true',
+            'api_key_cache.ttl': '10',
+            'api_key_cache.failure_max_size': '50',
+        }
+        root = Mock()
+        config.get_root_resource.return_value = root
+        auth._setup_apikey_policy(config, {})
+        api_key_cache = config.registry.api_key_cache
+        assert api_key_cache.verified.ttl == 10
+        assert api_key_cache.failures.max_size == 50
+        assert api_key_cache.check == \
+            config.registry.auth_model.get_groups_by_token
+        assert mock_policy.call_args[1]['check'] == \
+            api_key_cache.get_groups_by_token
+        reset_view = root.add.call_args_list[2][1]['view']
+        assert issubclass(reset_view, auth.ApiKeyCacheResetMixin)
+        subscriber = config.subscribe_to_events.call_args[0][0]
+        assert subscriber == api_key_cache.invalidate
+
+
 @pytest.mark.usefixtures('engine_mock')
 class TestSetupAuthPolicies(object):
 
@@ -213,7 +489,7 @@ class TestSetupAuthPolicies(object):
         expected = 'Unsupported security scheme type: asd123'
         assert expected == str(ex.value)
 
-    @patch('ramses.auth.ACLAuthorizationPolicy')
+    @patch('ramses.auth.CompiledACLAuthorizationPolicy')
     def test_policies_calls(self, mock_acl):
         from ramses import auth
         scheme = Mock(type='mytype', settings={'name': 'user1'})
@@ -248,6 +524,7 @@ class TestHelperFunctions(object):
         encoder = mock_crypt.bcrypt.BCRYPTPasswordManager()
         encoder.encode.return_value = '654321'
         config = Mock()
+        config.registry.password_pool = None
         config.registry.settings = {
             'system.user': 'user12',
             'system.password': '123456',
@@ -274,6 +551,7 @@ class TestHelperFunctions(object):
         encoder = mock_crypt.bcrypt.BCRYPTPasswordManager()
         encoder.encode.return_value = '654321'
         config = Mock()
+        config.registry.password_pool = None
         config.registry.settings = {
             'system.user': 'user12',
             'system.password': '123456',
@@ -294,6 +572,24 @@ class TestHelperFunctions(object):
             }
         )
 
+    @patch('ramses.auth.transaction')
+    def test_create_system_user_password_pool(self, mock_trans):
+        from ramses import auth
+        config = Mock()
+        config.registry.password_pool.encode.return_value = '654321'
+        config.registry.settings = {
+            'system.user': 'user12',
+            'system.password': '123456',
+            'system.email': 'user12@example.com',
+        }
+        config.registry.auth_model.get_or_create.return_value = (1, False)
+        auth.create_system_user(config)
+        config.registry.password_pool.encode.assert_called_once_with(
+            '123456')
+        defaults = config.registry.auth_model.get_or_create.call_args[1][
+            'defaults']
+        assert defaults['password'] == '654321'
+
     @patch('ramses.auth.create_system_user')
     def test_includeme(self, mock_create):
         from ramses import auth
@@ -0,0 +1,146 @@
+from mock import Mock, patch
+
+from ramses import cache
+
+
+class TestRequestCache(object):
+
+    def test_get_request_cache(self):
+        request = Mock()
+        data = cache.get_request_cache(request, 'foo')
+        assert data == {}
+        data['a'] = 1
+        assert cache.get_request_cache(request, 'foo') == {'a': 1}
+        assert cache.get_request_cache(request, 'bar') == {}
+
+    def test_share_request_cache(self):
+        source, target = Mock(), Mock()
+        cache.get_request_cache(source, 'foo')['a'] = 1
+        cache.share_request_cache(source, target)
+        assert cache.get_request_cache(target, 'foo') == {'a': 1}
+        assert cache.get_identity_map(target) is cache.get_identity_map(
+            source)
+
+
+class TestIdentityMap(object):
+
+    def test_get_add(self):
+        model = Mock(__name__='Foo')
+        identity_map = cache.IdentityMap()
+        assert identity_map.get(model, True, 1) is None
+        identity_map.add(model, True, 1, 'obj')
+        assert identity_map.get(model, True, '1') == 'obj'
+        assert identity_map.get(model, False, 1) is None
+        assert identity_map.hits == 1
+        assert identity_map.misses == 2
+
+    def test_discard(self):
+        model = Mock(__name__='Foo')
+        identity_map = cache.IdentityMap()
+        identity_map.add(model, True, 1, 'obj')
+        identity_map.add(model, False, 1, 'obj')
+        identity_map.discard(model, 1)
+        assert identity_map.get(model, True, 1) is None
+        assert identity_map.get(model, False, 1) is None
+
+    def _event(self, request, instance):
+        model = Mock(__name__='Foo')
+        model.pk_field.return_value = 'id'
+        return Mock(view=Mock(request=request), model=model,
+                    instance=instance)
+
+    def test_invalidate_identity_map(self):
+        request = Mock(_ramses_cache=None)
+        event = self._event(request, Mock(id=1))
+        identity_map = cache.get_identity_map(request)
+        identity_map.add(event.model, True, 1, 'obj')
+        identity_map.add(event.model, False, 'self', 'obj')
+        identity_map.add(event.model, False, 2, 'obj2')
+        cache.invalidate_identity_map(event)
+        assert identity_map.get(event.model, True, 1) is None
+        assert identity_map.get(event.model, False, 'self') is None
+        assert identity_map.get(event.model, False, 2) == 'obj2'
+
+    def test_invalidate_identity_map_bulk(self):
+        request = Mock(_ramses_cache=None)
+        event = self._event(request, None)
+        identity_map = cache.get_identity_map(request)
+        identity_map.add(event.model, False, 2, 'obj2')
+        cache.invalidate_identity_map(event)
+        assert identity_map.get(event.model, False, 2) is None
+
+    def test_invalidate_identity_map_no_map(self):
+        request = Mock(_ramses_cache=None)
+        cache.invalidate_identity_map(self._event(request, None))
+        assert request._ramses_cache is None
+
+    def test_includeme(self):
+        from nefertari import events
+        config = Mock()
+        cache.includeme(config)
+        config.subscribe_to_events.assert_called_once_with(
+            cache.invalidate_identity_map, [
+                events.AfterUpdate, events.AfterReplace,
+                events.AfterDelete, events.AfterUpdateMany,
+                events.AfterDeleteMany])
+
+
+class TestTTLCache(object):
+
+    def test_get_set(self):
+        ttl_cache = cache.TTLCache(max_size=10, ttl=60, name='foo')
+        assert ttl_cache.get('a') is None
+        assert ttl_cache.get('a', 1) == 1
+        ttl_cache.set('a', 2)
+        assert ttl_cache.get('a') == 2
+
+    @patch.object(cache, 'record_cache')
+    def test_hits_recorded(self, mock_record):
+        ttl_cache = cache.TTLCache(max_size=10, ttl=60, name='foo')
+        ttl_cache.get('a')
+        ttl_cache.set('a', 1)
+        ttl_cache.get('a')
+        mock_record.assert_any_call('foo', misses=1)
+        mock_record.assert_any_call('foo', hits=1)
+
+    @patch.object(cache.time, 'time')
+    def test_expired(self, mock_time):
+        mock_time.return_value = 100
+        ttl_cache = cache.TTLCache(max_size=10, ttl=60, name='foo')
+        ttl_cache.set('a', 1)
+        ttl_cache.set('b', 2, ttl=10)
+        mock_time.return_value = 120
+        assert ttl_cache.get('a') == 1
+        assert ttl_cache.get('b') is None
+        mock_time.return_value = 160
+        assert ttl_cache.get('a') is None
+        assert len(ttl_cache) == 0
+
+    def test_lru_eviction(self):
+        ttl_cache = cache.TTLCache(max_size=2, ttl=60, name='foo')
+        ttl_cache.set('a', 1)
+        ttl_cache.set('b', 2)
+        ttl_cache.get('a')
+        ttl_cache.set('c', 3)
+        assert ttl_cache.get('b') is None
+        assert ttl_cache.get('a') == 1
+        assert ttl_cache.get('c') == 3
+
+    def test_discard_clear(self):
+        ttl_cache = cache.TTLCache(max_size=10, ttl=60, name='foo')
+        ttl_cache.set('a', 1)
+        ttl_cache.set('b', 2)
+        ttl_cache.discard('a')
+        ttl_cache.discard('x')
+        assert ttl_cache.get('a') is None
+        ttl_cache.clear()
+        assert len(ttl_cache) == 0
+
+    def test_discard_if(self):
+        ttl_cache = cache.TTLCache(max_size=10, ttl=60, name='foo')
+        ttl_cache.set('a', 1)
+        ttl_cache.set('b', 2)
+        ttl_cache.set('c', 3)
+        ttl_cache.discard_if(lambda key, value: key == 'a' or value == 3)
+        assert len(ttl_cache) == 1
+        assert ttl_cache.get('b') == 2
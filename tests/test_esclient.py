@@ -0,0 +1,79 @@
+from mock import Mock, patch
+
+from ramses import esclient
+
+
+class TestAccessors(object):
+
+    def test_get_es_accessor_reused(self):
+        es_cls = Mock()
+        first = esclient.get_es_accessor(es_cls, 'Story')
+        assert esclient.get_es_accessor(es_cls, 'Story') is first
+        es_cls.assert_called_once_with('Story')
+        assert first is es_cls.return_value
+
+    def test_get_es_accessor_per_model_and_class(self):
+        es_cls = Mock(side_effect=lambda name: Mock())
+        other_cls = Mock(side_effect=lambda name: Mock())
+        story = esclient.get_es_accessor(es_cls, 'Story')
+        assert esclient.get_es_accessor(es_cls, 'User') is not story
+        assert esclient.get_es_accessor(other_cls, 'Story') is not story
+
+
+class TestPool(object):
+
+    def test_get_pool_params(self):
+        params = esclient.get_pool_params({
+            'es_pool.maxsize': '25',
+            'es_pool.timeout': '2.5',
+            'es_pool.retry_on_timeout': 'true',
+            'elasticsearch.hosts': 'localhost:9200',
+        })
+        assert params == {
+            'maxsize': 25,
+            'timeout': 2.5,
+            'retry_on_timeout': True,
+        }
+
+    def test_get_pool_params_empty(self):
+        assert esclient.get_pool_params({}) == {}
+
+    def test_rebuild_client(self):
+        class Client(object):
+            def __init__(self, **kwargs):
+                self.kwargs = kwargs
+                self.transport = Mock(
+                    kwargs={'timeout': 1, 'use_ssl': True},
+                    sniff_on_connection_fail=True)
+
+        client = Client()
+        new_client = esclient.rebuild_client(
+            client, {'timeout': 5, 'maxsize': 10}, sniff_on_start=True)
+        assert isinstance(new_client, Client)
+        assert new_client.kwargs == dict(
+            hosts=client.transport.hosts,
+            serializer=client.transport.serializer,
+            connection_class=client.transport.connection_class,
+            sniff_on_start=True,
+            sniff_on_connection_fail=True,
+            timeout=5, use_ssl=True, maxsize=10)
+        client.transport.close.assert_called_once_with()
+
+    @patch('nefertari.elasticsearch.ES')
+    @patch.object(esclient, 'rebuild_client')
+    def test_includeme(self, mock_rebuild, mock_es):
+        original = mock_es.api
+        config = Mock()
+        config.registry.settings = {'es_pool.maxsize': '5'}
+        esclient.includeme(config)
+        mock_rebuild.assert_called_once_with(
+            original, {'maxsize': 5}, sniff_on_start=False)
+        assert mock_es.api is mock_rebuild.return_value
+
+    @patch('nefertari.elasticsearch.ES')
+    @patch.object(esclient, 'rebuild_client')
+    def test_includeme_not_configured(self, mock_rebuild, mock_es):
+        config = Mock()
+        config.registry.settings = {}
+        esclient.includeme(config)
+        assert not mock_rebuild.called
@@ -1,8 +1,9 @@
 
 import pytest
 from mock import Mock, patch, call
+from pyramid.events import BeforeTraversal
 
-from ramses import generators
+from ramses import generators, views
 from .fixtures import engine_mock, config_mock
 
 
@@ -44,6 +45,9 @@ class TestHelperFunctions(object):
             Mock(path='/bar'),
         ]
         generators.generate_server(Mock(resources=resources), config)
+        assert config.registry.allowed_methods == {}
+        config.add_subscriber.assert_called_once_with(
+            views.reject_not_allowed_methods, BeforeTraversal)
         assert mock_get.call_count == 2
         mock_gen.assert_has_calls([
             call(config, resources[0], mock_get()),
@@ -155,6 +159,7 @@ class TestGenerateResource(object):
             self, generate_view, view_attrs, generate_acl, get_model,
             attr_res, singular_res, mock_dyn):
         mock_dyn.return_value = 'fooid'
+        view_attrs.return_value = {'index', 'show', 'create'}
         model_cls = Mock()
         model_cls.pk_field.return_value = 'my_id'
         attr_res.return_value = False
@@ -162,6 +167,8 @@ class TestGenerateResource(object):
         get_model.return_value = model_cls
         raml_resource = Mock(path='/stories')
         parent_resource = Mock(is_root=False, uid=1)
+        parent_resource.add.return_value.action_route_map = {
+            'index': 'stories', 'create': 'stories', 'show': 'story'}
         config = config_mock()
 
         res = generators.generate_resource(
@@ -187,6 +194,10 @@ class TestGenerateResource(object):
             view=generate_view()
         )
         assert res == parent_resource.add()
+        assert config.registry.allowed_methods == {
+            'stories': frozenset(['GET', 'HEAD', 'POST']),
+            'story': frozenset(['GET', 'HEAD']),
+        }
 
     @patch('ramses.generators.dynamic_part_name')
     @patch('ramses.generators.singular_subresource')
@@ -199,6 +210,7 @@ class TestGenerateResource(object):
             self, generate_view, view_attrs, generate_acl, get_model,
             attr_res, singular_res, mock_dyn):
         mock_dyn.return_value = 'fooid'
+        view_attrs.return_value = {'show', 'create'}
         model_cls = Mock()
         model_cls.pk_field.return_value = 'my_id'
         attr_res.return_value = False
@@ -207,6 +219,8 @@ class TestGenerateResource(object):
         raml_resource = Mock(path='/stories')
         parent_resource = Mock(is_root=False, uid=1)
         parent_resource.view.Model.pk_field.return_value = 'other_id'
+        parent_resource.add.return_value.action_route_map = {
+            'create': 'story', 'show': 'story'}
 
         config = config_mock()
         res = generators.generate_resource(
@@ -229,4 +243,6 @@ class TestGenerateResource(object):
             factory=generate_acl(),
             view=generate_view()
         )
-        assert res == parent_resource.add()
\ No newline at end of file
+        assert res == parent_resource.add()
+        assert config.registry.allowed_methods == {
+            'story': frozenset(['GET', 'HEAD', 'POST'])}
@@ -0,0 +1,181 @@
+import json
+import threading
+
+from mock import Mock, patch
+
+from ramses import indexing
+
+
+def _queue(send=None, **kwargs):
+    kwargs.setdefault('retry_backoff', 0)
+    kwargs.setdefault('flush_interval', 60)
+    return indexing.WriteBehindQueue(send=send or Mock(), **kwargs)
+
+
+class TestWriteBehindQueue(object):
+
+    def test_put_and_flush(self):
+        queue = _queue(batch_size=2)
+        queue._start = Mock()
+        queue.put([1, 2, 3])
+        assert len(queue) == 3
+        queue.flush()
+        assert [c[0][0] for c in queue.send.call_args_list] == [[1, 2], [3]]
+        assert len(queue) == 0
+
+    def test_background_flush(self):
+        sent = []
+        queue = _queue(send=sent.extend, flush_interval=0.01)
+        queue.put([1])
+        queue._thread.join(0.5)
+        queue.stop()
+        assert sent == [1]
+
+    def test_flush_waits_for_background_send(self):
+        import threading
+        sending = threading.Event()
+        release = threading.Event()
+        sent = []
+
+        def send(batch):
+            sending.set()
+            release.wait(1)
+            sent.append(batch)
+
+        queue = _queue(send=send, batch_size=1, flush_interval=0.01)
+        queue.put([1, 2])
+        assert sending.wait(1)
+        flush = threading.Thread(target=queue.flush)
+        flush.start()
+        flush.join(0.05)
+        # flush can't send the next batch before the current one is sent
+        assert sent == []
+        release.set()
+        flush.join(1)
+        queue.stop()
+        assert sent == [[1], [2]]
+
+    @patch.object(indexing.time, 'sleep')
+    def test_send_batch_retries(self, mock_sleep):
+        send = Mock(side_effect=[Exception, Exception, None])
+        queue = _queue(send=send, max_retries=3, retry_backoff=1)
+        assert queue.send_batch([1])
+        assert send.call_count == 3
+        assert [c[0][0] for c in mock_sleep.call_args_list] == [1, 2]
+
+    def test_send_batch_spills(self, tmpdir):
+        spill_file = str(tmpdir.join('spill.jsonl'))
+        send = Mock(side_effect=Exception)
+        queue = _queue(send=send, max_retries=1, spill_file=spill_file)
+        assert not queue.send_batch([{'_id': 1}, {'_id': 2}])
+        assert send.call_count == 2
+        with open(spill_file) as f:
+            assert [json.loads(line) for line in f] == [
+                {'_id': 1}, {'_id': 2}]
+
+    def test_replay_spilled(self, tmpdir):
+        spill_file = tmpdir.join('spill.jsonl')
+        spill_file.write('{"_id": 1}\n{"_id": 2}\n')
+        queue = _queue(spill_file=str(spill_file))
+        queue._start = Mock()
+        queue.replay_spilled()
+        assert queue._actions == [{'_id': 1}, {'_id': 2}]
+        assert spill_file.read() == ''
+
+    def test_spill_locks_file(self, tmpdir):
+        spill_file = tmpdir.join('spill.jsonl')
+        spill_file.write('{"_id": 1}\n')
+        queue = _queue(spill_file=str(spill_file))
+        queue._start = Mock()
+        with open(str(spill_file), 'r+') as other:
+            # Another process is replaying the file
+            indexing.fcntl.flock(other, indexing.fcntl.LOCK_EX)
+            thread = threading.Thread(
+                target=queue.spill, args=([{'_id': 2}],))
+            thread.start()
+            thread.join(0.2)
+            assert thread.is_alive()
+            other.truncate(0)
+        thread.join()
+        assert spill_file.read() == '{"_id": 2}\n'
+
+    def test_replay_spilled_after_send(self, tmpdir):
+        spill_file = tmpdir.join('spill.jsonl')
+        spill_file.write('{"_id": 1}\n')
+        queue = _queue(spill_file=str(spill_file))
+        queue._start = Mock()
+        queue.send_batch([{'_id': 2}])
+        assert queue._actions == [{'_id': 1}]
+
+
+class TestInstallWriteBehind(object):
+
+    def _es_module(self):
+        es_module = Mock()
+        queue = Mock()
+        sync = es_module._bulk_body
+        indexing.install_write_behind(es_module, queue)
+        return es_module, queue, sync
+
+    def test_no_request(self):
+        es_module, queue, sync = self._es_module()
+        es_module._bulk_body(iter([1, 2]), None)
+        queue.put.assert_called_once_with([1, 2])
+        assert not sync.called
+
+    def test_request_finished(self):
+        es_module, queue, sync = self._es_module()
+        request = Mock(params={}, exception=None)
+        es_module._bulk_body([1], request=request)
+        assert not queue.put.called
+        callback = request.add_finished_callback.call_args[0][0]
+        callback(request)
+        queue.put.assert_called_once_with([1])
+
+    def test_request_failed(self):
+        es_module, queue, sync = self._es_module()
+        request = Mock(params={}, exception=ValueError())
+        es_module._bulk_body([1], request=request)
+        callback = request.add_finished_callback.call_args[0][0]
+        callback(request)
+        assert not queue.put.called
+
+    def test_refresh_requested(self):
+        es_module, queue, sync = self._es_module()
+        request = Mock(params={'_refresh_index': 'true'})
+        es_module._bulk_body([1], request=request)
+        queue.flush.assert_called_once_with()
+        sync.assert_called_once_with([1], request)
+        assert not queue.put.called
+
+    def test_nefertari_bulk_patched(self):
+        from nefertari import elasticsearch
+        queue = Mock()
+        with patch.object(elasticsearch, '_bulk_body') as sync:
+            indexing.install_write_behind(elasticsearch, queue)
+            es = elasticsearch.ES.__new__(elasticsearch.ES)
+            es.prep_bulk_documents = Mock(return_value=[{'_id': 1}])
+            es.process_chunks = Mock()
+            es._bulk('index', ['doc'])
+            call_kwargs = es.process_chunks.call_args[1]
+            call_kwargs['operation'](call_kwargs['documents'])
+        queue.put.assert_called_once_with([{'_id': 1}])
+        assert not sync.called
+
+
+class TestSendBulk(object):
+
+    @patch('elasticsearch.helpers.bulk')
+    def test_send_bulk(self, mock_bulk):
+        mock_bulk.return_value = (1, [{'delete': {'status': 404}}])
+        indexing.send_bulk('client', [1, 2])
+        mock_bulk.assert_called_once_with(
+            client='client', actions=[1, 2], raise_on_error=False)
+
+    @patch('elasticsearch.helpers.bulk')
+    def test_send_bulk_errors(self, mock_bulk):
+        import pytest
+        mock_bulk.return_value = (1, [{'index': {'status': 500}}])
+        with pytest.raises(Exception) as ex:
+            indexing.send_bulk('client', [1, 2])
+        assert '1 Elasticsearch actions failed' in str(ex.value)
@@ -0,0 +1,168 @@
+import pytest
+from mock import Mock, patch
+
+from nefertari.json_httpexceptions import JHTTPBadRequest
+
+from ramses import iterables
+
+
+class TestIterablesHelpers(object):
+
+    def test_split_keys(self):
+        positive, negative = iterables.split_keys(
+            ['a', '-b', '__c', ' d'])
+        assert positive == ['a', 'd']
+        assert negative == ['b']
+
+    def test_list_changes_dict_params(self):
+        positive, negative = iterables._list_changes(
+            {'a': '', '-b': ''})
+        assert positive == ['a']
+        assert negative == ['b']
+
+    def test_list_changes_empty_params(self):
+        positive, negative = iterables._list_changes('', ['a', 'b'])
+        assert positive == []
+        assert negative == ['a', 'b']
+
+    def test_list_changes_missing_params(self):
+        with pytest.raises(JHTTPBadRequest):
+            iterables._list_changes(['__foo'])
+
+    def test_dict_changes(self):
+        to_set, to_unset = iterables._dict_changes(
+            {'a': 1, '-b': '', '-a': ''})
+        assert to_set == {'a': 1}
+        assert to_unset == ['b']
+
+    def test_dict_changes_empty_params(self):
+        to_set, to_unset = iterables._dict_changes(None, {'a': 1})
+        assert to_set == {}
+        assert to_unset == ['a']
+
+    def test_supports_atomic_update_sqla(self):
+        class ListField(object):
+            pass
+
+        class Model(object):
+            __table__ = Mock(columns={'tags': ListField()})
+
+        assert iterables.supports_atomic_update(Model, 'tags')
+        assert not iterables.supports_atomic_update(Model, 'other')
+
+    def test_supports_atomic_update_mongo(self):
+        class DictField(object):
+            pass
+
+        class Model(object):
+            _fields = {'settings': DictField()}
+            _get_collection = Mock()
+
+        assert iterables.supports_atomic_update(Model, 'settings')
+
+    def test_supports_atomic_update_unknown_engine(self):
+        assert not iterables.supports_atomic_update(object, 'tags')
+
+    @patch.dict('ramses.iterables._excluded_fields', clear=True)
+    def test_supports_atomic_update_excluded(self):
+        class ListField(object):
+            pass
+
+        class Model(object):
+            __table__ = Mock(columns={'tags': ListField(), 'a': ListField()})
+
+        iterables.exclude_from_atomic_update(Model, 'tags')
+        assert not iterables.supports_atomic_update(Model, 'tags')
+        assert iterables.supports_atomic_update(Model, 'a')
+        iterables.exclude_from_atomic_update(Model)
+        assert not iterables.supports_atomic_update(Model, 'a')
+        iterables.exclude_from_atomic_update(Model, 'tags')
+        assert iterables.is_excluded(Model, 'a')
+
+    def test_list_changes_value_type(self):
+        positive, negative = iterables._list_changes(
+            ['1', '-2'], value_type=int)
+        assert positive == [1]
+        assert negative == [2]
+        with pytest.raises(JHTTPBadRequest):
+            iterables._list_changes(['a'], value_type=int)
+
+    def test_dict_changes_value_type(self):
+        to_set, to_unset = iterables._dict_changes(
+            {'a': '1', '-b': ''}, value_type=int)
+        assert to_set == {'a': 1}
+        assert to_unset == ['b']
+
+
+class TestAtomicUpdate(object):
+
+    def _mongo_obj(self, field_cls_name):
+        field_cls = type(field_cls_name, (object,), {'db_field': 'f'})
+
+        class Model(object):
+            _index_enabled = False
+            _fields = {'attr': field_cls()}
+            _get_collection = Mock()
+
+        obj = Model()
+        obj.pk = 1
+        obj.reload = Mock()
+        obj.attr = None
+        return obj
+
+    def test_mongo_list(self):
+        obj = self._mongo_obj('ListField')
+        iterables.atomic_update_iterables(
+            obj, {'a': '', '-b': ''}, 'attr', unique=True)
+        collection = type(obj)._get_collection()
+        collection.update_one.assert_any_call(
+            {'_id': 1}, {'$addToSet': {'f': {'$each': ['a']}}})
+        collection.update_one.assert_any_call(
+            {'_id': 1}, {'$pullAll': {'f': ['b']}})
+        obj.reload.assert_called_once_with('attr')
+
+    def test_mongo_dict(self):
+        obj = self._mongo_obj('DictField')
+        iterables.atomic_update_iterables(
+            obj, {'a': 1, '-b': ''}, 'attr')
+        collection = type(obj)._get_collection()
+        collection.update_one.assert_called_once_with(
+            {'_id': 1}, {'$set': {'f.a': 1}, '$unset': {'f.b': ''}})
+
+    def _indexed_obj(self):
+        obj = Mock(tags=['a'])
+        type(obj)._index_enabled = True
+        type(obj).__name__ = 'Story'
+        type(obj).pk_field = Mock(return_value='id')
+        obj.id = 4
+        return obj
+
+    def _update_action(self, es):
+        return {
+            '_op_type': 'update', '_index': es.index_name,
+            '_type': es.doc_type, '_id': '4', 'doc': {'tags': ['a']}}
+
+    @patch('nefertari.elasticsearch._bulk_body')
+    @patch('nefertari.elasticsearch.ES')
+    def test_index_field_es(self, mock_es, mock_bulk):
+        obj = self._indexed_obj()
+        iterables.index_field_es(obj, 'tags', request='req')
+        mock_es.assert_called_once_with('Story')
+        mock_bulk.assert_called_once_with(
+            [self._update_action(mock_es())], 'req')
+
+    @patch.object(iterables, 'transaction')
+    @patch('nefertari.elasticsearch._bulk_body')
+    @patch('nefertari.elasticsearch.ES')
+    def test_index_field_es_sqla(self, mock_es, mock_bulk, mock_trans):
+        obj = self._indexed_obj()
+        type(obj).__table__ = Mock()
+        iterables.index_field_es(obj, 'tags', request='req')
+        assert not mock_bulk.called
+        add_hook = mock_trans.get().addAfterCommitHook
+        hook = add_hook.call_args[0][0]
+        hook(False)
+        assert not mock_bulk.called
+        hook(True)
+        mock_bulk.assert_called_once_with(
+            [self._update_action(mock_es())], 'req')
@@ -0,0 +1,236 @@
+import os
+import json
+
+import pytest
+from mock import Mock, patch
+
+from ramses import metrics
+from ramses.cache import get_identity_map
+
+
+@pytest.fixture
+def enabled_metrics(request):
+    instance = metrics.Metrics(buckets=(0.1, 1))
+    metrics._metrics = instance
+
+    def disable():
+        metrics._metrics = None
+    request.addfinalizer(disable)
+    return instance
+
+
+class TestMetrics(object):
+
+    def test_inc(self):
+        instance = metrics.Metrics()
+        instance.inc('foo', (('a', 1),))
+        instance.inc('foo', (('a', 1),), 2)
+        instance.inc('foo')
+        assert instance.counters == {
+            ('foo', (('a', 1),)): 3,
+            ('foo', ()): 1,
+        }
+
+    def test_observe(self):
+        instance = metrics.Metrics(buckets=(0.1, 1))
+        instance.observe('lat', (), 0.05)
+        instance.observe('lat', (), 0.5)
+        instance.observe('lat', (), 5)
+        buckets, total, count = instance.histograms[('lat', ())]
+        assert buckets == [1, 1]
+        assert round(total, 2) == 5.55
+        assert count == 3
+
+    def test_render(self):
+        instance = metrics.Metrics(buckets=(0.1, 1))
+        labels = (('method', 'GET'), ('route', 'stories'))
+        instance.inc('ramses_requests_total', labels + (('status', 200),))
+        instance.observe('ramses_request_duration_seconds', labels, 0.5)
+        instance.track_in_flight(1)
+        assert instance.render().splitlines() == [
+            '# TYPE ramses_requests_total counter',
+            'ramses_requests_total{method="GET",route="stories",'
+            'status="200"} 1',
+            '# TYPE ramses_request_duration_seconds histogram',
+            'ramses_request_duration_seconds_bucket{method="GET",'
+            'route="stories",le="0.1"} 0',
+            'ramses_request_duration_seconds_bucket{method="GET",'
+            'route="stories",le="1"} 1',
+            'ramses_request_duration_seconds_bucket{method="GET",'
+            'route="stories",le="+Inf"} 1',
+            'ramses_request_duration_seconds_sum{method="GET",'
+            'route="stories"} 0.5',
+            'ramses_request_duration_seconds_count{method="GET",'
+            'route="stories"} 1',
+            '# TYPE ramses_requests_in_flight gauge',
+            'ramses_requests_in_flight 1',
+        ]
+
+    def test_render_gauges(self):
+        instance = metrics.Metrics()
+        instance.set_gauge('queue_depth', (), 3)
+        instance.set_gauge('queue_depth', (), 2)
+        assert instance.render().splitlines()[:2] == [
+            '# TYPE queue_depth gauge',
+            'queue_depth 2',
+        ]
+
+    def test_flush_not_configured(self, tmpdir):
+        instance = metrics.Metrics()
+        instance.flush(force=True)
+        assert not tmpdir.listdir()
+
+    def test_flush(self, tmpdir):
+        instance = metrics.Metrics(directory=str(tmpdir))
+        instance.inc('foo')
+        instance.flush()
+        path = tmpdir.join('ramses_{}.json'.format(os.getpid()))
+        data = json.loads(path.read())
+        assert data['counters'] == [['foo', [], 1]]
+
+    def test_flush_interval(self, tmpdir):
+        instance = metrics.Metrics(directory=str(tmpdir))
+        instance.flush()
+        instance.inc('foo')
+        instance.flush()
+        path = tmpdir.join('ramses_{}.json'.format(os.getpid()))
+        assert json.loads(path.read())['counters'] == []
+        instance.flush(force=True)
+        assert json.loads(path.read())['counters'] == [['foo', [], 1]]
+
+    @patch.object(metrics, '_process_exists')
+    def test_collect_sums_workers(self, mock_exists, tmpdir):
+        mock_exists.side_effect = lambda pid: pid == 1
+        for pid in (1, 2):
+            tmpdir.join('ramses_{}.json'.format(pid)).write(json.dumps({
+                'pid': pid,
+                'buckets': [0.1, 1],
+                'in_flight': 2,
+                'counters': [['foo', [['a', 1]], 5]],
+                'histograms': [['lat', [], [1, 0], 0.05, 1]],
+            }))
+        tmpdir.join('other.txt').write('ignored')
+        instance = metrics.Metrics(directory=str(tmpdir), buckets=(0.1, 1))
+        instance.inc('foo', (('a', 1),))
+        instance.observe('lat', (), 0.5)
+        instance.track_in_flight(1)
+        counters, histograms, in_flight = instance.collect()
+        assert counters == {('foo', (('a', 1),)): 11}
+        buckets, total, count = histograms[('lat', ())]
+        assert (buckets, round(total, 2), count) == ([2, 1], 0.6, 3)
+        assert in_flight == 3
+
+    @patch.object(metrics, '_process_exists')
+    def test_gauges_of_live_workers(self, mock_exists, tmpdir):
+        mock_exists.side_effect = lambda pid: pid == 1
+        for pid in (1, 2):
+            tmpdir.join('ramses_{}.json'.format(pid)).write(json.dumps({
+                'pid': pid, 'buckets': [], 'in_flight': 0,
+                'counters': [], 'histograms': [],
+                'gauges': [['queue_depth', [], 4]],
+            }))
+        instance = metrics.Metrics(directory=str(tmpdir), buckets=())
+        instance.set_gauge('queue_depth', (), 1)
+        assert 'queue_depth 5' in instance.render().splitlines()
+
+    def test_collect_skips_broken_files(self, tmpdir):
+        tmpdir.join('ramses_1.json').write('{')
+        instance = metrics.Metrics(directory=str(tmpdir))
+        instance.inc('foo')
+        counters, histograms, in_flight = instance.collect()
+        assert counters == {('foo', ()): 1}
+
+
+class TestHelpers(object):
+
+    def test_record_cache_disabled(self):
+        metrics._metrics = None
+        metrics.record_cache('identity_map', 1, 2)
+
+    def test_record_cache(self, enabled_metrics):
+        metrics.record_cache('identity_map', hits=2, misses=0)
+        assert enabled_metrics.counters == {
+            ('ramses_cache_hits_total', (('cache', 'identity_map'),)): 2,
+        }
+
+    def test_set_gauge_inc(self, enabled_metrics):
+        metrics.set_gauge('queue_depth', 2)
+        metrics.inc('rejected_total', (('reason', 'foo'),))
+        assert enabled_metrics.gauges == {('queue_depth', ()): 2}
+        assert enabled_metrics.counters == {
+            ('rejected_total', (('reason', 'foo'),)): 1}
+
+    def test_format_labels(self):
+        assert metrics._format_labels(()) == ''
+        assert metrics._format_labels((('a', 'x"y'), ('b', 1))) == \
+            '{a="x\\"y",b="1"}'
+
+    def test_count_es_calls(self):
+        instance = metrics.Metrics()
+        client = Mock()
+        client.search.return_value = {'hits': {}}
+        metrics.count_es_calls(client, instance)
+        assert client.search(index='foo') == {'hits': {}}
+        client.count()
+        client.search()
+        assert instance.counters == {
+            ('ramses_es_calls_total', (('operation', 'search'),)): 2,
+            ('ramses_es_calls_total', (('operation', 'count'),)): 1,
+        }
+
+    @patch.object(metrics, 'atexit')
+    @patch.object(metrics, 'count_db_calls')
+    def test_includeme(self, mock_count_db, mock_atexit):
+        config = Mock()
+        config.registry.settings = {}
+        with patch.object(metrics, '_metrics'):
+            metrics.includeme(config)
+            instance = metrics._metrics
+        assert config.registry.metrics is instance
+        mock_count_db.assert_called_once_with(instance)
+        config.add_tween.assert_called_once_with(
+            'ramses.metrics.metrics_tween_factory', over=metrics.INGRESS)
+
+
+class TestMetricsTween(object):
+
+    def _request(self, route_name='stories'):
+        request = Mock(method='GET', _ramses_cache=None)
+        request.matched_route.name = route_name
+        return request
+
+    def test_request_recorded(self, enabled_metrics):
+        handler = Mock(return_value=Mock(status_code=201))
+        tween = metrics.metrics_tween_factory(handler, None)
+        request = self._request()
+        identity_map = get_identity_map(request)
+        identity_map.hits, identity_map.misses = 3, 1
+        assert tween(request) == handler.return_value
+        labels = (('method', 'GET'), ('route', 'stories'))
+        counters = enabled_metrics.counters
+        assert counters[
+            ('ramses_requests_total', labels + (('status', 201),))] == 1
+        assert counters[
+            ('ramses_cache_hits_total', (('cache', 'identity_map'),))] == 3
+        assert counters[
+            ('ramses_cache_misses_total', (('cache', 'identity_map'),))] == 1
+        assert enabled_metrics.histograms[
+            ('ramses_request_duration_seconds', labels)][2] == 1
+        assert enabled_metrics.in_flight == 0
+
+    def test_error_recorded(self, enabled_metrics):
+        handler = Mock(side_effect=ValueError)
+        tween = metrics.metrics_tween_factory(handler, None)
+        request = self._request(route_name=None)
+        with pytest.raises(ValueError):
+            tween(request)
+        labels = (('method', 'GET'), ('route', 'none'), ('status', 500))
+        assert enabled_metrics.counters[
+            ('ramses_requests_total', labels)] == 1
+        assert enabled_metrics.in_flight == 0
+
+    def test_metrics_view(self, enabled_metrics):
+        enabled_metrics.inc('foo')
+        response = metrics.metrics_view(None)
+        assert response.content_type == 'text/plain'
+        assert b'foo 1' in response.body
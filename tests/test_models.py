@@ -159,6 +159,7 @@ class TestGenerateModelCls(object):
             '_auth_model': False,
             '_public_fields': ['public_field1'],
             '_auth_fields': ['auth_field1'],
+            '_owner_fields': ['owner_field1'],
             '_hidden_fields': ['hidden_field1'],
             '_nested_relationships': ['nested_field1'],
             '_nesting_depth': 3
@@ -190,6 +191,7 @@ class TestGenerateModelCls(object):
         assert model_cls._public_fields == ['public_field1']
         assert model_cls._nesting_depth == 3
         assert model_cls._auth_fields == ['auth_field1']
+        assert model_cls._owner_fields == ['owner_field1']
         assert model_cls._hidden_fields == ['hidden_field1']
         assert model_cls._nested_relationships == ['nested_field1']
         assert model_cls.foo == 'bar'
@@ -376,8 +378,9 @@ class TestSubscribersSetup(object):
 
     @patch('ramses.models.resolve_to_callable')
     @patch('ramses.models.get_events_map')
+    @patch.dict('ramses.iterables._excluded_fields', clear=True)
     def test_setup_model_event_subscribers(self, mock_get, mock_resolve):
-        from ramses import models
+        from ramses import models, iterables
         mock_get.return_value = {'before': {'index': 'eventcls'}}
         mock_resolve.return_value = 1
         config = Mock()
@@ -394,11 +397,13 @@ class TestSubscribersSetup(object):
             call(mock_resolve(), ['eventcls'], model='mymodel'),
             call(mock_resolve(), ['eventcls'], model='mymodel'),
         ])
+        assert iterables.is_excluded('mymodel', 'foo')
 
     @patch('ramses.models.resolve_to_callable')
     @patch('ramses.models.engine')
+    @patch.dict('ramses.iterables._excluded_fields', clear=True)
     def test_setup_fields_processors(self, mock_eng, mock_resolve):
-        from ramses import models
+        from ramses import models, iterables
         config = Mock()
         schema = {
             'properties': {
@@ -424,6 +429,9 @@ class TestSubscribersSetup(object):
             call([mock_resolve()], model=mock_eng.get_document_cls(),
                  field='owner'),
         ])
+        assert iterables.is_excluded('mymodel', 'stories')
+        assert not iterables.is_excluded('mymodel', 'foo')
+        assert iterables.is_excluded(mock_eng.get_document_cls(), 'owner')
 
     @patch('ramses.models.resolve_to_callable')
     @patch('ramses.models.engine')
@@ -0,0 +1,205 @@
+import threading
+
+import pytest
+from mock import Mock, patch
+
+from ramses import passwords
+
+
+class TestPasswordPool(object):
+
+    def test_encode_check_in_pool_thread(self):
+        manager = Mock()
+        threads = []
+        manager.encode.side_effect = lambda text, *args: (
+            threads.append(threading.current_thread()) or 'hash')
+        pool = passwords.PasswordPool(workers=1, manager=manager)
+        assert pool.encode('secret') == 'hash'
+        manager.encode.assert_called_once_with('secret')
+        assert threads[0] is not threading.current_thread()
+        manager.check.return_value = True
+        assert pool.check('hash', 'secret') is True
+        manager.check.assert_called_once_with('hash', 'secret')
+        assert pool.pending == 0
+
+    def test_encode_rounds(self):
+        manager = Mock()
+        pool = passwords.PasswordPool(rounds=10, manager=manager)
+        pool.encode('secret')
+        manager.encode.assert_called_once_with('secret', 10)
+        pool.encode('secret', rounds=5)
+        manager.encode.assert_called_with('secret', 5)
+
+    def test_match_inline(self):
+        manager = Mock()
+        pool = passwords.PasswordPool(manager=manager)
+        assert pool.match('hash') == manager.match()
+        assert pool._threads == []
+
+    def test_errors_raised(self):
+        manager = Mock()
+        manager.check.side_effect = ValueError('foo')
+        pool = passwords.PasswordPool(manager=manager)
+        with pytest.raises(ValueError):
+            pool.check('hash', 'secret')
+        assert pool.pending == 0
+
+    @patch.object(passwords, 'inc')
+    def test_pool_full(self, mock_inc):
+        started = threading.Event()
+        release = threading.Event()
+
+        def encode(text):
+            started.set()
+            release.wait()
+            return 'hash'
+        manager = Mock()
+        manager.encode.side_effect = encode
+        pool = passwords.PasswordPool(
+            workers=1, max_pending=1, manager=manager)
+        thread = threading.Thread(target=pool.encode, args=('secret',))
+        thread.start()
+        try:
+            started.wait()
+            with pytest.raises(passwords.JHTTPServiceUnavailable):
+                pool.encode('secret')
+        finally:
+            release.set()
+            thread.join()
+        mock_inc.assert_called_once_with(
+            'ramses_password_rejected_total', (('reason', 'pool_full'),))
+        assert pool.pending == 0
+
+    @patch.object(passwords, 'set_gauge')
+    def test_queue_depth_gauge(self, mock_gauge):
+        pool = passwords.PasswordPool(manager=Mock())
+        pool.check('hash', 'secret')
+        assert [call[0] for call in mock_gauge.call_args_list] == [
+            ('ramses_password_queue_depth', 1),
+            ('ramses_password_queue_depth', 0),
+        ]
+
+    @patch.object(passwords.os, 'getpid')
+    def test_restarted_after_fork(self, mock_pid):
+        mock_pid.return_value = 1
+        pool = passwords.PasswordPool(workers=1, manager=Mock())
+        pool.check('hash', 'secret')
+        parent_threads = list(pool._threads)
+        mock_pid.return_value = 2
+        pool.check('hash', 'secret')
+        assert len(pool._threads) == 1
+        assert pool._threads != parent_threads
+
+
+class TestAuthRequestLimiter(object):
+
+    @patch.object(passwords, 'inc')
+    def test_limit(self, mock_inc):
+        limiter = passwords.AuthRequestLimiter(max_requests=1)
+        with limiter:
+            assert limiter.in_progress == 1
+            with pytest.raises(passwords.JHTTPServiceUnavailable):
+                with limiter:
+                    pass
+        assert limiter.in_progress == 0
+        mock_inc.assert_called_once_with(
+            'ramses_password_rejected_total',
+            (('reason', 'auth_requests'),))
+
+    def test_released_on_error(self):
+        limiter = passwords.AuthRequestLimiter(max_requests=1)
+        with pytest.raises(ValueError):
+            with limiter:
+                raise ValueError
+        assert limiter.in_progress == 0
+
+    def test_mixin(self):
+        class DummyBase(object):
+            def create(self):
+                return self.request.registry.auth_request_limiter.in_progress
+
+        class DummyView(passwords.AuthRequestLimitMixin, DummyBase):
+            request = Mock()
+
+        view = DummyView()
+        view.request.registry.auth_request_limiter = \
+            passwords.AuthRequestLimiter(max_requests=2)
+        assert view.create() == 1
+
+    def test_limit_auth_requests(self):
+        class View(object):
+            pass
+        config = Mock()
+        config.registry.password_pool = None
+        assert passwords.limit_auth_requests(config, View) is View
+        config.registry.password_pool = Mock()
+        limited = passwords.limit_auth_requests(config, View)
+        assert issubclass(limited, passwords.AuthRequestLimitMixin)
+        assert issubclass(limited, View)
+        assert limited.__name__ == 'View'
+
+
+class TestIncludeme(object):
+
+    def test_includeme(self):
+        from nefertari.authentication import models
+        config = Mock()
+        config.registry.settings = {
+            'password_pool.workers': '4',
+            'password_pool.rounds': '10',
+            'password_pool.max_auth_requests': '5',
+        }
+        with patch.object(models, 'crypt'):
+            passwords.includeme(config)
+            pool = config.registry.password_pool
+            assert models.crypt is pool
+        assert pool.workers == 4
+        assert pool.rounds == 10
+        assert pool.max_pending == passwords.DEFAULT_MAX_PENDING
+        assert config.registry.auth_request_limiter.max_requests == 5
+
+    def test_includeme_default_max_auth_requests(self):
+        from nefertari.authentication import models
+        config = Mock()
+        config.registry.settings = {'password_pool.workers': '3'}
+        with patch.object(models, 'crypt'):
+            passwords.includeme(config)
+        assert config.registry.auth_request_limiter.max_requests == 3
+
+    def test_rejected_while_pool_saturated(self):
+        from nefertari.authentication import models
+        started = threading.Semaphore(0)
+        release = threading.Event()
+
+        def check(encoded, text):
+            started.release()
+            release.wait()
+            return True
+        config = Mock()
+        config.registry.settings = {'password_pool.workers': '2'}
+        with patch.object(models, 'crypt'):
+            passwords.includeme(config)
+        pool = config.registry.password_pool
+        pool.manager = Mock()
+        pool.manager.check.side_effect = check
+        limiter = config.registry.auth_request_limiter
+
+        def login():
+            with limiter:
+                pool.check('hash', 'secret')
+        threads = [threading.Thread(target=login) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        try:
+            started.acquire()
+            started.acquire()
+            # Both pool threads are busy: next login fails right away
+            # instead of holding a request thread
+            with pytest.raises(passwords.JHTTPServiceUnavailable):
+                login()
+        finally:
+            release.set()
+            for thread in threads:
+                thread.join()
+        assert limiter.in_progress == 0
+        assert pool.pending == 0
@@ -0,0 +1,107 @@
+from mock import Mock, patch
+
+from ramses import prefetch
+
+
+class TestPrefetchHelpers(object):
+
+    def test_get_nesting_depth(self):
+        assert prefetch.get_nesting_depth(object) == 1
+        assert prefetch.get_nesting_depth(Mock(_nesting_depth=3)) == 3
+        assert prefetch.get_nesting_depth(Mock(_nesting_depth=0)) == 0
+
+    @patch.object(prefetch, 'get_loader')
+    @patch.object(prefetch, 'get_relationships')
+    def test_sqla_loader_options(self, mock_rels, mock_loader):
+        class User(object):
+            _nested_relationships = []
+            stories = 'User.stories'
+
+        class Story(object):
+            _nested_relationships = ['owner']
+            owner = 'Story.owner'
+            tags = 'Story.tags'
+
+        relationships = {
+            Story: {'owner': User, 'tags': object},
+            User: {'stories': Story},
+        }
+        mock_rels.side_effect = relationships.get
+        loader = mock_loader.return_value
+        loader.__name__ = 'subqueryload'
+        options = prefetch.sqla_loader_options(Story, depth=1)
+        assert len(options) == 3
+        loader.assert_any_call('Story.owner')
+        loader.assert_any_call('Story.tags')
+        owner_option = loader.return_value
+        owner_option.subqueryload.assert_called_once_with('User.stories')
+
+    @patch.object(prefetch, 'get_loader')
+    @patch.object(prefetch, 'get_relationships')
+    def test_sqla_loader_options_depth_reached(self, mock_rels, mock_loader):
+        class Story(object):
+            _nested_relationships = ['owner']
+            owner = 'Story.owner'
+            tags = 'Story.tags'
+
+        mock_rels.return_value = {'owner': object, 'tags': object}
+        loader = mock_loader.return_value
+        options = prefetch.sqla_loader_options(Story, depth=0)
+        assert len(options) == 2
+        options = prefetch.sqla_loader_options(
+            Story, depth=0, names={'owner'})
+        assert len(options) == 1
+        loader.assert_called_with('Story.owner')
+
+
+class TestPrefetchRelationships(object):
+
+    @patch.object(prefetch, 'sqla_loader_options')
+    def test_sqla(self, mock_options):
+        class Story(object):
+            __table__ = 'stories'
+            _nesting_depth = 2
+
+        mock_options.return_value = ['opt1', 'opt2']
+        objects = Mock(_nefertari_meta={'total': 3})
+        objects.options.return_value = Mock(spec=[])
+        result = prefetch.prefetch_relationships(
+            Story, objects, fields='name,owner,-tags')
+        mock_options.assert_called_once_with(
+            Story, 2, names={'name', 'owner'})
+        objects.options.assert_called_once_with('opt1', 'opt2')
+        assert result is objects.options()
+        assert result._nefertari_meta == {'total': 3}
+
+    @patch.object(prefetch, 'sqla_loader_options')
+    def test_sqla_no_relationships(self, mock_options):
+        class Story(object):
+            __table__ = 'stories'
+
+        mock_options.return_value = []
+        objects = Mock()
+        result = prefetch.prefetch_relationships(Story, objects)
+        mock_options.assert_called_once_with(Story, 1, names=None)
+        assert not objects.options.called
+        assert result is objects
+
+    def test_mongo(self):
+        from ramses.views import ItemsList
+
+        class Story(object):
+            _get_collection = None
+
+        objects = Mock(_nefertari_meta={'total': 2})
+        objects.select_related.return_value = ['obj1', 'obj2']
+        result = prefetch.prefetch_relationships(Story, objects)
+        objects.select_related.assert_called_once_with(max_depth=2)
+        assert isinstance(result, ItemsList)
+        assert result == ['obj1', 'obj2']
+        assert result._nefertari_meta == {'total': 2}
+
+    def test_not_a_collection(self):
+        class Story(object):
+            __table__ = 'stories'
+
+        assert prefetch.prefetch_relationships(Story, 3) == 3
+        assert prefetch.prefetch_relationships(object, [1]) == [1]
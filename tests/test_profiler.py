@@ -0,0 +1,159 @@
+import threading
+
+import pytest
+from mock import Mock, patch
+from pyramid.security import Allow, ALL_PERMISSIONS
+
+from ramses import profiler
+
+
+def _frame(module, name, back=None, self=None):
+    frame = Mock(f_globals={'__name__': module}, f_back=back)
+    frame.f_code.co_name = name
+    frame.f_locals = {'self': self} if self is not None else {}
+    return frame
+
+
+class TestHelpers(object):
+
+    def test_frame_name(self):
+        assert profiler.frame_name(_frame('ramses.views', 'index')) == \
+            'ramses.views:index'
+
+    def test_find_resource(self):
+        view = Mock()
+        view.request.matched_route.name = 'stories'
+        outer = _frame('waitress.task', 'service')
+        view_frame = _frame('ramses.views', 'index', back=outer, self=view)
+        inner = _frame('nefertari.engine', 'get_collection', back=view_frame)
+        assert profiler.find_resource(inner) == 'stories'
+
+    def test_find_resource_not_found(self):
+        outer = _frame('waitress.task', 'service')
+        inner = _frame('ramses.utils', 'helper', back=outer,
+                       self=Mock(spec=[]))
+        assert profiler.find_resource(inner) is None
+
+    @patch.object(profiler, 'find_resource')
+    def test_collapse_stack(self, mock_find):
+        mock_find.return_value = 'stories'
+        outer = _frame('waitress.task', 'service')
+        inner = _frame('ramses.views', 'index', back=outer)
+        assert profiler.collapse_stack(inner) == \
+            'stories;waitress.task:service;ramses.views:index'
+
+    @patch.object(profiler, 'find_resource')
+    def test_collapse_stack_no_resource(self, mock_find):
+        mock_find.return_value = None
+        frame = _frame('waitress.task', 'service')
+        assert profiler.collapse_stack(frame) == '-;waitress.task:service'
+
+
+class TestSamplingProfiler(object):
+
+    @patch.object(profiler, 'collapse_stack')
+    @patch.object(profiler.sys, '_current_frames')
+    def test_sample(self, mock_frames, mock_collapse):
+        mock_frames.return_value = {1: 'a', 2: 'b', 3: 'a'}
+        mock_collapse.side_effect = lambda frame: frame
+        prof = profiler.SamplingProfiler()
+        prof.sample(exclude=(2,))
+        prof.sample()
+        assert prof.stacks == {'a': 4, 'b': 1}
+        assert prof.samples == 2
+
+    def test_collapsed(self):
+        prof = profiler.SamplingProfiler()
+        prof.stacks = {'-;a': 1, 'stories;a;b': 3, 'stories;a': 1}
+        assert prof.collapsed() == (
+            'stories;a;b 3\n'
+            '-;a 1\n'
+            'stories;a 1\n')
+
+    def test_run_samples_other_threads(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait)
+        thread.start()
+        try:
+            prof = profiler.SamplingProfiler(interval=0.001)
+            prof.run(0.01)
+        finally:
+            stop.set()
+            thread.join()
+        assert prof.samples > 0
+        assert any('threading:wait' in stack for stack in prof.stacks)
+        assert not any('profiler:run' in stack for stack in prof.stacks)
+
+
+class TestProfilerView(object):
+
+    @patch.object(profiler, 'SamplingProfiler')
+    def test_view(self, mock_prof):
+        mock_prof.return_value.collapsed.return_value = 'a;b 2\n'
+        mock_prof.return_value.samples = 2
+        view = profiler.profiler_view_factory(max_seconds=5)
+        request = Mock(params={'seconds': '30', 'interval': '10'})
+        response = view(request)
+        mock_prof.assert_called_once_with(interval=0.01)
+        mock_prof.return_value.run.assert_called_once_with(5)
+        assert response.body == b'a;b 2\n'
+        assert response.headers['X-Profile-Samples'] == '2'
+
+    def test_view_invalid_params(self):
+        view = profiler.profiler_view_factory(max_seconds=5)
+        with pytest.raises(profiler.JHTTPBadRequest):
+            view(Mock(params={'seconds': 'foo'}))
+        with pytest.raises(profiler.JHTTPBadRequest):
+            view(Mock(params={'seconds': '0'}))
+        for value in ('nan', 'inf', '-inf'):
+            with pytest.raises(profiler.JHTTPBadRequest):
+                view(Mock(params={'interval': value}))
+
+    @patch.object(profiler, 'SamplingProfiler')
+    def test_view_limits(self, mock_prof):
+        mock_prof.return_value.collapsed.return_value = ''
+        view = profiler.profiler_view_factory(max_seconds=3600)
+        view(Mock(params={'seconds': '1000', 'interval': '0.001'}))
+        mock_prof.assert_called_once_with(interval=0.001)
+        mock_prof.return_value.run.assert_called_once_with(
+            profiler.MAX_SECONDS)
+
+    @patch.object(profiler, 'SamplingProfiler')
+    def test_view_already_running(self, mock_prof):
+        view = profiler.profiler_view_factory(max_seconds=5)
+
+        def run(seconds):
+            with pytest.raises(profiler.JHTTPConflict):
+                view(Mock(params={}))
+        mock_prof.return_value.run.side_effect = run
+        mock_prof.return_value.collapsed.return_value = ''
+        view(Mock(params={}))
+        assert mock_prof.return_value.run.call_count == 1
+
+
+class TestIncludeme(object):
+
+    def test_includeme(self):
+        config = Mock()
+        config.registry.settings = {
+            'profiler.route': '/prof',
+            'profiler.acl': 'allow g:ops all',
+        }
+        profiler.includeme(config)
+        route_kwargs = config.add_route.call_args[1]
+        assert config.add_route.call_args[0] == ('ramses_profiler', '/prof')
+        factory = route_kwargs['factory']
+        assert issubclass(factory, profiler.ProfilerACL)
+        assert factory._collection_acl == (
+            (Allow, 'g:ops', ALL_PERMISSIONS),)
+        view_kwargs = config.add_view.call_args[1]
+        assert view_kwargs['route_name'] == 'ramses_profiler'
+        assert view_kwargs['permission'] == 'view'
+
+    def test_includeme_empty_acl(self):
+        config = Mock()
+        config.registry.settings = {'profiler.acl': '  '}
+        profiler.includeme(config)
+        factory = config.add_route.call_args[1]['factory']
+        assert factory._collection_acl == (
+            (Allow, 'g:admin', ALL_PERMISSIONS),)
@@ -0,0 +1,99 @@
+from mock import Mock, patch
+
+from ramses import replicas
+
+
+class TestReplicaRouter(object):
+
+    def test_is_routable(self):
+        router = replicas.ReplicaRouter(
+            engines=['r1'], exclude=['/api/payments'])
+        assert router.is_routable(Mock(method='GET', path_info='/api/a'))
+        assert router.is_routable(Mock(method='HEAD', path_info='/api/a'))
+        assert not router.is_routable(
+            Mock(method='POST', path_info='/api/a'))
+        assert not router.is_routable(
+            Mock(method='GET', path_info='/api/payments/1'))
+
+    def test_choose_round_robin(self):
+        router = replicas.ReplicaRouter(engines=['r1', 'r2'])
+        assert [router.choose() for i in range(3)] == ['r1', 'r2', 'r1']
+
+    @patch.object(replicas, 'get_replica_lag')
+    def test_choose_skips_lagging(self, mock_lag):
+        mock_lag.side_effect = lambda engine: {'r1': 10, 'r2': 1}[engine]
+        router = replicas.ReplicaRouter(engines=['r1', 'r2'], max_lag=5)
+        assert router.choose() == 'r2'
+        assert router.choose() == 'r2'
+        assert mock_lag.call_count == 2
+
+    @patch.object(replicas, 'get_replica_lag')
+    def test_is_healthy_cached(self, mock_lag):
+        mock_lag.return_value = 1
+        router = replicas.ReplicaRouter(
+            engines=['r1'], max_lag=5, lag_check_interval=60)
+        assert router.is_healthy('r1')
+        assert router.is_healthy('r1')
+        mock_lag.assert_called_once_with('r1')
+        router.lag_check_interval = 0
+        mock_lag.return_value = 6
+        assert not router.is_healthy('r1')
+
+    @patch.object(replicas, 'get_replica_lag')
+    def test_is_healthy_check_error(self, mock_lag):
+        mock_lag.side_effect = Exception('down')
+        router = replicas.ReplicaRouter(engines=['r1'], max_lag=5)
+        assert not router.is_healthy('r1')
+        assert router.choose() is None
+
+    def test_get_bind(self):
+        router = replicas.ReplicaRouter(engines=['r1'])
+        assert router.get_bind(Mock(method='GET', path_info='/')) == 'r1'
+        assert router.get_bind(Mock(method='PUT', path_info='/')) is None
+        router = replicas.ReplicaRouter(engines=[])
+        assert router.get_bind(Mock(method='GET', path_info='/')) is None
+
+
+class TestRoutingSession(object):
+
+    def _session(self):
+        class Session(object):
+            _flushing = False
+
+            def __init__(self):
+                self.info = {}
+
+            def get_bind(self, *args, **kwargs):
+                return 'primary'
+
+        factory = Mock(class_=Session)
+        replicas.install_routing_session(Mock(session_factory=factory))
+        return factory.class_()
+
+    def test_install_routing_session(self):
+        session = self._session()
+        assert isinstance(session, replicas.RoutingSessionMixin)
+        factory = Mock(class_=type(session))
+        replicas.install_routing_session(Mock(session_factory=factory))
+        assert factory.class_ is type(session)
+
+    def test_get_bind(self):
+        session = self._session()
+        assert session.get_bind() == 'primary'
+        replicas.set_replica_bind(session, 'replica')
+        assert session.get_bind() == 'replica'
+        replicas.set_replica_bind(session, None)
+        assert session.get_bind() == 'primary'
+
+    def test_get_bind_after_flush(self):
+        session = self._session()
+        replicas.set_replica_bind(session, 'replica')
+        session._flushing = True
+        assert session.get_bind() == 'primary'
+        session._flushing = False
+        assert session.get_bind() == 'primary'
+
+
+def test_split_setting():
+    assert replicas.split_setting(None) == []
+    assert replicas.split_setting('a, b\n c') == ['a', 'b', 'c']
@@ -0,0 +1,208 @@
+from mock import Mock, patch
+
+from ramses import serializers
+
+
+class Story(object):
+    _public_fields = ['name']
+    _auth_fields = ['name', 'description', 'secret', 'owner']
+    _hidden_fields = ['secret']
+
+
+class User(object):
+    _public_fields = ['username']
+    _auth_fields = ['username', 'email']
+    _owner_fields = ['settings']
+    _hidden_fields = []
+
+    def __init__(self, username, admin=False):
+        self.username = username
+        self.admin = admin
+
+    @classmethod
+    def pk_field(cls):
+        return 'username'
+
+    @classmethod
+    def is_admin(cls, user):
+        return user.admin
+
+
+def _story_data():
+    return {
+        '_type': 'Story', '_pk': '1', '_self': 'http://x/stories/1',
+        'name': 'foo', 'description': 'bar', 'secret': 'baz',
+        'owner': {'_type': 'User', '_pk': 'a', 'username': 'a',
+                  'email': 'a@a.com', 'password': 'p'},
+    }
+
+
+class TestSerializers(object):
+
+    def setup_method(self, method):
+        serializers._serializers.clear()
+        serializers.compile_serializers(Story)
+        serializers.compile_serializers(User)
+
+    def test_get_visible_fields(self):
+        assert serializers.get_visible_fields(Story, 'admin') is None
+        assert serializers.get_visible_fields(Story, 'public') == {'name'}
+        assert serializers.get_visible_fields(
+            Story, 'authenticated') == {'name', 'description', 'owner'}
+        assert serializers.get_visible_fields(
+            Story, 'public', drop_hidden=False) == {'name', 'secret'}
+        assert serializers.get_visible_fields(
+            User, 'owner') == {'username', 'email', 'settings'}
+
+    def test_compile_serializers(self):
+        for audience in serializers.AUDIENCES:
+            serializer = serializers.get_serializer('Story', audience)
+            assert serializer.__name__ == 'serialize_Story_{}'.format(
+                audience)
+            serializer = serializers.get_serializer('Story', audience, False)
+            assert serializer.__name__ == (
+                'serialize_Story_{}_with_hidden'.format(audience))
+
+    def test_serialize_public(self):
+        result = serializers.serialize_document(_story_data(), 'public')
+        assert result == {
+            '_type': 'Story', '_pk': '1', '_self': 'http://x/stories/1',
+            'name': 'foo'}
+
+    def test_serialize_authenticated_nested(self):
+        result = serializers.serialize_document(
+            _story_data(), 'authenticated')
+        assert set(result.keys()) == {
+            '_type', '_pk', '_self', 'name', 'description', 'owner'}
+        assert result['owner'] == {
+            '_type': 'User', '_pk': 'a', 'username': 'a',
+            'email': 'a@a.com'}
+
+    def test_serialize_admin(self):
+        data = _story_data()
+        result = serializers.serialize_document(data, 'admin')
+        assert result == data
+
+    def test_serialize_nested_list(self):
+        data = {'_type': 'User', 'username': 'a', 'email': 'b',
+                'stories': [_story_data()]}
+        User._auth_fields.append('stories')
+        try:
+            # Serializers are compiled when models are generated
+            serializers.compile_serializers(User)
+            result = serializers.serialize_document(data, 'authenticated')
+        finally:
+            User._auth_fields.remove('stories')
+        assert 'secret' not in result['stories'][0]
+
+    def test_serialize_drop_hidden(self):
+        result = serializers.serialize_document(
+            _story_data(), 'public', drop_hidden=False)
+        assert result['secret'] == 'baz'
+
+    def test_serialize_owner(self):
+        data = {'_type': 'User', '_pk': 'a', 'username': 'a',
+                'email': 'b', 'settings': {}}
+        result = serializers.serialize_document(
+            data, 'authenticated', owner=('User', 'a'))
+        assert result == data
+        result = serializers.serialize_document(
+            data, 'authenticated', owner=('User', 'b'))
+        assert 'settings' not in result
+        story = _story_data()
+        story['owner']['settings'] = {}
+        result = serializers.serialize_document(
+            story, 'authenticated', owner=('User', 'a'))
+        assert 'settings' in result['owner']
+
+    def test_serialize_nested_fields_only(self):
+        class Tag(object):
+            _public_fields = ['name', 'parent', 'meta']
+            _hidden_fields = []
+            _nested_relationships = ['parent']
+            _nesting_depth = 2
+
+        serializers.compile_serializers(Tag)
+        data = {
+            '_type': 'Tag', 'name': 'a',
+            'meta': {'_type': 'User', 'username': 'u', 'email': 'e'},
+            'parent': {
+                '_type': 'Tag', 'name': 'b', 'parent': {
+                    '_type': 'Tag', '_pk': '3', 'name': 'c', 'parent': {
+                        '_type': 'Tag', '_pk': '4', 'name': 'd'}}},
+        }
+        result = serializers.serialize_document(data, 'public')
+        # Not a relationship field
+        assert result['meta'] == data['meta']
+        assert result['parent']['name'] == 'b'
+        assert result['parent']['parent']['name'] == 'c'
+        # Deeper than nesting depth of the top-level document
+        assert result['parent']['parent']['parent'] == {
+            '_type': 'Tag', '_pk': '4'}
+
+    def test_serialize_not_document(self):
+        data = {'foo': 1}
+        assert serializers.serialize_document(data, 'public') is data
+
+    @patch('nefertari.engine')
+    def test_get_serializer_lazy_compilation(self, mock_engine):
+        serializers._serializers.clear()
+        mock_engine.get_document_cls.return_value = Story
+        serializer = serializers.get_serializer('Story', 'public')
+        mock_engine.get_document_cls.assert_called_once_with('Story')
+        assert serializer({'_type': 'Story', 'secret': 1}) == {
+            '_type': 'Story'}
+
+    @patch('nefertari.engine')
+    def test_get_serializer_unknown_model(self, mock_engine):
+        mock_engine.get_document_cls.side_effect = ValueError
+        assert serializers.get_serializer('Foo', 'public') is None
+        data = {'_type': 'Foo', 'a': 1}
+        assert serializers.serialize_document(data, 'public') is data
+
+    def test_get_audience(self):
+        assert serializers.get_audience(Mock(user=None)) == 'public'
+        request = Mock(user=User('a'))
+        assert serializers.get_audience(request) == 'authenticated'
+        assert serializers.get_audience(request, is_admin=True) == 'admin'
+        request.user.admin = True
+        assert serializers.get_audience(request) == 'admin'
+
+    def test_get_owner(self):
+        assert serializers.get_owner(Mock(user=None)) is None
+        assert serializers.get_owner(Mock(user=User('a'))) == ('User', 'a')
+
+    def test_apply_compiled_privacy(self):
+        wrapper = serializers.apply_compiled_privacy(Mock(user=None))
+        result = wrapper(result={'data': [_story_data()], 'total': 1})
+        assert result['total'] == 1
+        assert result['data'][0] == {
+            '_type': 'Story', '_pk': '1', '_self': 'http://x/stories/1',
+            'name': 'foo'}
+        result = wrapper(result=_story_data())
+        assert 'description' not in result
+
+    def test_apply_compiled_privacy_owner(self):
+        wrapper = serializers.apply_compiled_privacy(Mock(user=User('a')))
+        data = {'_type': 'User', '_pk': 'a', 'username': 'a',
+                'settings': {}, 'password': 'p'}
+        result = wrapper(result={'data': [data, 'foo']})
+        assert result['data'][0] == {
+            '_type': 'User', '_pk': 'a', 'username': 'a', 'settings': {}}
+        assert result['data'][1] == 'foo'
+
+    def test_apply_compiled_privacy_kwargs(self):
+        wrapper = serializers.apply_compiled_privacy(Mock(user=None))
+        result = wrapper(result=_story_data(), drop_hidden=False)
+        assert result['secret'] == 'baz'
+        wrapper = serializers.apply_compiled_privacy(Mock(user=User('b')))
+        assert 'secret' not in wrapper(result=_story_data())
+        result = wrapper(result=_story_data(), is_admin=True)
+        assert result['secret'] == 'baz'
+
+    def test_apply_compiled_privacy_not_dict(self):
+        wrapper = serializers.apply_compiled_privacy(Mock(user=None))
+        assert wrapper(result='foo') == 'foo'
+        data = _story_data()
+        wrapper = serializers.apply_compiled_privacy(None)
+        assert wrapper(result=data) is data
@@ -0,0 +1,136 @@
+import json
+
+from mock import Mock, patch
+
+from ramses import slowlog
+
+
+class TestHelpers(object):
+
+    def test_find_caller(self):
+        frame = Mock(f_globals={'__name__': 'ramses.views'})
+        frame.f_code.co_name = 'get_collection_es'
+        frame.f_locals = {'self': Mock(request='req')}
+        outer = Mock(f_globals={'__name__': 'nefertari.elasticsearch'})
+        outer.f_back = frame
+        assert slowlog.find_caller(outer) == (
+            'ramses.views:get_collection_es', 'req')
+
+    def test_find_caller_skips_wrappers(self):
+        frame = Mock(f_globals={'__name__': 'ramses.views'})
+        frame.f_code.co_name = 'get_collection_es'
+        frame.f_locals = {'self': Mock(request='req')}
+        for module in ('ramses.esclient', 'ramses.slowlog', 'ramses.metrics'):
+            wrapper = Mock(f_globals={'__name__': module})
+            wrapper.f_code.co_name = 'wrapper'
+            wrapper.f_back = frame
+            frame = wrapper
+        assert slowlog.find_caller(frame) == (
+            'ramses.views:get_collection_es', 'req')
+
+    def test_find_caller_not_found(self):
+        frame = Mock(f_globals={'__name__': 'ramses.slowlog'}, f_back=None)
+        assert slowlog.find_caller(frame) == (None, None)
+        assert slowlog.find_caller(None) == (None, None)
+
+    def test_response_stats(self):
+        assert slowlog._response_stats(None) == (None, None)
+        assert slowlog._response_stats(
+            {'took': 5, 'hits': {'total': 10}}) == (5, 10)
+        assert slowlog._response_stats(
+            {'took': 5, 'hits': {'total': {'value': 3}}}) == (5, 3)
+        assert slowlog._response_stats({'count': 7}) == (None, 7)
+        assert slowlog._response_stats(
+            {'docs': [{'found': True}, {'found': False}]}) == (None, 1)
+
+
+@patch.object(slowlog, 'default_timer')
+class TestSlowQueryLog(object):
+
+    def test_fast_call_not_recorded(self, mock_timer):
+        mock_timer.side_effect = [0, 0.05]
+        slow_log = slowlog.SlowQueryLog(threshold_ms=100)
+        slow_log.record = Mock()
+        wrapped = slow_log.wrap('search', Mock(return_value='res'))
+        assert wrapped(body={}) == 'res'
+        assert not slow_log.record.called
+
+    def test_slow_call_recorded(self, mock_timer):
+        mock_timer.side_effect = [0, 0.2]
+        slow_log = slowlog.SlowQueryLog(threshold_ms=100)
+        slow_log.record = Mock()
+        wrapped = slow_log.wrap('search', Mock(return_value='res'))
+        assert wrapped(index='foo', body={'query': {}}) == 'res'
+        args = slow_log.record.call_args[0]
+        assert args[:2] == ('search', {'index': 'foo', 'body': {'query': {}}})
+        assert round(args[2]) == 200
+        assert args[3:] == ('res', None)
+
+    def test_failed_call_recorded(self, mock_timer):
+        import pytest
+        mock_timer.side_effect = [0, 0.2]
+        slow_log = slowlog.SlowQueryLog(threshold_ms=100)
+        slow_log.record = Mock()
+        error = ValueError('boom')
+        wrapped = slow_log.wrap('get', Mock(side_effect=error))
+        with pytest.raises(ValueError):
+            wrapped(id=1)
+        assert slow_log.record.call_args[0][4] is error
+
+    @patch.object(slowlog.random, 'random')
+    def test_sampling(self, mock_random, mock_timer):
+        mock_timer.side_effect = [0, 0.2, 0, 0.2]
+        mock_random.side_effect = [0.7, 0.3]
+        slow_log = slowlog.SlowQueryLog(threshold_ms=100, sample_rate=0.5)
+        slow_log.record = Mock()
+        wrapped = slow_log.wrap('count', Mock())
+        wrapped()
+        assert not slow_log.record.called
+        wrapped()
+        assert slow_log.record.called
+
+
+class TestRecord(object):
+
+    def test_record_to_file(self, tmpdir):
+        path = str(tmpdir.join('slow.jsonl'))
+        slow_log = slowlog.SlowQueryLog(threshold_ms=100, path=path)
+        request = Mock(method='GET', path='/stories')
+        request.matched_route.name = 'stories'
+        with patch.object(slowlog, 'find_caller') as mock_caller:
+            mock_caller.return_value = ('ramses.views:index', request)
+            slow_log.record(
+                'search',
+                {'index': 'idx', 'doc_type': 'Story', 'body': {'q': 1},
+                 'size': 10},
+                duration_ms=150.123,
+                result={'took': 120, 'hits': {'total': 4}})
+        with open(path) as f:
+            entry = json.loads(f.readline())
+        assert entry['operation'] == 'search'
+        assert entry['index'] == 'idx'
+        assert entry['doc_type'] == 'Story'
+        assert entry['body'] == {'q': 1}
+        assert entry['params'] == {'size': 10}
+        assert entry['duration_ms'] == 150.12
+        assert entry['took'] == 120
+        assert entry['hits'] == 4
+        assert entry['caller'] == 'ramses.views:index'
+        assert entry['route'] == 'stories'
+        assert entry['path'] == '/stories'
+
+    @patch.object(slowlog, 'log')
+    def test_record_to_log(self, mock_log):
+        slow_log = slowlog.SlowQueryLog(threshold_ms=100)
+        slow_log.record('count', {}, 100, error=ValueError('boom'))
+        entry = json.loads(mock_log.warning.call_args[0][0])
+        assert entry['error'] == 'boom'
+        assert 'route' not in entry
+
+    def test_install(self):
+        client = Mock(spec=['search', 'index'])
+        search = client.search
+        slow_log = slowlog.SlowQueryLog(threshold_ms=100)
+        slow_log.install(client)
+        assert client.search is not search
+        assert client.search.__name__ == 'search'
@@ -0,0 +1,119 @@
+import pytest
+from mock import Mock, patch
+
+from ramses import timing
+
+
+@pytest.fixture
+def enabled(request):
+    timing._enabled = True
+
+    def disable():
+        timing._enabled = False
+    request.addfinalizer(disable)
+
+
+@patch.object(timing, 'default_timer')
+class TestRequestTimer(object):
+
+    def test_exclusive_times(self, mock_timer):
+        mock_timer.side_effect = [0, 1, 4, 6]
+        timer = timing.RequestTimer()
+        timer.start('db')
+        timer.start('acl')
+        timer.stop()
+        timer.stop()
+        assert timer.totals == {'db': 3, 'acl': 3}
+
+    def test_repeated_category(self, mock_timer):
+        mock_timer.side_effect = [0, 1, 5, 7]
+        timer = timing.RequestTimer()
+        timer.start('es')
+        timer.stop()
+        timer.start('es')
+        timer.stop()
+        assert timer.totals == {'es': 3}
+
+    def test_inclusive_category(self, mock_timer):
+        mock_timer.side_effect = [0, 1, 6, 8]
+        timer = timing.RequestTimer()
+        timer.start('db')
+        timer.start('parent')
+        timer.start('es')
+        timer.start('acl')
+        timer.stop()
+        timer.stop()
+        timer.stop()
+        timer.stop()
+        assert timer.totals == {'db': 3, 'parent': 5}
+
+
+class TestTimed(object):
+
+    def test_disabled(self):
+        request = Mock(spec=[])
+        with timing.timed(request, 'db'):
+            pass
+        assert not hasattr(request, '_ramses_cache')
+
+    def test_enabled(self, enabled):
+        request = Mock()
+        with timing.timed(request, 'db'):
+            pass
+        assert 'db' in timing.get_timer(request).totals
+
+    def test_timed_method(self, enabled):
+        class View(object):
+            request = Mock()
+
+            @timing.timed_method('es')
+            def get(self, value):
+                return value
+
+        view = View()
+        assert view.get(1) == 1
+        assert View.get.__name__ == 'get'
+        assert 'es' in timing.get_timer(view.request).totals
+
+    def test_timed_event_handler(self, enabled):
+        handler = Mock(return_value=1)
+        wrapped = timing.timed_event_handler(handler)
+        event = Mock()
+        assert wrapped(event) == 1
+        handler.assert_called_once_with(event)
+        assert 'events' in timing.get_timer(event.view.request).totals
+
+    def test_timed_event_handler_no_view(self, enabled):
+        handler = Mock(return_value=1)
+        wrapped = timing.timed_event_handler(handler)
+        assert wrapped(Mock(view=None)) == 1
+
+
+class TestServerTiming(object):
+
+    def test_format_server_timing(self):
+        header = timing.format_server_timing(
+            {'es': 0.002, 'acl': 0.001}, total=0.005)
+        assert header == (
+            'acl;dur=1.00, es;dur=2.00, app;dur=2.00, total;dur=5.00')
+
+    def test_tween(self):
+        response = Mock(headers={}, status_code=200)
+        handler = Mock(return_value=response)
+        tween = timing.server_timing_tween_factory(handler, None)
+        request = Mock(method='GET', path='/stories')
+        timing.get_timer(request).totals['db'] = 0.001
+        assert tween(request) is response
+        handler.assert_called_once_with(request)
+        assert response.headers['Server-Timing'].startswith(
+            'db;dur=1.00, app;dur=')
+
+    def test_includeme(self):
+        config = Mock()
+        try:
+            timing.includeme(config)
+            assert timing.is_enabled()
+        finally:
+            timing._enabled = False
+        config.add_tween.assert_called_once_with(
+            'ramses.timing.server_timing_tween_factory')
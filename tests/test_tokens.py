@@ -0,0 +1,212 @@
+import pytest
+from mock import Mock, patch
+from pyramid.security import Everyone, Authenticated
+
+from ramses import tokens
+
+
+def _request(token=None):
+    request = Mock(_ramses_cache=None)
+    request.headers = {}
+    if token is not None:
+        request.headers['Authorization'] = 'Bearer ' + token
+    return request
+
+
+class TestTokenSigner(object):
+
+    def test_no_secrets(self):
+        with pytest.raises(ValueError):
+            tokens.TokenSigner([])
+
+    def test_sign_verify(self):
+        signer = tokens.TokenSigner(['secret'])
+        token = signer.sign({'uid': 1, 'grp': ['g:admin']})
+        key_id, _, _ = token.split('.')
+        assert key_id == tokens.TokenSigner.key_id('secret')
+        assert signer.verify(token) == {'uid': 1, 'grp': ['g:admin']}
+
+    def test_verify_tampered(self):
+        signer = tokens.TokenSigner(['secret'])
+        token = signer.sign({'uid': 1})
+        key_id, data, signature = token.split('.')
+        forged = tokens._b64encode(b'{"uid":2}')
+        assert signer.verify('.'.join([key_id, forged, signature])) is None
+        assert signer.verify(token[:-2]) is None
+        assert signer.verify('foo') is None
+        assert signer.verify('a.b.c.d') is None
+
+    def test_key_rotation(self):
+        old = tokens.TokenSigner(['old'])
+        rotated = tokens.TokenSigner(['new', 'old'])
+        token = old.sign({'uid': 1})
+        assert rotated.verify(token) == {'uid': 1}
+        new_token = rotated.sign({'uid': 1})
+        assert new_token.startswith(tokens.TokenSigner.key_id('new'))
+        assert old.verify(new_token) is None
+        assert tokens.TokenSigner(['new']).verify(token) is None
+
+
+class TestSignedTokenAuthenticationPolicy(object):
+
+    def _policy(self, **kwargs):
+        auth_model = Mock(__name__='User')
+        auth_model.pk_field.return_value = 'id'
+        auth_model.get_groups_by_userid.return_value = ['g:admin']
+        kwargs.setdefault('revocation_check_interval', 0)
+        return tokens.SignedTokenAuthenticationPolicy(
+            auth_model, ['secret'], max_age=60, **kwargs)
+
+    def test_effective_principals(self):
+        policy = self._policy()
+        token = policy.issue(1, ['g:admin'])
+        request = _request(token)
+        assert policy.effective_principals(request) == [
+            Everyone, Authenticated, 1, 'g:admin']
+        assert policy.authenticated_userid(request) == 1
+        assert policy.unauthenticated_userid(request) == 1
+        assert not policy.auth_model.get_groups_by_userid.called
+
+    def test_anonymous(self):
+        policy = self._policy()
+        request = _request()
+        assert policy.effective_principals(request) == [Everyone]
+        assert policy.authenticated_userid(request) is None
+        assert policy.unauthenticated_userid(request) is None
+        request.headers['Authorization'] = 'ApiKey foo:bar'
+        assert policy.authenticated_userid(request) is None
+
+    def test_non_int_userid(self):
+        policy = self._policy()
+        userid = type('ObjectId', (object,), {
+            '__str__': lambda self: 'abc'})()
+        token = policy.issue(userid, [])
+        assert policy.authenticated_userid(_request(token)) == 'abc'
+
+    def test_expired(self):
+        policy = self._policy()
+        token = policy.issue(1, ['g:admin'], now=1000)
+        with patch.object(tokens.time, 'time', return_value=1061):
+            assert policy.authenticated_userid(_request(token)) is None
+        with patch.object(tokens.time, 'time', return_value=1059):
+            assert policy.authenticated_userid(_request(token)) == 1
+
+    def test_payload_cached_per_request(self):
+        policy = self._policy()
+        request = _request(policy.issue(1, ['g:admin']))
+        with patch.object(policy, '_verify') as mock_verify:
+            policy.authenticated_userid(request)
+            policy.effective_principals(request)
+        mock_verify.assert_called_once_with(request)
+
+    def test_revocation_check(self):
+        policy = self._policy(revocation_check_interval=300)
+        get_groups = policy.auth_model.get_groups_by_userid
+        token = policy.issue(1, ['g:admin'])
+        assert policy.authenticated_userid(_request(token)) == 1
+        assert policy.authenticated_userid(_request(token)) == 1
+        assert get_groups.call_count == 1
+
+        get_groups.return_value = ['g:staff']
+        assert policy.authenticated_userid(_request(token)) == 1
+        policy.invalidate(Mock(instance=Mock(id=1)))
+        assert policy.authenticated_userid(_request(token)) is None
+
+        get_groups.return_value = None
+        policy.invalidate(Mock(instance=None))
+        assert policy.authenticated_userid(_request(token)) is None
+
+    def test_remember(self):
+        policy = self._policy()
+        request = _request()
+        headers = policy.remember(request, 1)
+        policy.auth_model.get_groups_by_userid.assert_called_once_with(
+            1, request)
+        name, value = headers[0]
+        assert name == 'Authorization'
+        assert value.startswith('Bearer ')
+        payload = policy.signer.verify(value[len('Bearer '):])
+        assert payload['uid'] == 1
+        assert payload['grp'] == ['g:admin']
+        assert payload['exp'] - payload['iat'] == 60
+
+    def test_remember_no_user(self):
+        policy = self._policy()
+        policy.auth_model.get_groups_by_userid.return_value = None
+        assert policy.remember(_request(), 1) == []
+        assert policy.forget(_request()) == []
+
+    def test_forget_revokes_token(self):
+        policy = self._policy()
+        token = policy.issue(1, ['g:admin'])
+        other_token = policy.issue(2, ['g:admin'])
+        assert policy.forget(_request(token)) == []
+        assert policy.authenticated_userid(_request(token)) is None
+        assert policy.authenticated_userid(_request(other_token)) == 2
+
+    def test_forget_revokes_until_expiry(self):
+        policy = self._policy()
+        token = policy.issue(1, ['g:admin'], now=1000)
+        with patch.object(tokens.time, 'time', return_value=1010):
+            policy.forget(_request(token))
+        with patch.object(tokens.time, 'time', return_value=1050):
+            assert policy.authenticated_userid(_request(token)) is None
+        assert policy.revoked_tokens._entries[token][0] == 1060
+
+
+class TestTokenUser(object):
+
+    def _policy(self):
+        class User(object):
+            get_authuser_by_userid = Mock()
+
+            @classmethod
+            def pk_field(cls):
+                return 'username'
+
+            @classmethod
+            def is_admin(cls, user):
+                return 'admin' in user.groups
+
+        policy = tokens.SignedTokenAuthenticationPolicy(
+            User, ['secret'], revocation_check_interval=0)
+        return User, policy
+
+    def test_get_user(self):
+        User, policy = self._policy()
+        request = _request(policy.issue('user12', ['g:admin', 'g:staff']))
+        user = policy.get_user(request)
+        assert isinstance(user, User)
+        assert type(user).__name__ == 'User'
+        assert user.username == 'user12'
+        assert user.groups == ['admin', 'staff']
+        assert user.pk_field() == 'username'
+        assert type(user).is_admin(user)
+        assert not User.get_authuser_by_userid.called
+
+    def test_get_user_anonymous(self):
+        _, policy = self._policy()
+        assert policy.get_user(_request()) is None
+        assert policy.get_user(_request('foo')) is None
+
+    def test_lazy_load(self):
+        User, policy = self._policy()
+        User.get_authuser_by_userid.return_value = Mock(email='a@b.c')
+        request = _request(policy.issue('user12', []))
+        user = policy.get_user(request)
+        assert user.email == 'a@b.c'
+        assert user.email == 'a@b.c'
+        User.get_authuser_by_userid.assert_called_once_with(request)
+        with pytest.raises(AttributeError):
+            user._private
+
+    def test_load_user_param(self):
+        User, _ = self._policy()
+        load_user = Mock(return_value=Mock(email='a@b.c'))
+        policy = tokens.SignedTokenAuthenticationPolicy(
+            User, ['secret'], revocation_check_interval=0,
+            load_user=load_user)
+        request = _request(policy.issue('user12', []))
+        assert policy.get_user(request).email == 'a@b.c'
+        load_user.assert_called_once_with(request)
+        assert not User.get_authuser_by_userid.called
@@ -418,4 +418,31 @@ class TestUtils(object):
 
     def test_get_resource_uri(self):
         resource = Mock(path='/foobar/zoo ')
-        assert utils.get_resource_uri(resource) == 'zoo'
\ No newline at end of file
+        assert utils.get_resource_uri(resource) == 'zoo'
+
+    def test_json_default(self):
+        import datetime
+        import decimal
+        value = datetime.date(2015, 1, 2)
+        assert utils.json_default(value) == '2015-01-02'
+        assert utils.json_default(decimal.Decimal('1.5')) == '1.5'
+
+
+class TestModelHelpers(object):
+
+    def test_get_model_field_names_sqla(self):
+        class Model(object):
+            __table__ = Mock()
+        Model.__table__.columns.keys.return_value = ['id', 'name']
+        assert utils.is_sqla_model(Model)
+        assert utils.get_model_field_names(Model) == ['id', 'name']
+
+    def test_get_model_field_names_mongo(self):
+        class Model(object):
+            _get_collection = Mock()
+            _fields = {'id': 1}
+        assert utils.is_mongo_model(Model)
+        assert utils.get_model_field_names(Model) == ['id']
+
+    def test_get_model_field_names_unknown(self):
+        assert utils.get_model_field_names(object) == []
@@ -51,6 +51,22 @@ class TestBaseView(ViewTestBase):
         view = self._test_view()
         assert view._query_params['_limit'] == 20
 
+    def test_setup_default_wrappers(self):
+        from nefertari import wrappers
+        from ramses.serializers import apply_compiled_privacy
+        # Privacy wrappers are only set up when auth is enabled
+        self.view_cls.root_resource = Mock(auth=True)
+        try:
+            view = self._test_view()
+        finally:
+            del self.view_cls.root_resource
+        for calls in view._after_calls.values():
+            assert not any(
+                isinstance(call, wrappers.apply_privacy) for call in calls)
+        assert any(
+            isinstance(call, apply_compiled_privacy)
+            for call in view._after_calls['index'])
+
     def test_clean_id_name(self):
         view = self._test_view()
         view._resource = Mock(id_name='foo')
@@ -141,6 +157,16 @@ class TestBaseView(ViewTestBase):
         view._resource = Mock(id_name='foo')
         assert view._get_context_key(foo='bar') == 'bar'
 
+    @patch('ramses.views.prefetch_relationships')
+    def test_prefetch_relationships(self, mock_prefetch):
+        view = self._test_view()
+        view.Model = Mock()
+        view._query_params['_fields'] = 'name,owner'
+        result = view.prefetch_relationships(['obj'])
+        mock_prefetch.assert_called_once_with(
+            view.Model, ['obj'], fields='name,owner')
+        assert result == mock_prefetch()
+
     def test_parent_queryset(self):
         from pyramid.config import Configurator
         from ramses.acl import BaseACL
@@ -181,6 +207,75 @@ class TestBaseView(ViewTestBase):
             get_item.assert_called_once_with(username='user12')
             assert result == get_item().stories
 
+    def test_pop_ids_param(self):
+        view = self._test_view()
+        assert view._pop_ids_param() is None
+        view._query_params['_ids'] = ' 3,1,,3 '
+        assert view._pop_ids_param() == ['3', '1']
+        assert '_ids' not in view._query_params
+        view._query_params['_ids'] = [2, '1']
+        assert view._pop_ids_param() == ['2', '1']
+
+    def _multiget_view(self, allowed=True):
+        view = self._test_view()
+        view.Model = Mock()
+        view.Model.pk_field.return_value = 'id'
+        view._get_acl = Mock()
+        view.prefetch_relationships = Mock(side_effect=lambda objects: objects)
+        view.request.has_permission.return_value = allowed
+        return view
+
+    def test_viewable_items(self):
+        view = self._multiget_view()
+        objects = [Mock(id=1), Mock(id=3)]
+        items = view._viewable_items(['3', '2', '1'], objects, False)
+        view._get_acl.assert_called_once_with(es_based=False)
+        assert items == [objects[1], objects[0]]
+        assert items._nefertari_meta['missing'] == ['2']
+        assert items._nefertari_meta['total'] == 2
+        acl = view._get_acl()
+        assert objects[0].__acl__ == acl.item_acl()
+        assert objects[0].__parent__ is acl
+        view.request.has_permission.assert_any_call('view', objects[0])
+
+    def test_viewable_items_not_allowed(self):
+        view = self._multiget_view(allowed=False)
+        objects = [Mock(id=1)]
+        items = view._viewable_items(['1'], objects, False)
+        assert items == []
+        assert items._nefertari_meta['missing'] == ['1']
+
+    def test_get_items(self):
+        view = self._multiget_view()
+        view._parent_queryset = Mock(return_value=None)
+        view._viewable_items = Mock()
+        view.prefetch_relationships = Mock(return_value=['prefetched'])
+        view.Model.get_collection.return_value = ['obj']
+        result = view.get_items(['1', '2'])
+        view.Model.get_collection.assert_called_once_with(
+            id=['1', '2'], _limit=2)
+        view.prefetch_relationships.assert_called_once_with(['obj'])
+        view._viewable_items.assert_called_once_with(
+            ['1', '2'], ['prefetched'], es_based=False)
+        assert result == view._viewable_items()
+
+    def test_get_items_parent_queryset(self):
+        view = self._multiget_view()
+        view._parent_queryset = Mock(return_value=[Mock(id=2)])
+        view._viewable_items = Mock()
+        view.get_items(['1', '2'])
+        view.Model.get_collection.assert_called_once_with(
+            id=['2'], _limit=1)
+
+    def test_get_items_no_ids_left(self):
+        view = self._multiget_view()
+        view._parent_queryset = Mock(return_value=[])
+        view._viewable_items = Mock()
+        view.get_items(['1'])
+        assert not view.Model.get_collection.called
+        view._viewable_items.assert_called_once_with(
+            ['1'], [], es_based=False)
+
     def test_reload_context(self):
         class Factory(dict):
             item_model = None
@@ -202,9 +297,43 @@ class TestCollectionView(ViewTestBase):
     def test_index(self):
         view = self._test_view()
         view.get_collection = Mock()
+        view.prefetch_relationships = Mock()
         resp = view.index(foo='bar')
         view.get_collection.assert_called_once_with()
-        assert resp == view.get_collection()
+        view.prefetch_relationships.assert_called_once_with(
+            view.get_collection())
+        assert resp == view.prefetch_relationships()
+
+    def test_index_head(self):
+        view = self._test_view()
+        view.request.method = 'HEAD'
+        view.request.response.headers = {}
+        view.get_collection = Mock(return_value=42)
+        resp = view.index(foo='bar')
+        view.get_collection.assert_called_once_with()
+        assert view._query_params['_count']
+        assert resp is view.request.response
+        assert resp.headers['X-Total-Count'] == '42'
+
+    def test_show_head(self):
+        view = self._test_view()
+        view.request.method = 'HEAD'
+        view.request.response.headers = {}
+        view.get_item = Mock()
+        resp = view.show(foo='bar')
+        view.get_item.assert_called_once_with(foo='bar')
+        assert resp is view.request.response
+        assert 'X-Total-Count' not in resp.headers
+
+    def test_index_ids(self):
+        view = self._test_view()
+        view._query_params['_ids'] = '3,1'
+        view.get_collection = Mock()
+        view.get_items = Mock()
+        resp = view.index(foo='bar')
+        view.get_items.assert_called_once_with(['3', '1'])
+        assert not view.get_collection.called
+        assert resp == view.get_items()
 
     def test_show(self):
         view = self._test_view()
@@ -351,6 +480,15 @@ class TestESBaseView(ViewTestBase):
         assert not mock_es().get_collection.called
         assert result == []
 
+    @patch('nefertari.elasticsearch.ES')
+    def test_get_collection_es_parent_no_obj_ids_count(self, mock_es):
+        view = self._test_view()
+        view._query_params['_count'] = True
+        view._parent_queryset_es = Mock(return_value=[1, 2])
+        view.get_es_object_ids = Mock(return_value=None)
+        assert view.get_collection_es() == 0
+        assert not mock_es().get_collection.called
+
     @patch('nefertari.elasticsearch.ES')
     def test_get_collection_es_parent_with_ids(self, mock_es):
         mock_es.settings.asbool.return_value = False
@@ -363,6 +501,94 @@ class TestESBaseView(ViewTestBase):
         mock_es().get_collection.assert_called_once_with(
             _limit=20, foo='bar', id=[1, 2])
 
+    @patch('ramses.aggregations.get_aggregation_fields')
+    @patch('nefertari.elasticsearch.ES')
+    def test_get_aggregations_es(self, mock_es, mock_fields):
+        mock_fields.return_value = ['status']
+        view = self._test_view()
+        view._query_params['_aggregate'] = 'status:terms'
+        view._parent_queryset_es = Mock(return_value=None)
+        view.Model = Mock(__name__='Foo')
+        result = view.get_aggregations_es()
+        mock_fields.assert_called_once_with(
+            view.Model, view.request, auth_enabled=view._auth_enabled)
+        mock_es.assert_called_once_with('Foo')
+        mock_es().aggregate.assert_called_once_with(
+            _limit=20, foo='bar',
+            _aggregations_params={
+                'status_terms': {'terms': {'field': 'status', 'size': 10}}
+            })
+        assert view._after_calls['index'] == []
+        assert result == mock_es().aggregate()
+
+    @patch('nefertari.elasticsearch.ES')
+    def test_aggregate_es_parent_ids(self, mock_es):
+        view = self._test_view()
+        view._parent_queryset_es = Mock(return_value=['obj1'])
+        view.get_es_object_ids = Mock(return_value=['1'])
+        view.Model = Mock(__name__='Foo')
+        params = {'foo': 'bar'}
+        view.aggregate_es({'a': 1}, params)
+        mock_es().aggregate.assert_called_once_with(
+            foo='bar', id=['1'], _aggregations_params={'a': 1})
+        assert params == {'foo': 'bar'}
+        assert 'id' not in view._query_params
+
+    @patch('ramses.aggregations.get_aggregation_fields')
+    @patch('nefertari.elasticsearch.ES')
+    def test_get_aggregations_es_empty_parent(self, mock_es, mock_fields):
+        mock_fields.return_value = ['status']
+        view = self._test_view()
+        view._query_params['_aggregate'] = 'status:terms'
+        view._parent_queryset_es = Mock(return_value=[])
+        view.Model = Mock(__name__='Foo')
+        assert view.get_aggregations_es() == {}
+        assert not mock_es().aggregate.called
+
+    def _denying_factory(self, decision):
+        from ramses.acl import BaseACL
+
+        class Factory(BaseACL):
+            item_model = 'Foo'
+
+            def __init__(self, request, es_based=False):
+                super(Factory, self).__init__(request=request)
+                self.es_based = es_based
+
+            def static_item_decision(self, principals, permission):
+                self.checked = (principals, permission)
+                return decision
+        return Factory
+
+    @patch('nefertari.elasticsearch.ES')
+    def test_get_collection_es_items_denied(self, mock_es):
+        view = self._test_view()
+        view._auth_enabled = True
+        view._factory = self._denying_factory(False)
+        view._parent_queryset_es = Mock(return_value=None)
+        assert view.get_collection_es() == []
+        assert not mock_es().get_collection.called
+
+    def test_items_denied_es(self):
+        view = self._test_view()
+        view._auth_enabled = True
+        view.request.effective_principals = ['system.Everyone']
+        view._factory = self._denying_factory(False)
+        assert view._items_denied_es()
+        view._factory = self._denying_factory(None)
+        assert not view._items_denied_es()
+        view._factory = self._denying_factory(True)
+        assert not view._items_denied_es()
+
+    def test_items_denied_es_not_applicable(self):
+        view = self._test_view()
+        view._factory = self._denying_factory(False)
+        view._auth_enabled = False
+        assert not view._items_denied_es()
+        view._auth_enabled = True
+        view._factory = Mock()
+        assert not view._items_denied_es()
+
     def test_get_item_es_no_parent(self):
         view = self._test_view()
         view._get_context_key = Mock(return_value=1)
@@ -401,6 +627,21 @@ class TestESBaseView(ViewTestBase):
             view.get_item_es(a=4)
         assert 'Foo(id=1) resource not found' in str(ex.value)
 
+    @patch('nefertari.elasticsearch.ES')
+    def test_get_items_es(self, mock_es):
+        view = self._test_view()
+        view.Model = Mock(__name__='Foo')
+        view._parent_queryset_es = Mock(return_value=['obj1', 'obj2'])
+        view.get_es_object_ids = Mock(return_value=['2', '3'])
+        view._viewable_items = Mock()
+        result = view.get_items_es(['1', '2'])
+        mock_es.assert_called_once_with('Foo')
+        mock_es().get_by_ids.assert_called_once_with(
+            [{'_type': 'Foo', '_id': '2'}], _limit=1)
+        view._viewable_items.assert_called_once_with(
+            ['1', '2'], mock_es().get_by_ids(), es_based=True)
+        assert result == view._viewable_items()
+
     def test_get_item_es_callable_context(self):
         view = self._test_view()
         view._get_context_key = Mock(return_value=1)
@@ -424,6 +665,44 @@ class TestESCollectionView(ViewTestBase):
         view.get_collection_es.assert_called_once_with()
         assert resp == view.get_collection_es()
 
+    def test_index_head(self):
+        view = self._test_view()
+        view.request.method = 'HEAD'
+        view.request.response.headers = {}
+        view.get_collection_es = Mock(return_value=7)
+        resp = view.index(foo=1)
+        view.get_collection_es.assert_called_once_with()
+        assert view._query_params['_count']
+        assert resp.headers['X-Total-Count'] == '7'
+
+    def test_show_head(self):
+        view = self._test_view()
+        view.request.method = 'HEAD'
+        view.get_item_es = Mock()
+        resp = view.show(foo=1)
+        view.get_item_es.assert_called_once_with(foo=1)
+        assert resp is view.request.response
+
+    def test_index_aggregate(self):
+        view = self._test_view()
+        view._query_params['_aggregate'] = 'status:terms'
+        view.get_collection_es = Mock()
+        view.get_aggregations_es = Mock()
+        resp = view.index(foo=1)
+        view.get_aggregations_es.assert_called_once_with()
+        assert not view.get_collection_es.called
+        assert resp == view.get_aggregations_es()
+
+    def test_index_ids(self):
+        view = self._test_view()
+        view._query_params['_ids'] = '1'
+        view.get_collection_es = Mock()
+        view.get_items_es = Mock()
+        resp = view.index(foo=1)
+        view.get_items_es.assert_called_once_with(['1'])
+        assert not view.get_collection_es.called
+        assert resp == view.get_items_es()
+
     def test_show(self):
         view = self._test_view()
         view.get_item_es = Mock()
@@ -538,6 +817,33 @@ class TestItemAttributeView(ViewTestBase):
             request=view.request)
         assert resp == obj.settings
 
+    @patch('ramses.views.atomic_update_iterables')
+    @patch('ramses.views.supports_atomic_update')
+    def test_create_atomic(self, mock_supports, mock_update):
+        mock_supports.return_value = True
+        view = self._test_view()
+        view.atomic_iterables = True
+        view.get_item = Mock()
+        resp = view.create(foo=1)
+        obj = view.get_item()
+        mock_supports.assert_called_once_with(type(obj), 'settings')
+        mock_update.assert_called_once_with(
+            obj, {'foo2': 'bar2'}, 'settings', unique=True,
+            value_type=None, request=view.request)
+        assert not obj.update_iterables.called
+        assert resp == mock_update()
+
+    @patch('ramses.views.atomic_update_iterables')
+    @patch('ramses.views.supports_atomic_update')
+    def test_create_atomic_not_supported(self, mock_supports, mock_update):
+        mock_supports.return_value = False
+        view = self._test_view()
+        view.atomic_iterables = True
+        view.get_item = Mock()
+        view.create(foo=1)
+        assert not mock_update.called
+        assert view.get_item().update_iterables.call_count == 1
+
 
 class TestItemSingularView(ViewTestBase):
     view_cls = views.ItemSingularView
@@ -638,6 +944,23 @@ class TestRestViewGeneration(object):
         with pytest.raises(JHTTPMethodNotAllowed):
             view.index()
 
+    def test_generate_rest_view_shared_base(self):
+        config = config_mock()
+
+        def generate(model_cls='foo', attrs=('show',)):
+            return views.generate_rest_view(
+                config, model_cls=model_cls, attrs=list(attrs),
+                es_based=True)
+
+        view_cls = generate()
+        other_cls = generate()
+        assert view_cls is not other_cls
+        assert view_cls.__bases__ == other_cls.__bases__
+        assert generate(model_cls='bar').__bases__ != view_cls.__bases__
+        assert generate(attrs=['index']).__bases__ != view_cls.__bases__
+        view_cls._resource = 'resource'
+        assert getattr(other_cls, '_resource', None) != 'resource'
+
     def test_singular_view(self):
         config = config_mock()
         view_cls = views.generate_rest_view(
@@ -653,6 +976,15 @@ class TestRestViewGeneration(object):
             es_based=True, attr_view=True, singular=False)
         view_cls._json_encoder = 'foo'
         assert issubclass(view_cls, views.ItemAttributeView)
+        assert not view_cls.atomic_iterables
+
+    def test_attribute_view_atomic_iterables(self):
+        config = config_mock()
+        config.registry.atomic_iterables = True
+        view_cls = views.generate_rest_view(
+            config, model_cls='foo', attrs=['show'],
+            es_based=True, attr_view=True, singular=False)
+        assert view_cls.atomic_iterables
 
     def test_escollection_view(self):
         config = config_mock()
@@ -700,3 +1032,46 @@ class TestRestViewGeneration(object):
             es_based=False, attr_view=False, singular=False)
         assert issubclass(view_cls, views.SetObjectACLMixin)
         assert issubclass(view_cls, ACLFilterViewMixin)
+
+
+class TestAllowedMethods(object):
+
+    def test_get_allowed_methods(self):
+        collection, item = views.get_allowed_methods(
+            {'index', 'create', 'show', 'delete', 'item_options'})
+        assert collection == {'GET', 'HEAD', 'POST'}
+        assert item == {'GET', 'HEAD', 'DELETE', 'OPTIONS'}
+
+    def test_get_allowed_methods_singular(self):
+        collection, item = views.get_allowed_methods(
+            {'create', 'show'}, singular=True)
+        assert collection == item == {'GET', 'HEAD', 'POST'}
+
+    def _event(self, method, route_name='stories'):
+        request = Mock(method=method)
+        request.matched_route.name = route_name
+        request.registry.allowed_methods = {
+            'stories': frozenset(['GET', 'POST']),
+            'story': frozenset(['GET', 'DELETE']),
+        }
+        return Mock(request=request)
+
+    def test_reject_not_allowed_methods_allowed(self):
+        views.reject_not_allowed_methods(self._event('POST'))
+        views.reject_not_allowed_methods(self._event('DELETE', 'story'))
+
+    def test_reject_not_allowed_methods_collection(self):
+        with pytest.raises(JHTTPMethodNotAllowed) as ex:
+            views.reject_not_allowed_methods(self._event('DELETE'))
+        assert ex.value.headers['Allow'] == 'GET, POST'
+
+    def test_reject_not_allowed_methods_item(self):
+        with pytest.raises(JHTTPMethodNotAllowed) as ex:
+            views.reject_not_allowed_methods(self._event('POST', 'story'))
+        assert ex.value.headers['Allow'] == 'DELETE, GET'
+
+    def test_reject_not_allowed_methods_unknown_route(self):
+        views.reject_not_allowed_methods(self._event('PATCH', 'other'))
+        event = self._event('PATCH')
+        event.request.matched_route = None
+        views.reject_not_allowed_methods(event)